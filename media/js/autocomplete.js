@@ -1,7 +1,7 @@
 /* This file is part of the plan timetable generator, see LICENSE for details. */
 
 (function() {
-  var xhr, cache = {};
+  var xhr, catalog, cache = {}, limit = 10;
 
   function fetch(url, callback) {
     try {
@@ -18,13 +18,75 @@
     xhr.send();
   }
 
+  function load(url) {
+    var request = new XMLHttpRequest();
+    request.onreadystatechange = function() {
+      if (this.readyState == 4 && this.status == 200) {
+        catalog = JSON.parse(this.responseText);
+      }
+    };
+    request.open('GET', url, true);
+    request.send();
+  }
+
+  function alias(course, word) {
+    for (var i = 0; i < course[3].length; i++) {
+      if (course[3][i].toLowerCase() == word) {
+        return true;
+      }
+    }
+    return false;
+  }
+
+  function score(course, word) {
+    var code = course[0].toLowerCase(), name = course[1].toLowerCase();
+    if (code == word) {
+      return 8;
+    } else if (code.indexOf(word) == 0 || alias(course, word)) {
+      return 4;
+    } else if ((' ' + name).indexOf(' ' + word) >= 0) {
+      return 2;
+    } else if (code.indexOf(word) >= 0 || name.indexOf(word) >= 0) {
+      return 1;
+    }
+    return 0;
+  }
+
+  function filter(term, location) {
+    var words = term.split(/\s+/), matches = [];
+    location = parseInt(location, 10);
+
+    for (var i = 0; i < catalog.length; i++) {
+      var course = catalog[i], total = 0;
+      if (!isNaN(location) && course[2].indexOf(location) < 0) {
+        continue;
+      }
+      for (var j = 0; j < words.length; j++) {
+        var s = score(course, words[j]);
+        if (!s) {
+          break;
+        }
+        total += s;
+      }
+      if (j == words.length) {
+        matches.push([total, course]);
+      }
+    }
+
+    // Catalog is sorted by code, so ties keep that order.
+    matches.sort(function(a, b) { return b[0] - a[0]; });
+    return matches.slice(0, limit).map(function(m) { return m[1]; });
+  }
+
   function source(term, callback) {
     term = term.split(/\s*,\s*/).pop().replace(/^\s+|\s+/g, '').toLowerCase();
     var location = document.getElementById('location');
     var query = '?q=' + encodeURIComponent(term) +
                 '&l=' + encodeURIComponent(location !== null ? location.value : '');
 
-    if (cache[query]) {
+    if (catalog && term.length >= 2) {
+      callback(filter(term, location !== null ? location.value : ''));
+    } else if (cache[query]) {
       callback(cache[query]);
     } else if (term.length >= 3) {
       var url = this.selector.getAttribute('data-autocomplete');
@@ -57,8 +119,13 @@
 
   function init() {
     document.removeEventListener('DOMContentLoaded', arguments.callee, false);
+    var input = document.getElementById('course');
+    if (input !== null && input.getAttribute('data-catalog')) {
+      // Filter locally once the catalog is in, until then ask the server.
+      load(input.getAttribute('data-catalog'));
+    }
     new autoComplete({
-      selector: document.getElementById('course'),
+      selector: input,
       minChars: 0,
       cache: false,
       source: source,
@@ -0,0 +1,101 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+import gzip
+import hashlib
+import json
+import StringIO
+
+from django.conf import settings
+from django.core import cache
+from django.db import transaction
+
+from plan.common import utils
+from plan.common.models import Course, Semester, Subscription
+
+VERSION_KEY = 'course-catalog-version:%s:%s'
+CATALOG_KEY = 'course-catalog:%s:%s:%s:%s'
+
+
+class CourseCatalog(object):
+    """Compressed JSON bundle of a semester's courses for client side search.
+
+       The digest changes with the content, so responses for a given digest
+       can be cached forever. Bundles are regenerated after scrapers change
+       the semester's courses, and every TIMETABLE_CATALOG_TIMEOUT seconds
+       to pick up new aliases.
+    """
+
+    def __init__(self, content):
+        self.digest = hashlib.sha1(content).hexdigest()[:12]
+        self.size = len(content)
+
+        buf = StringIO.StringIO()
+        # Fixed mtime so the same content always compresses the same way.
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as compressed:
+            compressed.write(content)
+        self.compressed = buf.getvalue()
+
+    @property
+    def content(self):
+        return gzip.GzipFile(
+            fileobj=StringIO.StringIO(self.compressed)).read()
+
+    @classmethod
+    def build(cls, year, semester_type):
+        qs = Course.objects.filter(semester__year__exact=year,
+                                   semester__type__exact=semester_type)
+
+        locations = {}
+        through = Course.locations.through.objects.filter(course__in=qs)
+        for course_id, location_id in through.values_list(
+                'course_id', 'location_id').order_by('location_id'):
+            locations.setdefault(course_id, []).append(location_id)
+
+        # Aliases students have given courses, matched like the server side
+        # search does.
+        aliases = {}
+        subscriptions = Subscription.objects.filter(course__in=qs).exclude(
+            alias='')
+        for course_id, alias in subscriptions.values_list(
+                'course_id', 'alias').distinct().order_by('alias'):
+            aliases.setdefault(course_id, []).append(alias)
+
+        courses = []
+        for course_id, code, name in qs.order_by('code', 'id').values_list(
+                'id', 'code', 'name'):
+            courses.append([code, name or u'', locations.get(course_id, []),
+                            aliases.get(course_id, [])])
+
+        return cls(json.dumps(courses, separators=(',', ':')))
+
+    @classmethod
+    def get(cls, year, semester_type):
+        """Get catalog for semester, building it if missing or outdated.
+
+           Scrapes usually run in another process than the web server, so
+           besides the version the key includes the semester's last import,
+           which works even when the cache isn't shared between processes.
+        """
+        key = VERSION_KEY % (year, semester_type)
+        version = cache.cache.get(key)
+        if version is None:
+            version = utils.initial_version()
+            cache.cache.set(key, version, None)
+
+        last_import = Semester.objects.filter(
+            year=year, type=semester_type).values_list(
+                'last_import', flat=True).first()
+
+        key = CATALOG_KEY % (version, last_import and last_import.isoformat(),
+                             year, semester_type)
+        catalog = cache.cache.get(key)
+        if catalog is None:
+            catalog = cls.build(year, semester_type)
+            cache.cache.set(key, catalog, settings.TIMETABLE_CATALOG_TIMEOUT)
+        return catalog
+
+    @staticmethod
+    def invalidate(year, semester_type):
+        key = VERSION_KEY % (year, semester_type)
+        utils.bump_version(key)
+        transaction.on_commit(lambda: utils.bump_version(key))
@@ -0,0 +1,204 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Database native full-text search over course codes and names.
+
+   Backends are picked based on the database vendor using the
+   TIMETABLE_FULLTEXT_BACKENDS setting. Vendors without a backend, or
+   databases where the index could not be created, fall back to the plain
+   icontains search in CourseManager.
+"""
+
+import importlib
+
+from django.conf import settings
+from django.db import connection
+from django.db import utils as db_utils
+
+from plan.common.utils import split_search
+
+
+class SearchBackend(object):
+    def __init__(self):
+        self._available = None
+
+    def create(self, cursor):
+        """Create index, returning False if the database can't support it."""
+        raise NotImplementedError
+
+    def drop(self, cursor):
+        raise NotImplementedError
+
+    def exists(self, cursor):
+        raise NotImplementedError
+
+    def available(self):
+        """Check if the index exists, only asking the database once."""
+        if self._available is None:
+            self._available = self.exists(connection.cursor())
+        return self._available
+
+    def sync(self, semester_id=None):
+        """Update index after courses have been changed.
+
+           Leaving out semester_id resyncs every course.
+        """
+        pass
+
+    def match(self, words):
+        """SQL condition and params for courses matching all words."""
+        raise NotImplementedError
+
+    def rank(self, words):
+        """SQL expression and params for ordering matches, best first."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(SearchBackend):
+    table = 'common_course_fts'
+
+    def create(self, cursor):
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE %s USING fts5(
+                    code, name, prefix='2 3')''' % self.table)
+        except db_utils.OperationalError:
+            # SQLite has been built without FTS5.
+            return False
+        self._available = None
+        return True
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS %s' % self.table)
+        self._available = None
+
+    def exists(self, cursor):
+        cursor.execute('''
+            SELECT COUNT(*) FROM sqlite_master
+            WHERE type = 'table' AND name = %s''', [self.table])
+        return cursor.fetchone()[0] > 0
+
+    def sync(self, semester_id=None):
+        if not self.available():
+            return
+
+        if semester_id is None:
+            where, params = '', []
+        else:
+            where, params = 'WHERE semester_id = %s', [semester_id]
+
+        cursor = connection.cursor()
+        cursor.execute('''
+            DELETE FROM %s WHERE rowid IN (
+                SELECT id FROM common_course %s)''' % (self.table, where),
+            params)
+        # Courses that have been deleted since the last sync.
+        cursor.execute('''
+            DELETE FROM %s WHERE rowid NOT IN (
+                SELECT id FROM common_course)''' % self.table)
+        cursor.execute('''
+            INSERT INTO %s (rowid, code, name)
+            SELECT id, code, COALESCE(name, '')
+            FROM common_course %s''' % (self.table, where), params)
+
+    def query(self, words):
+        # Quote each word so user input can't use FTS query syntax, and
+        # match as prefix of any token in code or name.
+        return u' '.join(u'"%s"*' % w.replace(u'"', u'""') for w in words)
+
+    def match(self, words):
+        sql = 'common_course.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)'
+        return sql % (self.table, self.table), [self.query(words)]
+
+    def rank(self, words):
+        sql = '''(SELECT rank FROM %(table)s WHERE %(table)s MATCH %%s
+                  AND %(table)s.rowid = common_course.id)'''
+        return sql % {'table': self.table}, [self.query(words)]
+
+
+class PostgresBackend(SearchBackend):
+    index = 'common_course_fts'
+    document = ("to_tsvector('simple', common_course.code || ' ' || "
+                "COALESCE(common_course.name, ''))")
+
+    def create(self, cursor):
+        # Expression index, so there is nothing to sync.
+        cursor.execute('CREATE INDEX %s ON common_course USING gin (%s)' %
+                       (self.index, self.document))
+        self._available = None
+        return True
+
+    def drop(self, cursor):
+        cursor.execute('DROP INDEX IF EXISTS %s' % self.index)
+        self._available = None
+
+    def exists(self, cursor):
+        cursor.execute('SELECT COUNT(*) FROM pg_indexes WHERE indexname = %s',
+                       [self.index])
+        return cursor.fetchone()[0] > 0
+
+    def query(self, words):
+        # Strip tsquery syntax and match as prefix of any lexeme.
+        terms = []
+        for word in words:
+            for term in word.split():
+                term = u''.join(c for c in term if c.isalnum())
+                if term:
+                    terms.append(term + u':*')
+        return u' & '.join(terms)
+
+    def match(self, words):
+        sql = "%s @@ to_tsquery('simple', %%s)" % self.document
+        return sql, [self.query(words)]
+
+    def rank(self, words):
+        sql = "-ts_rank(%s, to_tsquery('simple', %%s))" % self.document
+        return sql, [self.query(words)]
+
+
+_backends = {}
+
+
+def get_backend():
+    """Backend for the current database, or None if full-text is disabled."""
+    path = settings.TIMETABLE_FULLTEXT_BACKENDS.get(connection.vendor)
+    if not path:
+        return None
+
+    if path not in _backends:
+        module, cls = path.rsplit('.', 1)
+        _backends[path] = getattr(importlib.import_module(module), cls)()
+    return _backends[path]
+
+
+def search(qs, query):
+    """Apply full-text search to a course queryset.
+
+       Courses where a subscription alias equals the query are included as
+       well. Returns None when full-text search is not available so callers
+       can fall back to other means.
+    """
+    backend = get_backend()
+    if not backend or not backend.available():
+        return None
+
+    words = [w for w in split_search(query) if w.strip()]
+    if not words:
+        return None
+
+    match, match_params = backend.match(words)
+    rank, rank_params = backend.rank(words)
+
+    where = '''(%s OR common_course.id IN (
+        SELECT course_id FROM common_subscription WHERE alias = %%s))''' % match
+
+    return qs.extra(where=[where],
+                    params=match_params + [query.strip()],
+                    select={'rank': rank},
+                    select_params=rank_params,
+                    order_by=['rank', 'code'])
+
+
+def sync(semester_id=None):
+    backend = get_backend()
+    if backend:
+        backend.sync(semester_id)
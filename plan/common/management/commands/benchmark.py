@@ -0,0 +1,99 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+import timeit
+
+from django.core.management import base as management
+
+
+class Command(management.LabelCommand):
+    help = ('Time hot code paths against synthetic data.\n\n'
+            'Available benchmarks are:\n  timetable\n  pdf')
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+
+        parser.add_argument('--count', action='store', dest='count', type=int,
+                            default=500, help='number of lectures to use')
+        parser.add_argument('--repeat', action='store', dest='repeat', type=int,
+                            default=20, help='number of runs to time')
+        parser.add_argument('--days', action='store', dest='days', type=int,
+                            default=None, help='number of days to spread lectures over')
+        parser.add_argument('--seed', action='store', dest='seed', type=int,
+                            default=0, help='seed for synthetic data')
+
+    def handle_label(self, label, **options):
+        try:
+            benchmark = getattr(self, 'benchmark_%s' % label)
+        except AttributeError:
+            raise management.CommandError('Unknown benchmark: %s' % label)
+        benchmark(**options)
+
+    def report(self, name, func, repeat):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        self.stdout.write('%-30s %8.2f ms' % (name, best * 1000))
+
+    def benchmark_timetable(self, count, repeat, seed, days, **options):
+        from plan.common.tests.benchmarks import ReferenceTimetable, random_lectures
+        from plan.common.timetable import Timetable
+
+        lectures = random_lectures(count, seed=seed, days=days)
+
+        def layout(cls):
+            def run():
+                timetable = cls(lectures)
+                timetable.place_lectures()
+                timetable.do_expansion()
+            return run
+
+        self.stdout.write('Timetable layout of %d lectures:' % count)
+        self.report('reference', layout(ReferenceTimetable), repeat)
+        self.report('current', layout(Timetable), repeat)
+
+    def benchmark_pdf(self, count, repeat, seed, days, **options):
+        import random
+        import StringIO
+
+        from plan.common.models import Course, LectureType
+        from plan.common.tests.benchmarks import random_lectures
+        from plan.common.timetable import Timetable
+        from plan.common.utils import ColorMap
+        from plan.pdf import views
+
+        rand = random.Random(seed)
+        courses = [Course(id=i, code='COURSE%d' % i) for i in xrange(10)]
+        types = [LectureType(name='Lecture', optional=False),
+                 LectureType(name='Lab/Exercise', optional=True)]
+
+        rooms = {}
+        lectures = random_lectures(count, seed=seed, days=days)
+        for lecture in lectures:
+            lecture.course = rand.choice(courses)
+            lecture.course_id = lecture.course.id
+            lecture.alias = None
+            lecture.type = rand.choice(types)
+            rooms[lecture.id] = ['Room %d' % rand.randrange(100)
+                                 for i in xrange(rand.randrange(1, 3))]
+
+        timetable = Timetable(lectures)
+        timetable.place_lectures()
+        timetable.do_expansion()
+        timetable.insert_times()
+
+        color_map = ColorMap(hex=True)
+
+        def render(renderer, size):
+            def run():
+                views.render(StringIO.StringIO(), timetable, u'Benchmark',
+                             rooms, color_map, size, renderer=renderer)
+            return run
+
+        self.stdout.write('PDF rendering of %d lectures:' % count)
+        for size in ('A4', 'A5', 'A6', 'A7'):
+            for renderer in ('table', 'canvas'):
+                name = '%s %s' % (renderer, size)
+                try:
+                    self.report(name, render(renderer, size), repeat)
+                except ZeroDivisionError:
+                    # KeepInFrame gives up once sub columns are narrower
+                    # than the table's cell padding.
+                    self.stdout.write('%-30s   failed' % name)
@@ -0,0 +1,32 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from django.core.management import base as management
+
+from plan.common.models import Semester, SemesterStats, SignupHistory
+
+
+class Command(management.BaseCommand):
+    help = 'Rebuild subscription statistics shown on the front page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-y', '--year', action='store', dest='year', type=int,
+                            help='year to rebuild, default: all semesters')
+        parser.add_argument('-t', '--type', action='store', dest='type',
+                            choices=dict(Semester.SEMESTER_TYPES).keys(),
+                            help='term to rebuild')
+
+    def handle(self, **options):
+        if not options['year'] and not options['type']:
+            SemesterStats.objects.rebuild()
+            SignupHistory.objects.rebuild()
+            self.stdout.write('Rebuilt statistics for all semesters.')
+            return
+
+        try:
+            semester = Semester.objects.get(year=options['year'],
+                                            type=options['type'])
+        except Semester.DoesNotExist:
+            raise management.CommandError('Semester not found.')
+
+        SemesterStats.objects.rebuild(semester.pk)
+        self.stdout.write('Rebuilt statistics for %s.' % semester)
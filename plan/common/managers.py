@@ -2,9 +2,14 @@
 
 import datetime
 
+from django.apps import apps
+from django.db import IntegrityError
 from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.db.models import Max, Min
 
+from plan.common import fulltext
 from plan.common.utils import build_search
 
 
@@ -13,9 +18,9 @@ class LectureManager(models.Manager):
         """
             Get all lectures for subscription during given period.
 
-            To do this we need to pull in a bunch of extra tables and manualy join them
-            in the where cluase. The first element in the custom where is the important
-            one that limits our results, the rest are simply meant for joining.
+            Lectures for a slug are found through the materialized
+            SubscriptionLecture rows, which already take groups and excludes
+            into account, so no DISTINCT or subqueries are needed.
         """
 
         if not slug and not course:
@@ -23,36 +28,18 @@ class LectureManager(models.Manager):
         elif slug and course:
             raise Exception('Invalid invocation of get_lectures')
 
-        where = [
-            'common_subscription_groups.group_id = common_group.id',
-            'common_subscription_groups.subscription_id = common_subscription.id',
-            'common_group.id = common_lecture_groups.group_id',
-            'common_lecture_groups.lecture_id = common_lecture.id'
-        ]
-        tables = [
-            'common_subscription_groups',
-            'common_group',
-            'common_lecture_groups'
-        ]
-
         select = {
             'alias': 'common_subscription.alias',
-            'exclude': '''
-                EXISTS (SELECT 1
-                 FROM common_subscription_exclude WHERE
-                 common_subscription_exclude.subscription_id = common_subscription.id AND
-                 common_subscription_exclude.lecture_id = common_lecture.id)''',
+            'exclude': 'common_subscriptionlecture.excluded',
             'show_week': '%s',
         }
 
         if week:
-            select['show_week'] = '''
-                EXISTS (SELECT 1 FROM common_week w WHERE
-                    w.lecture_id = common_lecture.id AND w.number = %s)'''
+            select['show_week'] = '(common_lecture.week_mask & %s) != 0'
 
         if slug:
             filter_kwargs = {
-                'course__subscription__student__slug': slug,
+                'subscriptionlecture__subscription__student__slug': slug,
                 'course__semester__year__exact': year,
                 'course__semester__type__exact': semester_type,
             }
@@ -62,8 +49,6 @@ class LectureManager(models.Manager):
                 'course__semester__year__exact': year,
                 'course__semester__type__exact': semester_type,
             }
-            where = []
-            tables = []
             select['alias'] = 'NULL'
             select['exclude'] = 'False'
 
@@ -79,12 +64,11 @@ class LectureManager(models.Manager):
             'type__name',
         ]
 
-        params = [week or True]
+        params = [1 << int(week) if week else True]
 
         return list(self.get_queryset().filter(**filter_kwargs)
-                    .distinct()
                     .select_related(*related)
-                    .extra(where=where, tables=tables, select=select, select_params=params)
+                    .extra(select=select, select_params=params)
                     .order_by(*order))
 
 
@@ -151,17 +135,27 @@ class CourseManager(models.Manager):
         return cursor.fetchall()
 
     def search(self, year, semester_type, query, limit=10, location=None):
-        search_filter = build_search(query, ['code__icontains',
-                                             'name__icontains',
-                                             'subscription__alias__exact'])
+        """Find courses matching query, using full-text search if possible.
 
+           With full-text search words match as prefixes of words in code or
+           name and results are ordered by relevance, otherwise words can
+           match anywhere and results are ordered by code.
+        """
         qs = self.get_queryset()
-        qs = qs.filter(search_filter)
         qs = qs.filter(semester__year__exact=year,
                        semester__type__exact=semester_type)
         if location:
             qs = qs.filter(locations__id=location)
 
+        matches = fulltext.search(qs, query)
+        if matches is not None:
+            return matches[:limit]
+
+        search_filter = build_search(query, ['code__icontains',
+                                             'name__icontains',
+                                             'subscription__alias__exact'])
+
+        qs = qs.filter(search_filter)
         qs = qs.distinct()
         qs = qs.order_by('code')
 
@@ -178,6 +172,321 @@ class SubscriptionManager(models.Manager):
                 'course',
             ).order_by('student__slug', 'course__code')
 
+    def get_last_modified(self, year, semester_type, slug, lectures=True,
+                          exams=True):
+        """Find when data shown in a student's schedule last changed.
+
+           Only aggregates are fetched, so this stays cheap enough to run
+           before deciding if a response needs to be rendered at all.
+        """
+        subscriptions = self.get_subscriptions(year, semester_type, slug)
+
+        modified = subscriptions.aggregate(value=Max('modified'))['value']
+        if modified is None:
+            return None
+
+        fields = []
+        if lectures:
+            fields.append('course__lecture__last_import')
+        if exams:
+            fields.append('course__exam__last_import')
+
+        # Aggregate one field at a time as joining both lectures and exams in
+        # the same query would multiply the number of rows to look at.
+        for field in fields:
+            value = subscriptions.aggregate(value=Max(field))['value']
+            if value is not None:
+                modified = max(modified, value)
+
+        return modified
+
+    def get_last_modified_by_slug(self, year, semester_type):
+        """Same as get_last_modified() for every student in a semester."""
+        subscriptions = self.get_queryset().filter(
+            course__semester__year__exact=year,
+            course__semester__type__exact=semester_type)
+
+        modified = {}
+        for field in ('modified', 'course__lecture__last_import',
+                      'course__exam__last_import'):
+            rows = subscriptions.values_list('student__slug').annotate(
+                value=Max(field)).order_by()
+            for slug, value in rows:
+                if value is not None:
+                    modified[slug] = max(modified.get(slug, value), value)
+        return modified
+
+    def touch(self, year, semester_type, slug):
+        """Mark a student's subscriptions as modified.
+
+           Needed when groups or excludes change as these are not stored on
+           the subscription itself.
+        """
+        return self.get_subscriptions(year, semester_type, slug).update(
+            modified=datetime.datetime.now())
+
+
+class SubscriptionLectureManager(models.Manager):
+    REFRESH_SQL = '''
+        INSERT INTO common_subscriptionlecture
+            (subscription_id, lecture_id, excluded)
+        SELECT DISTINCT s.id, l.id, EXISTS (
+            SELECT 1 FROM common_subscription_exclude e
+            WHERE e.subscription_id = s.id AND e.lecture_id = l.id)
+        FROM common_subscription s
+        JOIN common_subscription_groups sg ON (sg.subscription_id = s.id)
+        JOIN common_lecture_groups lg ON (lg.group_id = sg.group_id)
+        JOIN common_lecture l ON (l.id = lg.lecture_id AND l.course_id = s.course_id)
+        WHERE %s'''
+
+    def refresh(self, subscriptions=None, lectures=None):
+        """Rebuild rows for the given subscriptions and/or lectures.
+
+           Both arguments can be querysets or lists of objects or ids, and
+           leaving out both rebuilds the whole table.
+        """
+        qs = self.get_queryset()
+        where, params = ['1 = 1'], []
+
+        for column, values in (('s.id', subscriptions), ('l.id', lectures)):
+            if values is None:
+                continue
+            elif hasattr(values, 'query'):
+                values = values.order_by().values_list('pk', flat=True)
+                sql, values_params = values.query.sql_with_params()
+            else:
+                values_params = [getattr(v, 'pk', v) for v in values]
+                if not values_params:
+                    return
+                sql = ', '.join(['%s'] * len(values_params))
+
+            where.append('%s IN (%s)' % (column, sql))
+            params.extend(values_params)
+
+        if subscriptions is not None:
+            qs = qs.filter(subscription__in=subscriptions)
+        if lectures is not None:
+            qs = qs.filter(lecture__in=lectures)
+
+        with transaction.atomic():
+            qs.delete()
+            cursor = connection.cursor()
+            cursor.execute(self.REFRESH_SQL % ' AND '.join(where), params)
+
+
+class SemesterStatsManager(models.Manager):
+    """Keeps subscription statistics rolled up per semester and course."""
+
+    def rebuild(self, semester_id=None):
+        """Recompute rollup from scratch, for all semesters by default."""
+        if semester_id is None:
+            cursor = connection.cursor()
+            cursor.execute('SELECT id FROM common_semester')
+            semester_ids = [row[0] for row in cursor.fetchall()]
+        else:
+            semester_ids = [semester_id]
+
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for semester_id in semester_ids:
+                cursor.execute('''
+                    DELETE FROM common_coursestats WHERE semester_id = %s''',
+                    [semester_id])
+                cursor.execute('''
+                    INSERT INTO common_coursestats
+                        (course_id, semester_id, subscription_count)
+                    SELECT c.id, c.semester_id, COUNT(*)
+                    FROM common_subscription s
+                    JOIN common_course c ON (c.id = s.course_id)
+                    WHERE c.semester_id = %s
+                    GROUP BY c.id, c.semester_id''', [semester_id])
+
+                cursor.execute('''
+                    DELETE FROM common_semesterstats WHERE semester_id = %s''',
+                    [semester_id])
+                cursor.execute('''
+                    INSERT INTO common_semesterstats
+                        (semester_id, slug_count, subscription_count, course_count)
+                    SELECT %s, COUNT(DISTINCT s.student_id), COUNT(*),
+                           COUNT(DISTINCT c.name)
+                    FROM common_subscription s
+                    JOIN common_course c ON (c.id = s.course_id)
+                    WHERE c.semester_id = %s''', [semester_id, semester_id])
+
+    def get_stats(self, semester_id):
+        """Get rollup for semester, building it the first time it is used."""
+        try:
+            return self.get_queryset().get(semester_id=semester_id)
+        except self.model.DoesNotExist:
+            self.rebuild(semester_id)
+            return self.get_queryset().get(semester_id=semester_id)
+
+    def update_stats(self, semester_id, slug, course_ids, delta):
+        """Apply subscriptions that have just been added or removed.
+
+           Call with delta set to 1 after adding and -1 after removing
+           subscriptions to course_ids for the student.
+        """
+        course_ids = list(course_ids)
+        if not course_ids:
+            return
+
+        with transaction.atomic():
+            if not self.get_queryset().filter(semester_id=semester_id).exists():
+                # Rebuilding sees the change, so there is nothing to apply.
+                self.rebuild(semester_id)
+                return
+
+            cursor = connection.cursor()
+            placeholders = ', '.join(['%s'] * len(course_ids))
+
+            cursor.execute('''
+                UPDATE common_coursestats
+                SET subscription_count = subscription_count + %%s
+                WHERE course_id IN (%s)''' % placeholders, [delta] + course_ids)
+            if delta > 0:
+                cursor.execute('''
+                    INSERT INTO common_coursestats
+                        (course_id, semester_id, subscription_count)
+                    SELECT c.id, c.semester_id, 1 FROM common_course c
+                    WHERE c.id IN (%s) AND c.id NOT IN (
+                        SELECT course_id FROM common_coursestats)''' % placeholders,
+                    course_ids)
+
+            # Courses going from zero to one subscription or back only change
+            # the course count if no other course has the same name.
+            crossed = 1 if delta > 0 else 0
+            cursor.execute('''
+                SELECT COUNT(DISTINCT c.name) FROM common_course c
+                JOIN common_coursestats cs ON (cs.course_id = c.id)
+                WHERE c.id IN (%s) AND cs.subscription_count = %%s
+                AND NOT EXISTS (
+                    SELECT 1 FROM common_course o
+                    JOIN common_coursestats os ON (os.course_id = o.id)
+                    WHERE o.semester_id = c.semester_id AND o.name = c.name
+                    AND os.subscription_count > 0 AND NOT (
+                        o.id IN (%s) AND os.subscription_count = %%s))''' % (
+                        placeholders, placeholders),
+                course_ids + [crossed] + course_ids + [crossed])
+            course_delta = cursor.fetchone()[0] * delta
+
+            # The student appeared or disappeared if the courses we just
+            # changed are all there is for this semester.
+            cursor.execute('''
+                SELECT COUNT(*) FROM common_subscription s
+                JOIN common_student st ON (st.id = s.student_id)
+                JOIN common_course c ON (c.id = s.course_id)
+                WHERE st.slug = %s AND c.semester_id = %s''', [slug, semester_id])
+            remaining = cursor.fetchone()[0]
+            if delta > 0:
+                slug_delta = int(remaining == len(course_ids))
+            else:
+                slug_delta = -int(remaining == 0)
+
+            cursor.execute('''
+                UPDATE common_semesterstats
+                SET slug_count = slug_count + %s,
+                    subscription_count = subscription_count + %s,
+                    course_count = course_count + %s
+                WHERE semester_id = %s''',
+                [slug_delta, delta * len(course_ids), course_delta, semester_id])
+
+    def get_top_courses(self, semester_id, limit):
+        cursor = connection.cursor()
+        cursor.execute('''
+            SELECT cs.subscription_count, c.id, c.code, c.name
+            FROM common_coursestats cs
+            JOIN common_course c ON (c.id = cs.course_id)
+            WHERE cs.semester_id = %s AND cs.subscription_count > 0
+            ORDER BY cs.subscription_count DESC, c.code
+            LIMIT %s''', [semester_id, limit])
+        return cursor.fetchall()
+
+
+class SignupHistoryManager(models.Manager):
+    """Daily counts of students signing up for each semester."""
+
+    def record(self, semester_id, slug, date=None):
+        """Count student as signed up for semester on date, default today.
+
+           Only the first signup counts, students that remove all their
+           courses and come back later are not counted again.
+        """
+        Signup = apps.get_model('common', 'Signup')
+        date = date or datetime.date.today()
+
+        try:
+            with transaction.atomic():
+                Signup.objects.create(
+                    slug=slug, semester_id=semester_id, date=date)
+        except IntegrityError:
+            return
+
+        qs = self.get_queryset().filter(semester_id=semester_id, date=date)
+        if qs.update(count=models.F('count') + 1):
+            return
+
+        try:
+            with transaction.atomic():
+                self.get_queryset().create(
+                    semester_id=semester_id, date=date, count=1)
+        except IntegrityError:
+            # Someone else created the row first.
+            qs.update(count=models.F('count') + 1)
+
+    def rebuild(self):
+        """Recompute history from recorded signups.
+
+           Students with subscriptions but no signup, for instance from
+           before signups were recorded, get one from their first
+           subscription.
+        """
+        Signup = apps.get_model('common', 'Signup')
+        subscriptions = apps.get_model('common', 'Subscription').objects
+
+        with transaction.atomic():
+            known = set(Signup.objects.values_list('slug', 'semester'))
+            first = subscriptions.values(
+                'student__slug', 'course__semester').annotate(
+                    first=Min('added')).values_list(
+                        'student__slug', 'course__semester', 'first')
+            Signup.objects.bulk_create(
+                Signup(slug=slug, semester_id=semester_id, date=added.date())
+                for slug, semester_id, added in first
+                if (slug, semester_id) not in known)
+
+            counts = {}
+            for key in Signup.objects.values_list('semester', 'date'):
+                counts[key] = counts.get(key, 0) + 1
+
+            self.get_queryset().all().delete()
+            self.get_queryset().bulk_create(
+                self.model(semester_id=semester_id, date=date, count=count)
+                for (semester_id, date), count in sorted(counts.items()))
+
+    def get_buckets(self, buckets):
+        """Return (count, bucket, semester_id) ordered by semester and bucket.
+
+           Buckets are seconds since the epoch divided by a scale that spreads
+           the whole history over the given number of buckets.
+        """
+        rows = list(self.get_queryset().values_list(
+            'semester_id', 'date', 'count'))
+        if not rows:
+            return 0, []
+
+        epoch = datetime.date(1970, 1, 1)
+        seconds = [(d - epoch).days * 24 * 60 * 60 for _, d, _ in rows]
+        scale = max(1, (max(seconds) - min(seconds)) / buckets)
+
+        counts = {}
+        for (semester_id, date, count), second in zip(rows, seconds):
+            key = (semester_id, second / scale)
+            counts[key] = counts.get(key, 0) + count
+
+        return scale, [(count, bucket, semester_id)
+                       for (semester_id, bucket), count in sorted(counts.items())]
+
 
 class SemesterManager(models.Manager):
     def active(self):
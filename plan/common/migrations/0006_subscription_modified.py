@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def forwards(apps, schema_editor):
+    Subscription = apps.get_model('common', 'Subscription')
+    Subscription.objects.update(modified=models.F('added'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0005_lecture_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Modified'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
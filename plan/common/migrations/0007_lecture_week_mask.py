@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    Lecture = apps.get_model('common', 'Lecture')
+    Week = apps.get_model('common', 'Week')
+
+    masks = {}
+    for lecture_id, number in Week.objects.values_list('lecture_id', 'number'):
+        masks[lecture_id] = masks.get(lecture_id, 0) | (1 << number)
+
+    for lecture_id, mask in masks.items():
+        Lecture.objects.filter(id=lecture_id).update(week_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_subscription_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='week_mask',
+            field=models.BigIntegerField(default=0, verbose_name='Week mask'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
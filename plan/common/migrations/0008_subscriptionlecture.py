@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of SubscriptionLectureManager.REFRESH_SQL as it was when this
+# migration was written, without the WHERE clause. Migrations run against
+# the schema of their time, so this must not follow later changes to the
+# manager's query.
+FORWARDS_SQL = '''
+    INSERT INTO common_subscriptionlecture
+        (subscription_id, lecture_id, excluded)
+    SELECT DISTINCT s.id, l.id, EXISTS (
+        SELECT 1 FROM common_subscription_exclude e
+        WHERE e.subscription_id = s.id AND e.lecture_id = l.id)
+    FROM common_subscription s
+    JOIN common_subscription_groups sg ON (sg.subscription_id = s.id)
+    JOIN common_lecture_groups lg ON (lg.group_id = sg.group_id)
+    JOIN common_lecture l ON (l.id = lg.lecture_id AND l.course_id = s.course_id)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0007_lecture_week_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionLecture',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('excluded', models.BooleanField(default=False, verbose_name='Excluded')),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Lecture')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Subscription')),
+            ],
+            options={
+                'verbose_name': 'Subscription lecture',
+                'verbose_name_plural': 'Subscription lectures',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscriptionlecture',
+            unique_together=set([('subscription', 'lecture')]),
+        ),
+        migrations.RunSQL([FORWARDS_SQL], migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from plan.common import fulltext
+
+
+def create_index(apps, schema_editor):
+    backend = fulltext.get_backend()
+    if backend and backend.create(schema_editor.connection.cursor()):
+        backend.sync()
+
+
+def drop_index(apps, schema_editor):
+    backend = fulltext.get_backend()
+    if backend:
+        backend.drop(schema_editor.connection.cursor())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0008_subscriptionlecture'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
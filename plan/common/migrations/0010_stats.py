@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0009_course_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='common.Course')),
+                ('subscription_count', models.PositiveIntegerField(default=0, verbose_name='Subscriptions')),
+            ],
+            options={
+                'verbose_name': 'Course statistics',
+                'verbose_name_plural': 'Course statistics',
+            },
+        ),
+        migrations.CreateModel(
+            name='SemesterStats',
+            fields=[
+                ('semester', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='common.Semester')),
+                ('slug_count', models.PositiveIntegerField(default=0, verbose_name='Students')),
+                ('subscription_count', models.PositiveIntegerField(default=0, verbose_name='Subscriptions')),
+                ('course_count', models.PositiveIntegerField(default=0, verbose_name='Courses')),
+            ],
+            options={
+                'verbose_name': 'Semester statistics',
+                'verbose_name_plural': 'Semester statistics',
+            },
+        ),
+        migrations.AddField(
+            model_name='coursestats',
+            name='semester',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Semester'),
+        ),
+        migrations.AlterIndexTogether(
+            name='coursestats',
+            index_together=set([('semester', 'subscription_count')]),
+        ),
+    ]
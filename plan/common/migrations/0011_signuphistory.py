@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, schema_editor):
+    Subscription = apps.get_model('common', 'Subscription')
+    SignupHistory = apps.get_model('common', 'SignupHistory')
+
+    first = Subscription.objects.values('student', 'course__semester').annotate(
+        first=models.Min('added')).values_list('course__semester', 'first')
+
+    counts = {}
+    for semester_id, added in first:
+        key = (semester_id, added.date())
+        counts[key] = counts.get(key, 0) + 1
+
+    SignupHistory.objects.bulk_create(
+        SignupHistory(semester_id=semester_id, date=date, count=count)
+        for (semester_id, date), count in sorted(counts.items()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0010_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignupHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Semester')),
+            ],
+            options={
+                'verbose_name': 'Signup history',
+                'verbose_name_plural': 'Signup history',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='signuphistory',
+            unique_together=set([('semester', 'date')]),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0011_signuphistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='external_id',
+            field=models.CharField(db_index=True, max_length=100, null=True, verbose_name='External ID'),
+        ),
+    ]
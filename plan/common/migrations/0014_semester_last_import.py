@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0012_lecture_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semester',
+            name='last_import',
+            field=models.DateTimeField(null=True, verbose_name='Last import time'),
+        ),
+    ]
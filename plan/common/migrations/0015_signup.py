@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, schema_editor):
+    Subscription = apps.get_model('common', 'Subscription')
+    Signup = apps.get_model('common', 'Signup')
+
+    first = Subscription.objects.values(
+        'student__slug', 'course__semester').annotate(
+            first=models.Min('added')).values_list(
+                'student__slug', 'course__semester', 'first')
+
+    Signup.objects.bulk_create(
+        Signup(slug=slug, semester_id=semester_id, date=added.date())
+        for slug, semester_id, added in first)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0014_semester_last_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Signup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('slug', models.SlugField(verbose_name='Slug')),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Semester')),
+            ],
+            options={
+                'verbose_name': 'Signup',
+                'verbose_name_plural': 'Signups',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='signup',
+            unique_together=set([('slug', 'semester')]),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
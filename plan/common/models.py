@@ -4,13 +4,15 @@ import datetime
 
 from django.conf import settings
 from django.db import models
-from django.db import connection
 from django.template import defaultfilters as filters
 from django.utils import dates
 from django.utils import translation
 
+from plan.common import utils
 from plan.common.managers import (LectureManager, ExamManager, CourseManager,
-                                  SubscriptionManager, SemesterManager)
+                                  SubscriptionManager, SemesterManager,
+                                  SubscriptionLectureManager,
+                                  SemesterStatsManager, SignupHistoryManager)
 
 # To allow for overriding of the codes idea of now() for tests
 now = datetime.datetime.now
@@ -50,8 +52,7 @@ class Subscription(models.Model):
 
     alias = models.CharField(_('Alias'), max_length=50, blank=True)
     added = models.DateTimeField(_('Added'), auto_now_add=True)
-    # TODO(adamcik): Consider adding this so we can set better cache headers
-    # modified = models.DateTimeField(_('Modified'), auto_now=True)
+    modified = models.DateTimeField(_('Modified'), auto_now=True)
 
     groups = models.ManyToManyField('Group')
     exclude = models.ManyToManyField('Lecture', related_name='excluded_from')
@@ -88,6 +89,29 @@ class Subscription(models.Model):
         return tmp
 
 
+class SubscriptionLecture(models.Model):
+    """Lectures visible to a subscription based on its groups.
+
+       Materialized from the group tables so reading a student's lectures is
+       a single join. Needs to be refreshed whenever groups or excludes of a
+       subscription, or the groups of a lecture, change.
+    """
+    subscription = models.ForeignKey(Subscription)
+    lecture = models.ForeignKey('Lecture')
+    excluded = models.BooleanField(_('Excluded'), default=False)
+
+    objects = SubscriptionLectureManager()
+
+    class Meta:
+        unique_together = (('subscription', 'lecture'),)
+
+        verbose_name = _('Subscription lecture')
+        verbose_name_plural = _('Subscription lectures')
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.subscription, self.lecture)
+
+
 # TODO(adamcik): get rid of optional since it can't be imported?
 class LectureType(models.Model):
     code = models.CharField(_('Code'), max_length=20, null=True, unique=True)
@@ -185,24 +209,13 @@ class Course(models.Model):
         else:
             semester_id = semester
 
-        slug_count = int(Student.objects.filter(subscription__course__semester=semester).distinct().count())
-        subscription_count = int(Subscription.objects.filter(course__semester=semester).count())
-        course_count = int(Course.objects.filter(subscription__course__semester=semester).values('name').distinct().count())
-
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) as num, c.id, c.code, c.name FROM
-                common_subscription u JOIN common_course c ON (c.id = u.course_id)
-            WHERE c.semester_id = %s
-            GROUP BY c.id, c.code, c.name
-            ORDER BY num DESC
-            LIMIT %s''', [semester_id, limit])
+        stats = SemesterStats.objects.get_stats(semester_id)
 
         return {
-            'slug_count': slug_count,
-            'course_count': course_count,
-            'subscription_count': subscription_count,
-            'stats': cursor.fetchall(),
+            'slug_count': stats.slug_count,
+            'course_count': stats.course_count,
+            'subscription_count': stats.subscription_count,
+            'stats': SemesterStats.objects.get_top_courses(semester_id, limit),
             'limit': limit,
         }
 
@@ -244,6 +257,9 @@ class Semester(models.Model):
     year = models.PositiveSmallIntegerField(_('Year'))
     type = models.CharField(_('Type'), max_length=10, choices=SEMESTER_TYPES)
     active = models.DateField(_('Active'), null=True)
+    # Bumped by scrapers that change anything in the semester, for data
+    # cached for the semester as a whole.
+    last_import = models.DateTimeField(_('Last import time'), null=True)
 
     objects = SemesterManager()
 
@@ -266,6 +282,16 @@ class Semester(models.Model):
     def __unicode__(self):
         return u'%s %s' % (self.get_type_display(), self.year)
 
+    def save(self, *args, **kwargs):
+        from plan.common.registry import SemesterRegistry
+        super(Semester, self).save(*args, **kwargs)
+        SemesterRegistry.invalidate()
+
+    def delete(self, *args, **kwargs):
+        from plan.common.registry import SemesterRegistry
+        super(Semester, self).delete(*args, **kwargs)
+        SemesterRegistry.invalidate()
+
     @property
     def slug(self):
         return self.localize(self.type)
@@ -283,6 +309,76 @@ class Semester(models.Model):
             return 'h%s' % str(self.year)[-2:]
 
 
+class SemesterStats(models.Model):
+    semester = models.OneToOneField(Semester, primary_key=True)
+
+    slug_count = models.PositiveIntegerField(_('Students'), default=0)
+    subscription_count = models.PositiveIntegerField(_('Subscriptions'), default=0)
+    course_count = models.PositiveIntegerField(_('Courses'), default=0)
+
+    objects = SemesterStatsManager()
+
+    class Meta:
+        verbose_name = _('Semester statistics')
+        verbose_name_plural = _('Semester statistics')
+
+    def __unicode__(self):
+        return unicode(self.semester)
+
+
+class CourseStats(models.Model):
+    course = models.OneToOneField(Course, primary_key=True)
+    semester = models.ForeignKey(Semester)
+
+    subscription_count = models.PositiveIntegerField(_('Subscriptions'), default=0)
+
+    class Meta:
+        verbose_name = _('Course statistics')
+        verbose_name_plural = _('Course statistics')
+
+        index_together = [('semester', 'subscription_count')]
+
+    def __unicode__(self):
+        return unicode(self.course)
+
+
+class SignupHistory(models.Model):
+    semester = models.ForeignKey(Semester)
+    date = models.DateField(_('Date'))
+    count = models.PositiveIntegerField(_('Count'), default=0)
+
+    objects = SignupHistoryManager()
+
+    class Meta:
+        verbose_name = _('Signup history')
+        verbose_name_plural = _('Signup history')
+
+        unique_together = [('semester', 'date')]
+
+    def __unicode__(self):
+        return u'%s %s' % (self.semester, self.date)
+
+
+class Signup(models.Model):
+    """First time a student subscribed to a course in a semester.
+
+       Keyed on the slug as students without courses are deleted.
+    """
+
+    slug = models.SlugField(_('Slug'))
+    semester = models.ForeignKey(Semester)
+    date = models.DateField(_('Date'))
+
+    class Meta:
+        verbose_name = _('Signup')
+        verbose_name_plural = _('Signups')
+
+        unique_together = [('slug', 'semester')]
+
+    def __unicode__(self):
+        return u'%s %s' % (self.slug, self.semester)
+
+
 class ExamType(models.Model):
     code = models.CharField(_('Code'), max_length=20, unique=True)
     name = models.CharField(_('Name'), max_length=100, null=True)
@@ -359,6 +455,10 @@ class Lecture(models.Model):
     course = models.ForeignKey(Course)
     title = models.TextField(_('Title'), null=True)
 
+    # Stable id from the source we import from, when it has one.
+    external_id = models.CharField(_('External ID'), max_length=100,
+                                   null=True, db_index=True)
+
     day = models.PositiveSmallIntegerField(_('Week day'), choices=DAYS)
 
     start = models.TimeField(_('Start time'))
@@ -369,6 +469,9 @@ class Lecture(models.Model):
     groups = models.ManyToManyField(Group)
     lecturers = models.ManyToManyField(Lecturer)
 
+    # Denormalized copy of the lecture's weeks, see utils.weeks_to_mask()
+    week_mask = models.BigIntegerField(_('Week mask'), default=0)
+
     last_import = models.DateTimeField(_('Last import time'), auto_now=True)
 
     objects = LectureManager()
@@ -393,6 +496,13 @@ class Lecture(models.Model):
                 self.get_day_display()
             )
 
+    @property
+    def week_numbers(self):
+        return utils.mask_to_weeks(self.week_mask)
+
+    def has_week(self, week):
+        return bool(self.week_mask & (1 << int(week)))
+
     @staticmethod
     def get_related(model, lectures, fields=None, use_extra=True):
         tmp = {}
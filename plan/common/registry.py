@@ -0,0 +1,100 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.core import cache
+from django.db import transaction
+
+from plan.common import utils
+from plan.common.models import Course, Location, Semester
+
+VERSION_KEY = 'semester-registry-version'
+
+
+class SemesterRegistry(object):
+    """Process wide view of all semesters and their locations.
+
+       Semesters hardly ever change, so instead of looking them up on every
+       request they are loaded once and reused until the TTL runs out or
+       someone invalidates the registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _load(self):
+        semesters = list(Semester.objects.all())
+        by_id = dict((s.pk, s) for s in semesters)
+        locations = dict((l.pk, l) for l in Location.objects.all())
+
+        semester_locations = dict((s.pk, []) for s in semesters)
+        pairs = Course.locations.through.objects.values_list(
+            'course__semester_id', 'location_id').distinct()
+        for semester_id, location_id in sorted(pairs):
+            if semester_id in semester_locations:
+                semester_locations[semester_id].append(locations[location_id])
+
+        return {
+            'semesters': dict(((s.year, s.type), s) for s in semesters),
+            'by_id': by_id,
+            # Semesters ordered by when they became active.
+            'ordered': sorted((s for s in semesters if s.active),
+                              key=lambda s: s.active),
+            'locations': semester_locations,
+        }
+
+    def _get_state(self):
+        version = cache.cache.get(VERSION_KEY)
+        if version is None:
+            version = utils.initial_version()
+            cache.cache.set(VERSION_KEY, version, None)
+
+        with self._lock:
+            if self._state:
+                current, loaded, state = self._state
+                age = time.time() - loaded
+                if (current == version and
+                        age < settings.TIMETABLE_SEMESTER_REGISTRY_TIMEOUT):
+                    return state
+
+            state = self._load()
+            self._state = (version, time.time(), state)
+            return state
+
+    def get(self, year, semester_type):
+        try:
+            return self._get_state()['semesters'][(int(year), semester_type)]
+        except (KeyError, ValueError):
+            raise Semester.DoesNotExist
+
+    def active(self):
+        """Same as Semester.objects.active() without hitting the database."""
+        today = datetime.date.today()
+        ordered = self._get_state()['ordered']
+        for semester in reversed(ordered):
+            if semester.active < today:
+                return semester
+        raise Semester.DoesNotExist
+
+    def next(self):
+        """Same as Semester.objects.next() without hitting the database."""
+        today = datetime.date.today()
+        for semester in self._get_state()['ordered']:
+            if semester.active >= today:
+                return semester
+        raise Semester.DoesNotExist
+
+    def locations(self, semester):
+        return self._get_state()['locations'].get(semester.pk, [])
+
+    @staticmethod
+    def invalidate():
+        utils.bump_version(VERSION_KEY)
+        transaction.on_commit(lambda: utils.bump_version(VERSION_KEY))
+
+
+semesters = SemesterRegistry()
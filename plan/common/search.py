@@ -0,0 +1,182 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+import collections
+import time
+
+from django.conf import settings
+from django.core import cache
+from django.db import transaction
+
+from plan.common import utils
+from plan.common.models import Course, Subscription
+
+VERSION_KEY = 'course-index-version:%s:%s'
+GRAM_SIZE = 3
+
+# Per process indexes keyed on semester, storing (version, built, index).
+_indexes = {}
+
+
+def grams(value, size=GRAM_SIZE):
+    """All substrings of value up to size characters long."""
+    result = set()
+    for length in xrange(1, size + 1):
+        for i in xrange(len(value) - length + 1):
+            result.add(value[i:i + length])
+    return result
+
+
+class CourseIndex(object):
+    """In memory search index over a semester's courses.
+
+       Courses are found through n-grams of their code and name, while
+       aliases are kept in a separate map as they only match exactly. This
+       mirrors CourseManager.search without needing any SQL per query.
+    """
+
+    def __init__(self, courses, locations=None, aliases=None):
+        self.courses = []
+        self.grams = collections.defaultdict(set)
+        self.aliases = collections.defaultdict(set)
+        self.locations = collections.defaultdict(set)
+        self.popularity = collections.defaultdict(int)
+
+        for i, (course_id, code, name) in enumerate(courses):
+            self.courses.append((code, name or u'', code.lower(),
+                                 (name or u'').lower(), course_id))
+            for gram in grams(code.lower()) | grams((name or u'').lower()):
+                self.grams[gram].add(i)
+
+        positions = dict((c[4], i) for i, c in enumerate(self.courses))
+
+        for course_id, location_id in (locations or []):
+            if course_id in positions:
+                self.locations[location_id].add(positions[course_id])
+
+        for course_id, alias in (aliases or []):
+            if course_id in positions:
+                self.popularity[positions[course_id]] += 1
+                if alias:
+                    self.aliases[alias].add(positions[course_id])
+
+    @classmethod
+    def build(cls, year, semester_type):
+        semester = {'semester__year__exact': year,
+                    'semester__type__exact': semester_type}
+        related = {'course__semester__year__exact': year,
+                   'course__semester__type__exact': semester_type}
+
+        courses = Course.objects.filter(**semester).values_list(
+            'id', 'code', 'name')
+        locations = Course.locations.through.objects.filter(**related)
+        subscriptions = Subscription.objects.filter(**related)
+
+        return cls(courses,
+                   locations.values_list('course_id', 'location_id'),
+                   subscriptions.values_list('course_id', 'alias'))
+
+    @classmethod
+    def get(cls, year, semester_type):
+        """Get index for semester, building it if missing or outdated.
+
+           The version lives in the shared cache so that every process
+           rebuilds its copy once scrapers have changed the courses.
+        """
+        key = VERSION_KEY % (year, semester_type)
+        version = cache.cache.get(key)
+        if version is None:
+            version = utils.initial_version()
+            cache.cache.set(key, version, None)
+
+        current = _indexes.get((year, semester_type))
+        if current:
+            current_version, built, index = current
+            age = time.time() - built
+            if (current_version == version and
+                    age < settings.TIMETABLE_COURSE_INDEX_TIMEOUT):
+                return index
+
+        index = cls.build(year, semester_type)
+        _indexes[(year, semester_type)] = (version, time.time(), index)
+        return index
+
+    @staticmethod
+    def invalidate(year, semester_type):
+        key = VERSION_KEY % (year, semester_type)
+        utils.bump_version(key)
+        transaction.on_commit(lambda: utils.bump_version(key))
+
+    def lookup(self, word):
+        """Positions of courses whose code or name contains word."""
+        needle = word.lower()
+        if len(needle) <= GRAM_SIZE:
+            return self.grams.get(needle, set())
+
+        candidates = None
+        for i in xrange(len(needle) - GRAM_SIZE + 1):
+            matches = self.grams.get(needle[i:i + GRAM_SIZE], set())
+            if candidates is None:
+                candidates = set(matches)
+            else:
+                candidates &= matches
+            if not candidates:
+                return set()
+
+        return set(i for i in candidates
+                   if needle in self.courses[i][2] or
+                   needle in self.courses[i][3])
+
+    def score(self, position, word):
+        """Rank how well a single word matches a course."""
+        code, name, lower_code, lower_name = self.courses[position][:4]
+        needle = word.lower()
+
+        if lower_code == needle:
+            score = 8
+        elif lower_code.startswith(needle):
+            score = 4
+        elif any(w.startswith(needle) for w in lower_name.split()):
+            score = 2
+        elif needle in lower_code or needle in lower_name:
+            score = 1
+        else:
+            score = 0
+
+        if position in self.aliases.get(word, ()):
+            score = max(score, 4)
+        return score
+
+    def search(self, query, limit=10, location=None):
+        """Return (code, name) for courses matching every word in query.
+
+           Results are ordered by how well they match, then by how many
+           students have subscribed to them.
+        """
+        words = [w for w in utils.split_search(query) if w]
+
+        if location:
+            try:
+                matches = set(self.locations.get(int(location), ()))
+            except ValueError:
+                return []
+        else:
+            matches = None
+
+        for word in words:
+            found = self.lookup(word) | self.aliases.get(word, set())
+            if matches is None:
+                matches = set(found)
+            else:
+                matches &= found
+            if not matches:
+                return []
+
+        if matches is None:
+            matches = set(xrange(len(self.courses)))
+
+        def key(position):
+            score = sum(self.score(position, w) for w in words)
+            return (-score, -self.popularity[position],
+                    self.courses[position][0])
+
+        return [self.courses[p][:2] for p in sorted(matches, key=key)[:limit]]
@@ -0,0 +1,200 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from django.conf import settings
+from django.core import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from plan.common import utils
+from plan.common.models import (Exam, Group, Lecture, Lecturer, Room,
+                                Subscription)
+from plan.common.timetable import Timetable
+
+GENERATION_KEY = 'schedule-generation'
+VERSION_KEY = 'schedule-version:%s'
+SNAPSHOT_KEY = 'schedule:%s:%s:%s:%s:%s:%s:%s'
+
+
+class ScheduleSnapshot(object):
+    """All data needed to render a student's schedule for one semester.
+
+       Every attribute is loaded lazily with a single query the first time it
+       is used, so the total query count stays fixed no matter how many
+       courses the student has, and views only pay for the data they use.
+    """
+
+    # Attributes that are loaded up front before storing in the cache.
+    cached_attributes = ('student', 'courses', 'lectures', 'exams', 'rooms',
+                         'groups', 'lecturers', 'weeks', 'timetable')
+
+    def __init__(self, semester, slug, week=None):
+        self.semester = semester
+        self.slug = slug
+        self.week = week
+
+    @classmethod
+    def cached(cls, semester, slug, week=None, modified=None):
+        """Get a fully loaded snapshot, reusing cached data when valid.
+
+           Keys include both the global generation and the student's version
+           so anything that changes the underlying data makes old entries
+           unreachable instead of having to find and delete them.
+
+           The counters only live in the cache, which other processes such as
+           scrapes can't reach with a per-process backend, so keys also
+           include when the student's data last changed. Views that already
+           know it can pass it as modified, otherwise it is looked up.
+        """
+        if modified is None:
+            modified = Subscription.objects.get_last_modified(
+                semester.year, semester.type, slug)
+        if modified is not None and timezone.is_aware(modified):
+            modified = timezone.make_naive(modified)
+
+        version_key = VERSION_KEY % slug
+        versions = cache.cache.get_many([GENERATION_KEY, version_key])
+
+        missing = {}
+        for key in (GENERATION_KEY, version_key):
+            if key not in versions:
+                versions[key] = missing[key] = utils.initial_version()
+        if missing:
+            cache.cache.set_many(missing, None)
+
+        key = SNAPSHOT_KEY % (versions[GENERATION_KEY], versions[version_key],
+                              modified and modified.isoformat(),
+                              semester.year, semester.type, slug, week or '')
+
+        snapshot = cache.cache.get(key)
+        if snapshot is None:
+            snapshot = cls(semester, slug, week)
+            for name in cls.cached_attributes:
+                getattr(snapshot, name)
+            cache.cache.set(key, snapshot, settings.TIMETABLE_SCHEDULE_CACHE_TIMEOUT)
+        return snapshot
+
+    @staticmethod
+    def invalidate(slug=None):
+        """Make cached snapshots stale.
+
+           Passing a slug only affects that student, while no slug affects
+           everyone, which is what scrapers need after rewriting lectures.
+        """
+        if slug:
+            key = VERSION_KEY % slug
+        else:
+            key = GENERATION_KEY
+
+        # Bump right away and once more on commit, otherwise requests that
+        # come in before the commit could cache old data under the new key.
+        utils.bump_version(key)
+        transaction.on_commit(lambda: utils.bump_version(key))
+
+    @cached_property
+    def subscriptions(self):
+        return list(Subscription.objects.get_subscriptions(
+            self.semester.year, self.semester.type, self.slug).select_related(
+                'student'))
+
+    @cached_property
+    def student(self):
+        if self.subscriptions:
+            return self.subscriptions[0].student
+        return None
+
+    @cached_property
+    def courses(self):
+        courses = []
+        for subscription in self.subscriptions:
+            course = subscription.course
+            course.alias = subscription.alias
+            courses.append(course)
+        return courses
+
+    @cached_property
+    def lectures(self):
+        if not self.subscriptions:
+            return []
+        return Lecture.objects.get_lectures(
+            self.semester.year, self.semester.type, self.slug, self.week)
+
+    @cached_property
+    def exams(self):
+        if not self.subscriptions:
+            return []
+        return list(Exam.objects.get_exams(
+            self.semester.year, self.semester.type, self.slug))
+
+    @cached_property
+    def exams_by_course(self):
+        exams = {}
+        for exam in self.exams:
+            exams.setdefault(exam.course_id, []).append(exam)
+        return exams
+
+    @cached_property
+    def rooms(self):
+        return Lecture.get_related(Room, self.lectures, fields=['name', 'url'])
+
+    @cached_property
+    def room_names(self):
+        names = {}
+        for lecture_id, rooms in self.rooms.items():
+            names[lecture_id] = [r['name'] for r in rooms]
+        return names
+
+    @cached_property
+    def groups(self):
+        return Lecture.get_related(Group, self.lectures, fields=['code'])
+
+    @cached_property
+    def lecturers(self):
+        return Lecture.get_related(Lecturer, self.lectures)
+
+    @cached_property
+    def weeks(self):
+        weeks = {}
+        for lecture in self.lectures:
+            if lecture.week_mask:
+                weeks[lecture.id] = lecture.week_numbers
+        return weeks
+
+    @cached_property
+    def timetable(self):
+        """Timetable with lectures placed and expanded.
+
+           Only locale independent steps are done here, so callers still need
+           to insert times and add markers as needed.
+        """
+        table = Timetable(self.lectures)
+        if self.week:
+            table.set_week(self.semester.year, int(self.week))
+        if self.lectures:
+            table.place_lectures()
+            table.do_expansion()
+        return table
+
+    def get_week_timetable(self, week):
+        """Timetable for a single week worked out from all lectures.
+
+           Only makes sense for snapshots without a week, where it saves
+           loading lectures again for every week that is needed.
+        """
+        table = Timetable([l for l in self.lectures if l.has_week(week)])
+        table.set_week(self.semester.year, int(week))
+        table.place_lectures()
+        table.do_expansion()
+        return table
+
+    @cached_property
+    def week_range(self):
+        """Range covering the first to last week with lectures."""
+        mask = 0
+        for lecture in self.lectures:
+            mask |= lecture.week_mask
+
+        if not mask:
+            return []
+        # Lowest and highest set bits give the first and last week.
+        return range((mask & -mask).bit_length() - 1, mask.bit_length())
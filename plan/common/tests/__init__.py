@@ -2,6 +2,7 @@
 
 import datetime
 
+from django.core import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
@@ -12,6 +13,7 @@ from plan.common.models import Semester
 class BaseTestCase(TestCase):
     def setUp(self):
         self.set_now_to(2009, 1, 1)
+        cache.cache.clear()
 
         self.semester = Semester(year=2009, type='spring')
         self.default_args = [
@@ -22,9 +24,10 @@ class BaseTestCase(TestCase):
 
     def set_now_to(self, year, month, day):
         from plan.common import models, views
+        from plan.ical import views as ical_views
         dt = datetime.datetime(year, month, day)
 
-        for cls in models, views:
+        for cls in models, views, ical_views:
             cls.now = lambda: dt
             cls.today = lambda: dt.date()
 
@@ -0,0 +1,145 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Synthetic data and reference implementations for tests and benchmarks."""
+
+import datetime
+import random
+
+from django.conf import settings
+
+from plan.common.models import Lecture
+from plan.common.timetable import SLOT_END_TIMES, Timetable
+
+
+class FakeLecture(object):
+    exclude = False
+    show_week = True
+
+    def __init__(self, id, day, start, end):
+        self.id = id
+        self.day = day
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return '<FakeLecture %s: %s %s-%s>' % (self.id, self.day, self.start, self.end)
+
+
+def random_lectures(count, seed=None, days=None):
+    """Synthetic lectures spread over the days and slots of a timetable."""
+    rand = random.Random(seed)
+    days = days or len(Lecture.DAYS)
+    first = settings.TIMETABLE_SLOTS[0][0]
+    first = first.hour * 60 + first.minute
+    last = settings.TIMETABLE_SLOTS[-1][1]
+    last = last.hour * 60 + last.minute
+
+    lectures = []
+    for i in xrange(count):
+        start = rand.randrange(first, last - 15, 15)
+        end = min(last, start + rand.choice([45, 105, 165, 225, 345]))
+
+        lecture = FakeLecture(i, rand.randrange(days),
+                              datetime.time(start // 60, start % 60),
+                              datetime.time(end // 60, end % 60))
+        lecture.exclude = rand.random() < 0.05
+        lecture.show_week = rand.random() < 0.95
+        lectures.append(lecture)
+    return lectures
+
+
+class ReferenceTimetable(Timetable):
+    """Original row search based layout, kept to verify and time the current one."""
+
+    def place_lectures(self):
+        for i, lecture in enumerate(self.lecture_queryset):
+            if lecture.exclude or not lecture.show_week:
+                continue
+
+            start, end = self.map_to_slot(lecture)
+            rowspan = end - start + 1
+
+            first = start
+
+            try:
+                row = 0
+                while start <= end:
+                    if self.table[start][lecture.day][row]:
+                        row += 1
+                        start = first
+                    else:
+                        start += 1
+
+            except IndexError:
+                for j in range(self.slots):
+                    self.table[j][lecture.day].append({})
+                self.span[lecture.day] += 1
+
+            start = first
+            remove = False
+
+            while start <= end:
+                self.table[start][lecture.day][row] = {
+                    'lecture': lecture,
+                    'rowspan': rowspan,
+                    'remove': remove,
+                    'bottom': start+rowspan == len(self.table)
+                }
+
+                if not remove:
+                    remove = True
+                    self.lectures.append({
+                        'height': rowspan,
+                        'i': start,
+                        'j': lecture.day,
+                        'k': row,
+                        'l': lecture,
+                    })
+
+                start += 1
+
+    def do_expansion(self):
+        for lecture in self.lectures:
+            i = lecture['i']
+            j = lecture['j']
+            k = lecture['k']
+
+            height = lecture['height']
+
+            expand_by = 1
+
+            safe = True
+            for l in xrange(k+1, len(self.table[i][j])):
+                for m in xrange(i, i+height):
+                    if self.table[m][j][l]:
+                        safe = False
+                        break
+                if safe:
+                    expand_by += 1
+                else:
+                    break
+
+            self.table[i][j][k]['colspan'] = expand_by
+            lecture['width'] = expand_by
+
+            if k+expand_by == len(self.table[i][j]):
+                self.table[i][j][k]['last'] = True
+
+            for l in xrange(k+1, k+expand_by):
+                for m in xrange(i, i+height):
+                    self.table[m][j][l]['remove'] = True
+
+    def map_to_slot(self, lecture):
+        start, end = None, None
+
+        for i, time in enumerate(SLOT_END_TIMES):
+            if start is None and lecture.start < time:
+                start = i
+
+            if end is None and lecture.end <= time:
+                end = i
+
+        if end is None and lecture.end > time:
+            end = i
+
+        return (start, end)
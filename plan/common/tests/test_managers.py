@@ -1,7 +1,8 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+from plan.common import fulltext
 from plan.common.tests import BaseTestCase
-from plan.common.models import Lecture, Semester, Deadline, Exam, Course, Subscription
+from plan.common.models import Lecture, Semester, Deadline, Exam, Course, Subscription, SubscriptionLecture
 
 class ManagerTestCase(BaseTestCase):
     fixtures = ['test_data.json', 'test_user.json']
@@ -52,6 +53,8 @@ class ManagerTestCase(BaseTestCase):
         self.assertEquals(set(control), set(subscriptions))
 
     def test_search(self):
+        fulltext.sync()
+
         control = Course.objects.exclude(id=5)
         courses = Course.objects.search(2009, Semester.SPRING, 'COURSE')
 
@@ -62,3 +65,60 @@ class ManagerTestCase(BaseTestCase):
 
         self.assertEquals(set(control), set(courses))
 
+    def visible_lectures(self):
+        return list(SubscriptionLecture.objects.order_by(
+            'subscription', 'lecture').values_list(
+                'subscription', 'lecture', 'excluded'))
+
+    def test_refresh_subscription_lectures(self):
+        control = self.visible_lectures()
+
+        SubscriptionLecture.objects.all().delete()
+        SubscriptionLecture.objects.refresh()
+
+        self.assertEquals(control, self.visible_lectures())
+
+    def test_refresh_subscription_lectures_partial(self):
+        subscription = Subscription.objects.get(pk=1)
+        subscription.exclude.clear()
+
+        SubscriptionLecture.objects.refresh([subscription])
+        lecture = SubscriptionLecture.objects.get(subscription=1, lecture=7)
+        self.assertEquals(False, lecture.excluded)
+
+        subscription.groups.clear()
+
+        SubscriptionLecture.objects.refresh([subscription])
+        self.assertEquals([], list(SubscriptionLecture.objects.filter(subscription=subscription)))
+        self.assertEquals(8, SubscriptionLecture.objects.count())
+
+        lecture = Lecture.objects.get(pk=8)
+        lecture.groups.clear()
+
+        SubscriptionLecture.objects.refresh(lectures=[lecture])
+        self.assertEquals([], list(SubscriptionLecture.objects.filter(lecture=lecture)))
+
+    def test_search_fulltext(self):
+        fulltext.sync()
+
+        courses = Course.objects.search(2009, Semester.SPRING, 'full cour')
+        self.assertEquals(4, len(courses))
+
+        # Matching both code and name ranks above matching only the name
+        Course.objects.filter(pk=3).update(name='Intro')
+        Course.objects.filter(pk=4).update(code='INTRO1', name='Intro')
+        fulltext.sync(1)
+
+        courses = Course.objects.search(2009, Semester.SPRING, 'intro')
+        self.assertEquals([4, 3], [c.id for c in courses])
+
+        courses = Course.objects.search(2009, Semester.SPRING, 'foo')
+        self.assertEquals([1], [c.id for c in courses])
+
+        courses = Course.objects.search(2009, Semester.SPRING, '"course1 OR')
+        self.assertEquals([], list(courses))
+
+    def test_search_without_fulltext(self):
+        with self.settings(TIMETABLE_FULLTEXT_BACKENDS={}):
+            courses = Course.objects.search(2009, Semester.SPRING, 'urse1')
+            self.assertEquals([1], [c.id for c in courses])
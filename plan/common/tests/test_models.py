@@ -1,7 +1,12 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import StringIO
+
+from django.core.management import call_command
+
 from plan.common.tests import BaseTestCase
-from plan.common.models import Course, Semester
+from plan.common.models import (Course, CourseStats, Semester, SemesterStats,
+                                Student, Subscription)
 
 class ModelsTestCase(BaseTestCase):
     fixtures = ['test_data.json', 'test_user.json']
@@ -20,6 +25,54 @@ class ModelsTestCase(BaseTestCase):
         self.assertEquals((2, 1, u'COURSE1', u'Course 1 full name'), stats[1])
         self.assertEquals((1, 3, u'COURSE3', u'Course 3 full name'), stats[2])
 
+    def test_course_get_stats_incremental(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        Course.get_stats(semester)
+
+        student = Student.objects.create(slug='new')
+        Subscription.objects.create(student=student, course_id=4)
+        Subscription.objects.create(student=student, course_id=2)
+        SemesterStats.objects.update_stats(semester.pk, 'new', [4, 2], 1)
+
+        with self.assertNumQueries(2):
+            actual = Course.get_stats(semester)
+
+        self.assertEquals(4, actual['slug_count'])
+        self.assertEquals(4, actual['course_count'])
+        self.assertEquals(8, actual['subscription_count'])
+        self.assertEquals((4, 2, u'COURSE2', u'Course 2 full name'), actual['stats'][0])
+        self.assertEquals((1, 4, u'COURSE4', u'Course 4 full name'), actual['stats'][3])
+
+        Subscription.objects.filter(student=student).delete()
+        SemesterStats.objects.update_stats(semester.pk, 'new', [4, 2], -1)
+        incremental = Course.get_stats(semester)
+
+        call_command('rebuild_stats', stdout=StringIO.StringIO())
+        self.assertEquals(Course.get_stats(semester), incremental)
+        self.assertEquals(3, incremental['slug_count'])
+        self.assertEquals(3, incremental['course_count'])
+        self.assertEquals(6, incremental['subscription_count'])
+
+    def test_course_get_stats_same_name(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        Course.objects.filter(pk=4).update(name='Course 3 full name')
+        Course.get_stats(semester)
+
+        Subscription.objects.create(student_id=1, course_id=4)
+        SemesterStats.objects.update_stats(semester.pk, 'adamcik', [4], 1)
+
+        self.assertEquals(3, Course.get_stats(semester)['course_count'])
+
+    def test_course_get_stats_remove_unknown(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        Course.get_stats(semester)
+
+        SemesterStats.objects.update_stats(semester.pk, 'adamcik', [4], -1)
+
+        self.assertFalse(CourseStats.objects.filter(
+            course_id=4, subscription_count__gt=0).exists())
+        self.assertEquals(3, Course.get_stats(semester)['course_count'])
+
     # FIXME test unicode
     # FIXME test course.get_url
     # FIXME test get_stats(int)
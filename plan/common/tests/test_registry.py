@@ -0,0 +1,48 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from plan.common.tests import BaseTestCase
+from plan.common.models import Course, Location, Semester
+from plan.common.registry import semesters
+
+
+class SemesterRegistryTestCase(BaseTestCase):
+    fixtures = ['test_data.json', 'test_user.json']
+
+    def test_get(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+
+        self.assertEquals(semester, semesters.get(2009, Semester.SPRING))
+        self.assertEquals(semester, semesters.get('2009', Semester.SPRING))
+        self.assertRaises(Semester.DoesNotExist, semesters.get, 2008, Semester.SPRING)
+
+    def test_active_and_next(self):
+        for name in ('active', 'next'):
+            try:
+                control = getattr(Semester.objects, name)()
+            except Semester.DoesNotExist:
+                self.assertRaises(Semester.DoesNotExist, getattr(semesters, name))
+            else:
+                self.assertEquals(control, getattr(semesters, name)())
+
+    def test_no_queries(self):
+        semester = semesters.get(2009, Semester.SPRING)
+
+        with self.assertNumQueries(0):
+            semesters.get(2009, Semester.FALL)
+            semesters.locations(semester)
+
+    def test_locations(self):
+        semester = semesters.get(2009, Semester.SPRING)
+        location = Location.objects.create(name='Gjovik')
+        Course.objects.get(pk=1).locations.add(location)
+
+        self.assertEquals([], semesters.locations(semester))
+
+        semesters.invalidate()
+        self.assertEquals([location], semesters.locations(semester))
+
+    def test_invalidated_on_save(self):
+        semesters.get(2009, Semester.SPRING)
+        Semester.objects.create(year=2011, type=Semester.SPRING)
+
+        self.assertEquals(2011, semesters.get(2011, Semester.SPRING).year)
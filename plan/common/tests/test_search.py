@@ -0,0 +1,65 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from plan.common.tests import BaseTestCase
+from plan.common.models import Course, Location, Semester
+from plan.common.search import CourseIndex
+
+
+class CourseIndexTestCase(BaseTestCase):
+    fixtures = ['test_data.json', 'test_user.json']
+
+    def search(self, query, limit=10, location=None):
+        index = CourseIndex.get(2009, Semester.SPRING)
+        return [code for code, name in index.search(query, limit, location)]
+
+    def test_search(self):
+        self.assertEquals(['COURSE2', 'COURSE1', 'COURSE3', 'COURSE4'],
+                          self.search('course'))
+        self.assertEquals(['COURSE1'], self.search('COURSE1'))
+        self.assertEquals(['COURSE3'], self.search('"3 full"'))
+        self.assertEquals(['COURSE3'], self.search('full 3'))
+        self.assertEquals([], self.search('course missing'))
+        self.assertEquals(['COURSE2', 'COURSE1'], self.search('c', limit=2))
+
+    def test_matches_manager(self):
+        for query in ('COURSE', 'COURSE1', 'name', 'foo', 'e 2', 'urse4'):
+            with self.settings(TIMETABLE_FULLTEXT_BACKENDS={}):
+                control = Course.objects.search(2009, Semester.SPRING, query)
+            self.assertEquals(sorted(c.code for c in control),
+                              sorted(self.search(query)))
+
+    def test_ranking(self):
+        Course.objects.filter(pk=4).update(code='COURSE')
+        CourseIndex.invalidate(2009, Semester.SPRING)
+
+        # Exact code matches beat popularity
+        self.assertEquals(['COURSE', 'COURSE2', 'COURSE1', 'COURSE3'],
+                          self.search('course'))
+        self.assertEquals(['COURSE1'], self.search('foo'))
+
+    def test_location(self):
+        location = Location.objects.create(name='Gjovik')
+        Course.objects.get(pk=3).locations.add(location)
+        CourseIndex.invalidate(2009, Semester.SPRING)
+
+        self.assertEquals(['COURSE3'], self.search('course', location=location.pk))
+        self.assertEquals([], self.search('course', location=location.pk + 1))
+        self.assertEquals([], self.search('course', location='foo'))
+
+    def test_no_queries(self):
+        self.search('course')
+
+        with self.assertNumQueries(0):
+            self.search('course')
+
+    def test_invalidate(self):
+        self.search('course')
+        Course.objects.filter(pk=4).update(name='Something else')
+
+        self.assertEquals(['COURSE2', 'COURSE1', 'COURSE3', 'COURSE4'],
+                          self.search('course full'))
+
+        CourseIndex.invalidate(2009, Semester.SPRING)
+
+        self.assertEquals(['COURSE2', 'COURSE1', 'COURSE3'],
+                          self.search('course full'))
@@ -0,0 +1,121 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from plan.common.tests import BaseTestCase
+from plan.common.models import (Course, Exam, Lecture, Semester,
+                                Subscription)
+from plan.common.snapshot import ScheduleSnapshot
+
+
+class ScheduleSnapshotTestCase(BaseTestCase):
+    fixtures = ['test_data.json', 'test_user.json']
+
+    def snapshot(self, slug='adamcik', week=None):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        return ScheduleSnapshot(semester, slug, week)
+
+    def load(self, snapshot):
+        for name in ('student', 'courses', 'lectures', 'exams', 'rooms',
+                     'groups', 'lecturers', 'weeks'):
+            getattr(snapshot, name)
+
+    def test_data(self):
+        snapshot = self.snapshot()
+
+        self.assertEquals('adamcik', snapshot.student.slug)
+        self.assertEquals(set(Course.objects.exclude(id__in=[4, 5])),
+                          set(snapshot.courses))
+        self.assertEquals(['foo', '', ''], [c.alias for c in snapshot.courses])
+        self.assertEquals(set(Exam.objects.exclude(id__in=[3, 4])),
+                          set(snapshot.exams))
+        self.assertEquals([1, 2], snapshot.week_range)
+
+        control = Lecture.objects.exclude(id__in=[6, 7])
+        lectures = [l for l in snapshot.lectures if not l.exclude]
+        self.assertEquals(set(control), set(lectures))
+
+    def test_week(self):
+        snapshot = self.snapshot(week=1)
+
+        control = Lecture.objects.exclude(id__in=[6, 7]).filter(weeks__number=1)
+        lectures = [l for l in snapshot.lectures if l.show_week and not l.exclude]
+        self.assertEquals(set(control), set(lectures))
+
+    def test_week_timetable(self):
+        snapshot = self.snapshot()
+        self.load(snapshot)
+
+        for week in snapshot.week_range:
+            with self.assertNumQueries(0):
+                timetable = snapshot.get_week_timetable(week)
+
+            control = self.snapshot(week=week).timetable
+            self.assertEquals(
+                sorted((l['i'], l['j'], l['k'], l['l'].id) for l in control.lectures),
+                sorted((l['i'], l['j'], l['k'], l['l'].id) for l in timetable.lectures))
+            self.assertEquals(control.date, timetable.date)
+
+    def test_query_count(self):
+        snapshot = self.snapshot()
+
+        with self.assertNumQueries(6):
+            self.load(snapshot)
+
+    def test_unknown_slug(self):
+        snapshot = self.snapshot('unknown')
+
+        with self.assertNumQueries(1):
+            self.load(snapshot)
+
+        self.assertEquals(None, snapshot.student)
+        self.assertEquals([], snapshot.lectures)
+        self.assertEquals([], snapshot.week_range)
+
+    def modified(self, slug):
+        return Subscription.objects.get_last_modified(2009, Semester.SPRING,
+                                                      slug)
+
+    def test_cached(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        modified = self.modified('adamcik')
+        snapshot = ScheduleSnapshot.cached(semester, 'adamcik', 1, modified)
+
+        with self.assertNumQueries(0):
+            cached = ScheduleSnapshot.cached(semester, 'adamcik', 1, modified)
+            self.load(cached)
+            cached.timetable
+
+        self.assertEquals(snapshot.timetable.table, cached.timetable.table)
+        self.assertEquals(snapshot.timetable.span, cached.timetable.span)
+
+        with self.assertNumQueries(6):
+            ScheduleSnapshot.cached(semester, 'adamcik', 2, modified)
+
+    def test_invalidate(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        adamcik, foo = self.modified('adamcik'), self.modified('foo')
+        ScheduleSnapshot.cached(semester, 'adamcik', modified=adamcik)
+        ScheduleSnapshot.cached(semester, 'foo', modified=foo)
+
+        ScheduleSnapshot.invalidate('adamcik')
+
+        with self.assertNumQueries(6):
+            ScheduleSnapshot.cached(semester, 'adamcik', modified=adamcik)
+        with self.assertNumQueries(0):
+            ScheduleSnapshot.cached(semester, 'foo', modified=foo)
+
+        ScheduleSnapshot.invalidate()
+
+        with self.assertNumQueries(6):
+            ScheduleSnapshot.cached(semester, 'foo', modified=foo)
+
+    def test_modified(self):
+        semester = Semester.objects.get(year=2009, type=Semester.SPRING)
+        ScheduleSnapshot.cached(semester, 'adamcik')
+
+        # Changes made by other processes only show up in the database.
+        Lecture.objects.filter(course__code='COURSE1').delete()
+        Subscription.objects.touch(2009, Semester.SPRING, 'adamcik')
+
+        snapshot = ScheduleSnapshot.cached(semester, 'adamcik')
+        self.assertFalse([l for l in snapshot.lectures
+                          if l.course.code == 'COURSE1'])
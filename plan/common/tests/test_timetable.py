@@ -1,11 +1,22 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import random
 from copy import copy
 
 from plan.common.tests import BaseTestCase
+from plan.common.tests.benchmarks import ReferenceTimetable, random_lectures
 from plan.common.models import Lecture, Semester
 from plan.common.timetable import Timetable
 
+
+def build(cls, lectures):
+    timetable = cls(lectures)
+    timetable.place_lectures()
+    timetable.do_expansion()
+    timetable.insert_times()
+    timetable.add_markers()
+    return timetable
+
 class TimetableTestCase(BaseTestCase):
     maxDiff = None
     fixtures = ['test_data.json', 'test_user.json']
@@ -69,3 +80,44 @@ class TimetableTestCase(BaseTestCase):
 
         for i, (t, r) in enumerate(zip(timetable.table, rows)):
             self.assertEquals(t, r)
+
+
+class TimetableLayoutTestCase(BaseTestCase):
+    def test_map_to_slot(self):
+        timetable = Timetable([])
+        reference = ReferenceTimetable([])
+
+        for lecture in random_lectures(500, seed=1):
+            self.assertEquals(reference.map_to_slot(lecture),
+                              timetable.map_to_slot(lecture))
+
+    def test_equivalent_to_reference(self):
+        # Lectures should end up exactly where the old row search would have
+        # put them, whatever order they come in.
+        for seed in xrange(50):
+            rand = random.Random(seed)
+            lectures = random_lectures(rand.randint(0, 300), seed=seed)
+
+            timetable = build(Timetable, lectures)
+            reference = build(ReferenceTimetable, lectures)
+
+            self.assertEquals(reference.span, timetable.span)
+            self.assertEquals(reference.lectures, timetable.lectures)
+            self.assertEquals(reference.table, timetable.table)
+
+    def test_no_overlap(self):
+        for seed in xrange(50):
+            lectures = random_lectures(200, seed=seed)
+            timetable = build(Timetable, lectures)
+
+            # All lectures should be placed without overlapping.
+            seen = set()
+            for lecture in timetable.lectures:
+                for slot in xrange(lecture['i'], lecture['i']+lecture['height']):
+                    for column in xrange(lecture['k'], lecture['k']+lecture['width']):
+                        cell = (slot, lecture['j'], column)
+                        self.assert_(cell not in seen)
+                        seen.add(cell)
+
+            placed = [l for l in lectures if not l.exclude and l.show_week]
+            self.assertEquals(len(placed), len(timetable.lectures))
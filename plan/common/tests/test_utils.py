@@ -3,7 +3,8 @@
 from django.conf import settings
 
 from plan.common.tests import BaseTestCase
-from plan.common.utils import ColorMap, compact_sequence
+from plan.common.utils import (ColorMap, compact_sequence, mask_to_weeks,
+                               weeks_to_mask)
 
 class UtilTestCase(BaseTestCase):
     fixtures = ['test_data.json']
@@ -34,3 +35,12 @@ class UtilTestCase(BaseTestCase):
 
         seq = compact_sequence([])
         self.assertEquals(seq, [])
+
+    def test_week_mask(self):
+        self.assertEquals(weeks_to_mask([]), 0)
+        self.assertEquals(weeks_to_mask([1, 2]), 6)
+        self.assertEquals(mask_to_weeks(0), [])
+        self.assertEquals(mask_to_weeks(6), [1, 2])
+
+        weeks = [1, 2, 3, 10, 33, 52, 53]
+        self.assertEquals(mask_to_weeks(weeks_to_mask(weeks)), weeks)
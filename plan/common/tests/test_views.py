@@ -1,10 +1,16 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import datetime
+import json
+
 from django.utils.datastructures import MultiValueDict
 from django.core.urlresolvers import reverse
 
+from plan.common import fulltext
+from plan.common.catalog import CourseCatalog
 from plan.common.tests import BaseTestCase
-from plan.common.models import Semester, Group, Subscription, Lecture, Deadline
+from plan.common.models import (Course, Semester, Group, Subscription, Lecture,
+    Deadline, SignupHistory)
 
 class EmptyViewTestCase(BaseTestCase):
     def test_index(self):
@@ -74,6 +80,27 @@ class ViewTestCase(BaseTestCase):
             self.assertEquals(response.status_code, 200)
             self.assertTemplateUsed(response, 'schedule.html')
 
+    def test_schedule_conditional(self):
+        url = self.url('schedule')
+
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assert_(response.has_header('Last-Modified'))
+
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        last_modified = response['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+
+        self.client.post(self.url('change-lectures'), {'exclude': ('2',)})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(etag, response['ETag'])
+
     def test_change_course(self):
         # FIXME test semester does not exist
         # FIXME test ie handling
@@ -177,6 +204,94 @@ class ViewTestCase(BaseTestCase):
 
             lectures = new_lectures
 
+    def test_about(self):
+        SignupHistory.objects.rebuild()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('about'))
+        self.assertEquals(200, response.status_code)
+
+        data = json.loads(response.context['data'])
+        self.assertEquals(2, len(data['series']))
+        self.assertEquals(3, data['series'][0][-1][1])
+        self.assertEquals(1, data['series'][1][-1][1])
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse('about'))
+
+    def test_signup_history(self):
+        SignupHistory.objects.rebuild()
+        self.assertEquals([3, 1], [h.count for h in
+                                   SignupHistory.objects.order_by('semester')])
+
+        url = self.url('change-course', self.semester.year,
+                       self.semester.type, 'newstudent')
+        self.client.post(url, {'submit_add': True, 'course_add': 'COURSE1'})
+        self.client.post(url, {'submit_add': True, 'course_add': 'COURSE2'})
+
+        history = SignupHistory.objects.get(semester__year=2009,
+                                            semester__type=Semester.SPRING,
+                                            date=datetime.date(2009, 1, 1))
+        self.assertEquals(1, history.count)
+
+        # Coming back after removing every course is not a new signup.
+        course_ids = Subscription.objects.filter(
+            student__slug='newstudent').values_list('course_id', flat=True)
+        self.client.post(url, {'submit_remove': True,
+                               'course_remove': list(course_ids)})
+        self.client.post(url, {'submit_add': True, 'course_add': 'COURSE1'})
+
+        history = SignupHistory.objects.get(pk=history.pk)
+        self.assertEquals(1, history.count)
+
+        SignupHistory.objects.rebuild()
+        self.assertEquals(1, SignupHistory.objects.get(
+            semester__year=2009, semester__type=Semester.SPRING,
+            date=datetime.date(2009, 1, 1)).count)
+
+    def test_course_catalog(self):
+        catalog = CourseCatalog.get(self.semester.year, self.semester.type)
+        url = reverse('course-catalog', args=[self.semester.year,
+                self.semester.slug, catalog.digest])
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('gzip', response['Content-Encoding'])
+        self.assertEquals(catalog.compressed, response.content)
+        self.assert_('max-age=31536000' in response['Cache-Control'])
+
+        response = self.client.get(url)
+        courses = json.loads(response.content)
+        self.assertEquals([u'COURSE1', u'Course 1 full name', [], [u'foo']],
+                          courses[0])
+        self.assertEquals(4, len(courses))
+
+        # Same content gives the same digest even after invalidating
+        CourseCatalog.invalidate(self.semester.year, self.semester.type)
+        response = self.client.get(url)
+        self.assertEquals(200, response.status_code)
+
+        Course.objects.filter(pk=1).update(name='Something else')
+        CourseCatalog.invalidate(self.semester.year, self.semester.type)
+        new_catalog = CourseCatalog.get(self.semester.year, self.semester.type)
+        self.assert_(catalog.digest != new_catalog.digest)
+
+        response = self.client.get(url)
+        self.assertEquals(302, response.status_code)
+        self.assert_(response['Location'].endswith(
+            '+%s.json' % new_catalog.digest))
+
+    def test_course_catalog_last_import(self):
+        catalog = CourseCatalog.get(self.semester.year, self.semester.type)
+
+        # Scrapes in other processes can't reach a per-process cache.
+        Course.objects.filter(pk=1).update(name='Something else')
+        Semester.objects.filter(year=2009, type=Semester.SPRING).update(
+            last_import=datetime.datetime.now())
+
+        new_catalog = CourseCatalog.get(self.semester.year, self.semester.type)
+        self.assertNotEquals(catalog.digest, new_catalog.digest)
+
     def test_course_query(self):
         url = reverse('course-query', args=[self.semester.year,
                 self.semester.type])
@@ -188,8 +303,24 @@ class ViewTestCase(BaseTestCase):
         response = self.client.get(url, {'q': 'COURSE'})
         lines = response.content.split('\n')
 
-        self.assertEquals("COURSE1|Course 1 full name", lines[0])
-        self.assertEquals("COURSE2|Course 2 full name", lines[1])
+        # Equally good matches are ordered by number of subscriptions
+        self.assertEquals("COURSE2|Course 2 full name", lines[0])
+        self.assertEquals("COURSE1|Course 1 full name", lines[1])
         self.assertEquals("COURSE3|Course 3 full name", lines[2])
         self.assertEquals("COURSE4|Course 4 full name", lines[3])
 
+        response = self.client.get(url, {'q': 'COURSE4'})
+        self.assertEquals("COURSE4|Course 4 full name\n", response.content)
+
+    def test_course_query_database(self):
+        url = reverse('course-query', args=[self.semester.year,
+                self.semester.type])
+        fulltext.sync()
+
+        with self.settings(TIMETABLE_COURSE_SEARCH='database'):
+            response = self.client.get(url, {'q': 'cour 4'})
+            self.assertEquals("COURSE4|Course 4 full name\n", response.content)
+
+            response = self.client.get(url, {'q': 'COURSE', 'l': 'x'})
+            self.assertEquals("", response.content)
+
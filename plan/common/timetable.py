@@ -1,5 +1,6 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import bisect
 import datetime
 
 from django.conf import settings
@@ -11,6 +12,18 @@ from plan.common.models import Lecture
 SLOT_END_TIMES = map(lambda s: s[1], settings.TIMETABLE_SLOTS)
 
 
+class _Placement(object):
+    """Where in the timetable a lecture ended up."""
+    __slots__ = ('lecture', 'day', 'start', 'end', 'row')
+
+    def __init__(self, lecture, start, end):
+        self.lecture = lecture
+        self.day = lecture.day
+        self.start = start
+        self.end = end
+        self.row = None
+
+
 class Timetable:
     slots = len(settings.TIMETABLE_SLOTS)
 
@@ -32,98 +45,91 @@ class Timetable:
     def place_lectures(self):
         '''Add basics to datastructure'''
 
-        for i, lecture in enumerate(self.lecture_queryset):
+        # Put each lecture in the leftmost row with room for it, in the order
+        # lectures are given, like the row search this replaces. Slots used
+        # in each row are kept as a bitmask so checking a row is a single
+        # operation instead of a rescan of its cells. Going through lectures
+        # by start time would need fewer rows at times, but would move them
+        # around for the course ordered lectures we get.
+        placements = []
+
+        # Per day: occupant of each slot and row, -1 for free cells.
+        self.grid = [[] for i in Lecture.DAYS]
+        used = [[] for i in Lecture.DAYS]
+
+        for lecture in self.lecture_queryset:
             if lecture.exclude or not lecture.show_week:
                 continue
-
             start, end = self.map_to_slot(lecture)
-            rowspan = end - start + 1
-
-            first = start
-
-            # Try to find leftmost row that can fit our lecture, if we run out of
-            # rows to test, ie IndexError, we append a fresh one to work with
-            try:
-                row = 0
-                while start <= end:
-                    if self.table[start][lecture.day][row]:
-                        # One of our time slots is taken, bump the row number and
-                        # restart our search
-                        row += 1
-                        start = first
-                    else:
-                        start += 1
-
-            except IndexError:
-                # We ran out of rows to check, simply append a new row
-                for j in range(self.slots):
-                    self.table[j][lecture.day].append({})
-
-                # Update the header colspan
-                self.span[lecture.day] += 1
-
-            start = first
-            remove = False
-
-            while start <= end:
-                # Replace the cell we found with a base containing info about our
-                # lecture
-                self.table[start][lecture.day][row] = {
-                    'lecture': lecture,
+            if start > end:
+                continue
+
+            p = _Placement(lecture, start, end)
+            mask = ((1 << (end - start + 1)) - 1) << start
+
+            rows = used[p.day]
+            for row, row_mask in enumerate(rows):
+                if not row_mask & mask:
+                    p.row = row
+                    break
+            else:
+                p.row = len(rows)
+                rows.append(0)
+                self.grid[p.day].append([-1] * self.slots)
+
+            rows[p.row] |= mask
+            self.grid[p.day][p.row][start:end+1] = [len(placements)] * (end-start+1)
+            placements.append(p)
+
+        self.placements = placements
+
+        # Build all the cells in one go now that we know the number of rows.
+        for day, rows in enumerate(self.grid):
+            self.span[day] = max(1, len(rows))
+        self.table = [[[{} for k in xrange(self.span[j])] for j, name in Lecture.DAYS]
+                      for i in xrange(self.slots)]
+
+        for p in placements:
+            rowspan = p.end - p.start + 1
+            for slot in xrange(p.start, p.end+1):
+                self.table[slot][p.day][p.row] = {
+                    'lecture': p.lecture,
                     'rowspan': rowspan,
-                    'remove': remove,
-                    'bottom': start+rowspan == len(self.table)
+                    'remove': slot != p.start,
+                    'bottom': slot+rowspan == self.slots,
                 }
 
-                # Add lecture to our supplementary data structure and set the
-                # remove flag.
-                if not remove:
-                    remove = True
-                    self.lectures.append({
-                        'height': rowspan,
-                        'i': start,
-                        'j': lecture.day,
-                        'k': row,
-                        'l': lecture,
-                    })
-
-                start += 1
+            self.lectures.append({
+                'height': rowspan,
+                'i': p.start,
+                'j': p.day,
+                'k': p.row,
+                'l': p.lecture,
+            })
 
     def do_expansion(self):
-        for lecture in self.lectures:
-            # Loop over supplementary data structure using this to figure out which
-            # colspan expansions are safe
-            i = lecture['i']
-            j = lecture['j']
-            k = lecture['k']
-
-            height = lecture['height']
+        # Claimed cells are marked with the number of rows in use, so later
+        # lectures in the same day can not expand into them.
+        for lecture, p in zip(self.lectures, self.placements):
+            rows = self.grid[p.day]
+            height = p.end - p.start + 1
+            claimed = [len(rows)] * height
 
             expand_by = 1
-
-            # Find safe expansion of colspan
-            safe = True
-            for l in xrange(k+1, len(self.table[i][j])):
-                for m in xrange(i, i+height):
-                    if self.table[m][j][l]:
-                        safe = False
-                        break
-                if safe:
-                    expand_by += 1
-                else:
+            for column in rows[p.row+1:]:
+                if column[p.start:p.end+1].count(-1) != height:
                     break
+                column[p.start:p.end+1] = claimed
+                for slot in xrange(p.start, p.end+1):
+                    self.table[slot][p.day][p.row+expand_by]['remove'] = True
+                expand_by += 1
 
-            self.table[i][j][k]['colspan'] = expand_by
+            cell = self.table[p.start][p.day][p.row]
+            cell['colspan'] = expand_by
             lecture['width'] = expand_by
 
-            if k+expand_by == len(self.table[i][j]):
-                self.table[i][j][k]['last'] = True
-
-            # Remove cells that will get replaced by colspan
-            for l in xrange(k+1, k+expand_by):
-                for m in xrange(i, i+height):
-                    self.table[m][j][l]['remove'] = True
-
+            if p.row+expand_by == self.span[p.day]:
+                cell['last'] = True
 
     def add_markers(self):
         for row in self.table:
@@ -141,20 +147,12 @@ class Timetable:
             self.table[i].insert(0, [{'time': '%s - %s' % (start, end)}])
 
     def map_to_slot(self, lecture):
-        start, end = None, None
-
-        for i, time in enumerate(SLOT_END_TIMES):
-            if start is None and lecture.start < time:
-                start = i
-
-            if end is None and lecture.end <= time:
-                end = i
-
-        if end is None and lecture.end > time:
-            end = i
+        # First slot ending after the start, and first slot ending at or
+        # after the end, clamped to the last slot.
+        start = bisect.bisect_right(SLOT_END_TIMES, lecture.start)
+        end = bisect.bisect_left(SLOT_END_TIMES, lecture.end)
 
         message = '%s slot for %s could not be set.'
-        assert start is not None, message % ('Start', lecture.id)
-        assert end is not None, message % ('End', lecture.id)
+        assert start < self.slots, message % ('Start', lecture.id)
 
-        return (start, end)
+        return (start, min(end, self.slots - 1))
@@ -8,6 +8,7 @@ urlpatterns = [
     url(r'^{year}/{semester}/$', getting_started, name='semester'),
 
     url(r'^{year}/{semester}/\+$', course_query, name='course-query'),
+    url(r'^{year}/{semester}/\+{digest}\.json$', course_catalog, name='course-catalog'),
 
     url(r'^{year}/{semester}/{slug}/$', schedule, {'all': True}, name='schedule'),
     url(r'^{year}/{semester}/{slug}/\+$', schedule, {'advanced': True}, name='schedule-advanced'),
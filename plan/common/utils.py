@@ -1,6 +1,7 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
 import datetime
+import hashlib
 import operator
 import time
 
@@ -8,9 +9,13 @@ from django import http
 from django import template
 from django.conf import settings
 from django.conf import urls
+from django.core import cache
 from django.db import models
 from django.utils import text as text_utils
 from django.utils import http as http_utils
+from django.utils import timezone
+from django.utils import translation
+from django.views.decorators import http as http_decorators
 
 # Collection of capture groups used in urls.
 url_aliases = {'year': r'(?P<year>\d{4})',
@@ -18,7 +23,8 @@ url_aliases = {'year': r'(?P<year>\d{4})',
                'slug': r'(?P<slug>[a-z0-9-_]{1,50})',
                'week': r'(?P<week>\d{1,2})',
                'size': r'(?P<size>A\d)',
-               'ical': r'(?P<ical_type>\w+)'}
+               'ical': r'(?P<ical_type>\w+)',
+               'digest': r'(?P<digest>[0-9a-f]{12})'}
 
 
 def url(regexp, *args, **kwargs):
@@ -36,10 +42,46 @@ def expires_in(timeout):
     return decorator
 
 
-def build_search(searchstring, filters, max_query_length=4,
-                 combine=operator.and_):
-    count = 0
-    search_filter = models.Q()
+def conditional(last_modified_func):
+    """Add ETag, Last-Modified and 304 support to a view.
+
+       last_modified_func gets the same arguments as the view and should
+       return when the data behind the response last changed, or None to
+       always render the response.
+    """
+    def last_modified(request, *args, **kwargs):
+        if not hasattr(request, '_timetable_last_modified'):
+            value = last_modified_func(request, *args, **kwargs)
+            if value is not None and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            request._timetable_last_modified = value
+        return request._timetable_last_modified
+
+    def etag(request, *args, **kwargs):
+        value = last_modified(request, *args, **kwargs)
+        if value is None:
+            return None
+
+        # Output also depends on url, language and hostname, and the full
+        # timestamp covers changes within the same second.
+        key = u'|'.join([value.isoformat(),
+                         request.get_full_path(),
+                         translation.get_language() or u'',
+                         request.META.get('HTTP_HOST', u'')])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    return http_decorators.condition(etag_func=etag,
+                                     last_modified_func=last_modified)
+
+
+def get_last_modified(request):
+    """Last modified time found by conditional() for this request, if any."""
+    return getattr(request, '_timetable_last_modified', None)
+
+
+def split_search(searchstring, max_query_length=4):
+    """Split search string into words, stripping quotes around phrases."""
+    words = []
 
     for word in text_utils.smart_split(searchstring):
         if word[0] in ['"', "'"]:
@@ -48,19 +90,45 @@ def build_search(searchstring, filters, max_query_length=4,
             else:
                 word = word[1:]
 
-        if count > max_query_length:
+        if len(words) > max_query_length:
             break
 
+        words.append(word)
+
+    return words
+
+
+def build_search(searchstring, filters, max_query_length=4,
+                 combine=operator.and_):
+    search_filter = models.Q()
+
+    for word in split_search(searchstring, max_query_length):
         local_filter = models.Q()
         for f in filters:
             local_filter |= models.Q(**{f: word})
 
         search_filter = combine(search_filter, local_filter)
-        count += 1
 
     return search_filter
 
 
+def initial_version():
+    """Starting value for cache version counters.
+
+       Counters that fall out of the cache restart from the current time so
+       they never reuse a value that might still be part of a cached key.
+    """
+    return int(time.time() * 1000)
+
+
+def bump_version(key):
+    """Increment cache version counter, restarting it if it is missing."""
+    try:
+        cache.cache.incr(key)
+    except ValueError:
+        cache.cache.set(key, initial_version(), None)
+
+
 def server_error(request, template_name='500.html'):
     """
     500 error handler.
@@ -137,6 +205,26 @@ class ColorMap(dict):
             return super(ColorMap, self).__getitem__(k)
 
 
+def weeks_to_mask(weeks):
+    '''Pack week numbers into an integer with one bit per week'''
+    mask = 0
+    for week in weeks:
+        mask |= 1 << int(week)
+    return mask
+
+
+def mask_to_weeks(mask):
+    '''Unpack integer from weeks_to_mask() into a sorted list of weeks'''
+    weeks = []
+    week = 0
+    while mask:
+        if mask & 1:
+            weeks.append(week)
+        mask >>= 1
+        week += 1
+    return weeks
+
+
 def max_number_of_weeks(year):
     # dec. 28 is always on the last week if the year.
     return datetime.date(int(year), 12, 28).isocalendar()[1]
@@ -7,17 +7,23 @@ import logging
 from django import http
 from django import shortcuts
 from django.conf import settings
-from django.db import connection, transaction
+from django.core import cache
+from django.db import transaction
+from django.utils import cache as cache_utils
 from django.utils import html
 from django.utils import text
 
-from plan.common.models import (Course, Deadline, Exam, Group, Lecture,
-    Location, Semester, Subscription, Room, Lecturer, Week, Student)
+from plan.common.models import (Course, Deadline, Lecture, Semester,
+    SemesterStats, SignupHistory, Subscription, SubscriptionLecture, Student)
+from plan.common.catalog import CourseCatalog
+from plan.common.registry import semesters
+from plan.common.search import CourseIndex
+from plan.common.snapshot import ScheduleSnapshot
 
 from plan.common import forms
-from plan.common import timetable
 from plan.common import utils
 from plan.common.templatetags import slugify
+from plan.ical import static
 
 # FIXME split into frontpage/semester, course, schedule files
 # FIXME Split views that do multiple form handling tasks into seperate views
@@ -34,7 +40,7 @@ get_current_week = lambda: (now() + datetime.timedelta(days=2)).isocalendar()[1]
 @utils.expires_in(3600)
 def frontpage(request):
     try:
-        semester = Semester.objects.active()
+        semester = semesters.active()
     except Semester.DoesNotExist:
         raise http.Http404
     return shortcuts.redirect('semester', semester.year, semester.slug)
@@ -44,7 +50,7 @@ def frontpage(request):
 def shortcut(request, slug):
     '''Redirect users to their timetable for the current semester'''
     try:
-        semester = Semester.objects.active()
+        semester = semesters.active()
     except Semester.DoesNotExist:
         raise http.Http404
     return schedule_current(request, semester.year, semester.type, slug)
@@ -54,12 +60,12 @@ def shortcut(request, slug):
 def getting_started(request, year, semester_type):
     '''Intial top level page that greets users'''
     try:
-        semester = Semester.objects.get(year=year, type=semester_type)
+        semester = semesters.get(year, semester_type)
     except Semester.DoesNotExist:
         raise http.Http404
 
     try:
-        next_semester = Semester.objects.next()
+        next_semester = semesters.next()
     except Semester.DoesNotExist:
         next_semester = None
 
@@ -88,7 +94,10 @@ def getting_started(request, year, semester_type):
 
 
 def course_query(request, year, semester_type):
-    limit = min(request.GET.get('limit', '10'), settings.TIMETABLE_AJAX_LIMIT)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), settings.TIMETABLE_AJAX_LIMIT)
+    except ValueError:
+        limit = 10
     query = request.GET.get('q', '').strip()[:100]
     location = request.GET.get('l', '')
     send_json = request.META.get('HTTP_ACCEPT') == 'application/json'
@@ -99,11 +108,17 @@ def course_query(request, year, semester_type):
         response = http.HttpResponse(content_type='text/plain; charset=utf-8')
 
     if not query:
-        courses = Course.objects.none()
+        course_list = []
+    elif settings.TIMETABLE_COURSE_SEARCH == 'database':
+        try:
+            courses = Course.objects.search(year, semester_type, query, limit,
+                                            location)
+            course_list = [(c.code, c.name) for c in courses]
+        except ValueError:  # Location that is not a number.
+            course_list = []
     else:
-        courses = Course.objects.search(year, semester_type, query, limit, location)
-
-    course_list = list(courses.values_list('code', 'name'))
+        index = CourseIndex.get(int(year), semester_type)
+        course_list = index.search(query, limit, location)
 
     if send_json:
         json.dump(course_list, response)
@@ -115,22 +130,56 @@ def course_query(request, year, semester_type):
     return response
 
 
+def course_catalog(request, year, semester_type, digest):
+    catalog = CourseCatalog.get(int(year), semester_type)
+
+    if digest != catalog.digest:
+        response = shortcuts.redirect('course-catalog', year,
+                                      Semester.localize(semester_type),
+                                      catalog.digest)
+        cache_utils.add_never_cache_headers(response)
+        return response
+
+    response = http.HttpResponse(content_type='application/json')
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response['Content-Encoding'] = 'gzip'
+        response.content = catalog.compressed
+    else:
+        response.content = catalog.content
+
+    cache_utils.patch_response_headers(response, settings.TIMETABLE_CATALOG_MAX_AGE)
+    cache_utils.patch_cache_control(response, public=True)
+    cache_utils.patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
 def schedule_current(request, year, semester_type, slug):
     semester = Semester(year=year, type=semester_type)
     current_week = get_current_week()
 
-    weeks = Week.objects.filter(
-        lecture__course__subscription__student__slug=slug,
-        lecture__course__semester__year__exact=semester.year,
-        lecture__course__semester__type=semester.type)
-    weeks = weeks.distinct().values_list('number', flat=True)
+    lectures = Lecture.objects.filter(
+        course__subscription__student__slug=slug,
+        course__semester__year__exact=semester.year,
+        course__semester__type=semester.type)
+    lectures = lectures.extra(where=['(common_lecture.week_mask & %s) != 0'],
+                              params=[1 << current_week])
 
-    if current_week in weeks and semester.year == today().year:
+    if semester.year == today().year and lectures.exists():
         return shortcuts.redirect(
             'schedule-week', semester.year, semester.slug, slug, current_week)
     return shortcuts.redirect('schedule', semester.year, semester.slug, slug)
 
 
+def schedule_last_modified(request, year, semester_type, slug, **kwargs):
+    modified = Subscription.objects.get_last_modified(year, semester_type, slug)
+    if modified is None:
+        return None
+
+    # Pages point out the current week so they also change from day to day.
+    return max(modified, datetime.datetime.combine(today(), datetime.time()))
+
+
+@utils.conditional(schedule_last_modified)
 def schedule(request, year, semester_type, slug, advanced=False,
              week=None, all=False):
     '''Page that handels showing schedules'''
@@ -146,38 +195,14 @@ def schedule(request, year, semester_type, slug, advanced=False,
     color_map = utils.ColorMap(hex=True)
 
     try:
-        semester = Semester.objects.get(year=year, type=semester_type)
+        semester = semesters.get(year, semester_type)
     except Semester.DoesNotExist:
         raise http.Http404
 
-    try:
-        student = Student.objects.distinct().get(slug=slug, subscription__course__semester=semester)
-    except Student.DoesNotExist:
-        student = None
-
-    # Start setting up queries
-    courses = Course.objects.get_courses(year, semester.type, slug)
-    lectures = Lecture.objects.get_lectures(year, semester.type, slug, week)
-    exams = {}
-    for exam in Exam.objects.get_exams(year, semester.type, slug):
-        exams.setdefault(exam.course_id, []).append(exam)
-
-    # Use get_related to cut query counts
-    lecturers = Lecture.get_related(Lecturer, lectures)
-    groups = Lecture.get_related(Group, lectures, fields=['code'])
-    rooms = Lecture.get_related(Room, lectures, fields=['name', 'url'])
-    weeks = Lecture.get_related(Week, lectures, fields=['number'], use_extra=False)
-
-    schedule_weeks = set()
-    for lecture_week_set in weeks.values():
-        for lecture_week in lecture_week_set:
-            schedule_weeks.add(lecture_week)
-
-    schedule_weeks = list(schedule_weeks)
-    schedule_weeks.sort()
-
-    if schedule_weeks:
-        schedule_weeks = range(schedule_weeks[0], schedule_weeks[-1]+1)
+    snapshot = ScheduleSnapshot.cached(semester, slug, week,
+                                       utils.get_last_modified(request))
+    courses = snapshot.courses
+    lectures = snapshot.lectures
 
     next_week = None
     prev_week = None
@@ -193,22 +218,12 @@ def schedule(request, year, semester_type, slug, advanced=False,
     for c in courses:
         color_map[c.id]
 
-    # Create Timetable
-    table = timetable.Timetable(lectures)
-
-    if week:
-        table.set_week(semester.year, week)
-
-    if lectures:
-        table.place_lectures()
-        table.do_expansion()
-
+    # Timetable comes placed and expanded, just add localised bits.
+    table = snapshot.timetable
     table.insert_times()
     table.add_markers()
 
     if advanced:
-        subscriptions = Subscription.objects.get_subscriptions(year, semester.type, slug)
-
         # Set up and course name forms
         for course in courses:
             alias = course.alias or ''
@@ -216,7 +231,7 @@ def schedule(request, year, semester_type, slug, advanced=False,
                 initial={'alias': alias}, prefix=course.id)
 
     try:
-        next_semester = Semester.objects.next()
+        next_semester = semesters.next()
         next_message = Subscription.objects.get_subscriptions(
             next_semester.year, next_semester.type, slug).count() == 0
     except Semester.DoesNotExist:
@@ -224,7 +239,8 @@ def schedule(request, year, semester_type, slug, advanced=False,
         next_message = False
 
     week_is_current = semester.year == today().year and week == current_week
-    locations = Location.objects.filter(course__semester=semester).distinct()
+    locations = semesters.locations(semester)
+    catalog = CourseCatalog.get(semester.year, semester.type)
 
     return shortcuts.render(request, 'schedule.html', {
             'advanced': advanced,
@@ -233,7 +249,7 @@ def schedule(request, year, semester_type, slug, advanced=False,
             'courses': courses,
             'current': (week == current_week),
             'current_week': current_week,
-            'exams': exams,
+            'exams': snapshot.exams_by_course,
             'next_message': next_message,
             'lectures': lectures,
             'semester': semester,
@@ -244,13 +260,14 @@ def schedule(request, year, semester_type, slug, advanced=False,
             'week': week,
             'next_week': next_week,
             'prev_week': prev_week,
-            'rooms': rooms,
-            'weeks': schedule_weeks,
-            'groups': groups,
-            'lecturers': lecturers,
-            'lecture_weeks': weeks,
-            'student': student,
+            'rooms': snapshot.rooms,
+            'weeks': snapshot.week_range,
+            'groups': snapshot.groups,
+            'lecturers': snapshot.lecturers,
+            'lecture_weeks': snapshot.weeks,
+            'student': snapshot.student,
             'locations': locations,
+            'catalog_digest': catalog.digest,
         })
 
 
@@ -275,6 +292,12 @@ def select_groups(request, year, semester_type, slug):
 
                     subscription.groups = group_form.cleaned_data['groups']
 
+            SubscriptionLecture.objects.refresh(
+                Subscription.objects.get_subscriptions(year, semester_type, slug))
+            ScheduleSnapshot.invalidate(slug)
+            static.discard(year, semester_type, slug)
+            Subscription.objects.touch(year, semester_type, slug)
+
             return shortcuts.redirect(
                 'schedule-advanced', year, Semester.localize(semester_type), slug)
 
@@ -307,6 +330,7 @@ def select_groups(request, year, semester_type, slug):
         })
 
 
+@transaction.atomic
 def select_course(request, year, semester_type, slug, add=False):
     '''Handle selecting of courses from course list, change of names and
        removeall of courses'''
@@ -314,12 +338,16 @@ def select_course(request, year, semester_type, slug, add=False):
     # FIXME split ut three sub functions into seperate functions?
 
     try:
-        semester = Semester.objects.get(year=year, type=semester_type)
+        semester = semesters.get(year, semester_type)
     except Semester.DoesNotExist:
         return shortcuts.redirect(
             'schedule', year, Semester.localize(semester_type), slug)
 
     if request.method == 'POST':
+        ScheduleSnapshot.invalidate(slug)
+        static.discard(year, semester_type, slug)
+        Subscription.objects.touch(year, semester_type, slug)
+
         if 'submit_add' in request.POST or add:
             lookup = []
 
@@ -338,6 +366,8 @@ def select_course(request, year, semester_type, slug, add=False):
             to_many_subscriptions = False
 
             student, created = Student.objects.get_or_create(slug=slug)
+            signed_up = bool(subscriptions)
+            added = []
 
             for l in lookup:
                 try:
@@ -351,15 +381,21 @@ def select_course(request, year, semester_type, slug, add=False):
                             semester__type__exact=semester_type,
                         )
 
-                    Subscription.objects.get_or_create(
+                    subscription, created = Subscription.objects.get_or_create(
                             student=student,
                             course=course,
                         )
+                    if created:
+                        added.append(course.id)
                     subscriptions.add(course.code)
 
                 except Course.DoesNotExist:
                     errors.append(l)
 
+            SemesterStats.objects.update_stats(semester.pk, slug, added, 1)
+            if added and not signed_up:
+                SignupHistory.objects.record(semester.pk, slug, today())
+
             if errors or to_many_subscriptions:
                 return shortcuts.render(request, 'error.html', {
                         'courses': errors,
@@ -374,17 +410,21 @@ def select_course(request, year, semester_type, slug, add=False):
                 'change-groups', year, Semester.localize(semester_type), slug)
 
         elif 'submit_remove' in request.POST:
-            with transaction.atomic():
-                courses = []
-                for c in request.POST.getlist('course_remove'):
-                    if c.strip():
-                        courses.append(c.strip())
+            courses = []
+            for c in request.POST.getlist('course_remove'):
+                if c.strip():
+                    courses.append(c.strip())
+
+            removed = Subscription.objects.get_subscriptions(
+                year, semester_type, slug).filter(course__id__in=courses)
+            removed_ids = list(removed.values_list('course_id', flat=True))
+            removed.delete()
 
-                Subscription.objects.get_subscriptions(year, semester_type, slug). \
-                        filter(course__id__in=courses).delete()
+            SemesterStats.objects.update_stats(
+                semester.pk, slug, removed_ids, -1)
 
-                if Subscription.objects.filter(student__slug=slug).count() == 0:
-                    Student.objects.filter(slug=slug).delete()
+            if Subscription.objects.filter(student__slug=slug).count() == 0:
+                Student.objects.filter(slug=slug).delete()
 
         elif 'submit_name' in request.POST:
             subscriptions = Subscription.objects.get_subscriptions(year, semester_type, slug)
@@ -399,6 +439,10 @@ def select_course(request, year, semester_type, slug, add=False):
                         # Leave as blank if we match the current course name
                         alias = ""
 
+                    if u.alias != alias:
+                        CourseIndex.invalidate(int(year), semester_type)
+                        CourseCatalog.invalidate(int(year), semester_type)
+
                     u.alias = alias
                     u.save()
 
@@ -421,31 +465,32 @@ def select_lectures(request, year, semester_type, slug):
                 else:
                     subscription.exclude.clear()
 
+            SubscriptionLecture.objects.refresh(subscriptions)
+            ScheduleSnapshot.invalidate(slug)
+            static.discard(year, semester_type, slug)
+            Subscription.objects.touch(year, semester_type, slug)
+
     return shortcuts.redirect(
         'schedule-advanced', year, Semester.localize(semester_type), slug)
 
 
 def about(request):
+    # Everything here only changes once a day, so cache it until tomorrow.
+    key = 'about:%s' % today().isoformat()
+    context = cache.cache.get(key)
+    if context is None:
+        context = about_context()
+        tomorrow = datetime.datetime.combine(
+            today() + datetime.timedelta(days=1), datetime.time())
+        timeout = (tomorrow - now()).total_seconds()
+        cache.cache.set(key, context, max(1, int(timeout)))
+    return shortcuts.render(request, 'about.html', context)
+
+
+def about_context():
     # Limit ourselves to 400 buckets to display within 940px - i.e. 2.3 pixels per sample.
-    cursor = connection.cursor()
-    cursor.execute('''
-        SELECT CAST(EXTRACT(EPOCH FROM MAX(s.added)) -
-                    EXTRACT(EPOCH FROM MIN(s.added)) AS INTEGER)
-        FROM common_subscription s;''')
-    scale = cursor.fetchone()[0] / 400
-
     # Fetch number of new subcriptions per time bucket:
-    cursor.execute('''
-        SELECT COUNT(*), bucket, semester_id FROM (
-            SELECT
-                cast(EXTRACT(EPOCH FROM date_trunc('day', min(s.added))) / %s as integer) AS bucket,
-                s.student_id,
-                c.semester_id
-            FROM common_subscription s
-            JOIN common_course c ON (c.id = s.course_id)
-            GROUP BY s.student_id, c.semester_id
-        ) AS foo GROUP BY bucket, semester_id ORDER by semester_id, bucket;
-        ''' % scale)
+    scale, buckets = SignupHistory.objects.get_buckets(400)
 
     last_semester = None
     colors = utils.ColorMap(hex=True)
@@ -453,7 +498,7 @@ def about(request):
     x, y, max_x, first = 0, 0, 0, 0
 
     # Use zero indexing for x values to keep payload small.
-    for count, bucket, semester in cursor.fetchall():
+    for count, bucket, semester in buckets:
         if not first:
             first = bucket - 1
 
@@ -476,10 +521,10 @@ def about(request):
 
     # Pass on all data we need. First is needed to undo zero indexing, bucket
     # size is needed to rescale x values to proper epochs.
-    return shortcuts.render(request, 'about.html', {
+    return {
             'data':  html.mark_safe(json.dumps({
                 'series': series,
                 'fills': fills,
                 'first': first,
                 'scale': scale}, separators=(',',':'))),
-        })
+        }
@@ -0,0 +1,121 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Serialized events shared between students' feeds.
+
+   Students taking the same course with the same groups get identical
+   events, so each course's events are serialized once and cached as a
+   block. Feeds are then put together from blocks, dropping the lectures
+   each student has excluded.
+"""
+
+import collections
+import hashlib
+
+from django.conf import settings
+from django.core import cache
+from django.utils import translation
+
+from plan.ical import writer
+
+_ = translation.ugettext
+
+BLOCK_KEY = 'ical-block:%s'
+
+
+def block_key(kind, course, alias, rows, hostname, tzid):
+    """Key covering everything that ends up in a block.
+
+       rows should describe each item well enough that any change to the
+       item's data gives a new key, which means blocks never need to be
+       invalidated.
+    """
+    parts = [kind, unicode(course.id), course.code, course.name or u'',
+             alias or u'', hostname, tzid,
+             translation.get_language() or u''] + rows
+    return BLOCK_KEY % hashlib.sha1(
+        u'|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def get_blocks(blocks):
+    """Fetch blocks given as (key, render) pairs, rendering missing ones."""
+    result = cache.cache.get_many([key for key, render in blocks])
+
+    missing = {}
+    for key, render in blocks:
+        if key not in result:
+            result[key] = missing[key] = render()
+    if missing:
+        cache.cache.set_many(missing, settings.TIMETABLE_ICAL_CACHE_TIMEOUT)
+    return result
+
+
+def by_course(items):
+    courses = collections.OrderedDict()
+    for item in items:
+        courses.setdefault((item.course_id, item.alias), []).append(item)
+    return courses
+
+
+def lecture_events(snapshot, year, hostname, tzid):
+    """Serialized VEVENTs for a student's lectures."""
+    all_rooms = snapshot.room_names
+    all_weeks = snapshot.weeks
+
+    def render(lectures):
+        # Stamped with the data's age so every student gets the same bytes.
+        dtstamp = writer.format_utc(max(l.last_import for l in lectures))
+        return [(l.id, ''.join(writer.lecture_event(
+                    l, int(year), all_weeks[l.id], all_rooms.get(l.id, []),
+                    dtstamp, hostname, tzid)))
+                for l in lectures]
+
+    blocks, excluded = [], set()
+    lectures = [l for l in snapshot.lectures if l.id in all_weeks]
+    for (course_id, alias), course_lectures in by_course(lectures).items():
+        # Excluded lectures are part of the block so students in the same
+        # groups share it regardless of what they have excluded.
+        rows = [u'%d:%s:%d:%s:%s:%s' % (
+                    l.id, l.last_import.isoformat(), l.week_mask,
+                    u','.join(all_rooms.get(l.id, [])),
+                    l.type.name if l.type else u'',
+                    l.type.optional if l.type else u'')
+                for l in course_lectures]
+        key = block_key('lectures', course_lectures[0].course, alias, rows,
+                        hostname, tzid)
+        blocks.append((key, lambda l=course_lectures: render(l)))
+        excluded.update(l.id for l in course_lectures if l.exclude)
+
+    found = get_blocks(blocks)
+
+    events = []
+    for key, unused in blocks:
+        events.extend(event for lecture_id, event in found[key]
+                      if lecture_id not in excluded)
+    return events
+
+
+def exam_events(snapshot, hostname, tzid):
+    """Serialized VEVENTs for a student's exams."""
+    exam_label = _('Exam')
+
+    def render(exams):
+        dtstamp = writer.format_utc(max(e.last_import for e in exams))
+        return [''.join(writer.exam_event(e, dtstamp, hostname, tzid,
+                                          exam_label))
+                for e in exams]
+
+    blocks = []
+    for (course_id, alias), exams in by_course(snapshot.exams).items():
+        rows = [u'%d:%s:%s:%s' % (e.id, e.last_import.isoformat(),
+                                  e.type.code if e.type else u'',
+                                  e.type.name if e.type else u'')
+                for e in exams]
+        key = block_key('exams', exams[0].course, alias, rows, hostname, tzid)
+        blocks.append((key, lambda e=exams: render(e)))
+
+    found = get_blocks(blocks)
+
+    events = []
+    for key, unused in blocks:
+        events.extend(found[key])
+    return events
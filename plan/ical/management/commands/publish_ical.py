@@ -0,0 +1,38 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from django.conf import settings
+from django.core.management import base as management
+
+from plan.common.models import Semester
+from plan.ical import static
+
+
+class Command(management.BaseCommand):
+    help = 'Write iCal feeds that have changed to TIMETABLE_ICAL_STATIC_ROOT.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-y', '--year', action='store', dest='year', type=int,
+                            help='year to publish, default: current semester')
+        parser.add_argument('-t', '--type', action='store', dest='type',
+                            choices=dict(Semester.SEMESTER_TYPES).keys(),
+                            help='term to publish')
+        parser.add_argument('-f', '--force', action='store_true', dest='force',
+                            help='write feeds even if they are up to date')
+
+    def handle(self, **options):
+        if not settings.TIMETABLE_ICAL_STATIC_ROOT:
+            raise management.CommandError(
+                'TIMETABLE_ICAL_STATIC_ROOT has not been set.')
+
+        try:
+            if options['year'] or options['type']:
+                semester = Semester.objects.get(year=options['year'],
+                                                type=options['type'])
+            else:
+                semester = Semester.objects.active()
+        except Semester.DoesNotExist:
+            raise management.CommandError('Semester not found.')
+
+        count = static.publish(semester, force=options['force'])
+        self.stdout.write('Published iCal feeds for %d students in %s.' %
+                          (count, semester))
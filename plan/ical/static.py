@@ -0,0 +1,158 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Pre-generated feeds the web server can serve without involving Django.
+
+   Feeds are written below TIMETABLE_ICAL_STATIC_ROOT using the same layout
+   as their urls, so 2009/spring/adamcik/ical/ ends up in
+   2009/spring/adamcik/ical/index.ics. A web server can then try that file
+   before passing the request on to plan.ical.views.ical.
+
+   Files get the modification time of the data they were made from, which
+   is how later runs know which students need new files.
+"""
+
+import calendar
+import logging
+import os
+import shutil
+import socket
+import tempfile
+
+from django.conf import settings
+from django.core import urlresolvers
+from django.db import transaction
+from django.utils import timezone
+from django.utils import translation
+
+from plan.common.models import Semester, Subscription
+from plan.ical import views
+
+_ = translation.ugettext
+
+FILENAME = 'index.ics'
+
+logger = logging.getLogger('plan.ical.static')
+
+
+def enabled():
+    return bool(settings.TIMETABLE_ICAL_STATIC_ROOT)
+
+
+def get_resources():
+    """Resources to write files for, each giving one feed per student."""
+    return [None, _(u'lectures'), _(u'exams')]
+
+
+def get_semester_directory(semester):
+    """Directory holding the directories of every student in semester."""
+    path = urlresolvers.reverse('semester',
+                                args=[semester.year, semester.slug])
+    return os.path.join(settings.TIMETABLE_ICAL_STATIC_ROOT, path.strip('/'))
+
+
+def get_directory(semester, slug):
+    """Directory holding slug's feeds, matching the schedule's url."""
+    path = urlresolvers.reverse(
+        'schedule', args=[semester.year, semester.slug, slug])
+    return os.path.join(settings.TIMETABLE_ICAL_STATIC_ROOT, path.strip('/'))
+
+
+def get_path(semester, slug, ical_type=None):
+    args = [semester.year, semester.slug, slug]
+    if ical_type:
+        args.append(ical_type)
+    path = urlresolvers.reverse('schedule-ical', args=args)
+    return os.path.join(settings.TIMETABLE_ICAL_STATIC_ROOT,
+                        path.strip('/'), FILENAME)
+
+
+def write(path, chunks, timestamp):
+    """Atomically replace path with chunks, setting its mtime to timestamp."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+        # mkstemp only lets the owner read the file.
+        os.chmod(tmp, 0644)
+        os.utime(tmp, (timestamp, timestamp))
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def publish(semester, force=False):
+    """Write feeds for students in semester whose data has changed.
+
+       Returns the number of students that got new files.
+    """
+    hostname = settings.TIMETABLE_HOSTNAME or socket.getfqdn()
+    refresh = views.get_refresh(views.get_max_age(semester))
+    count = 0
+
+    modified = Subscription.objects.get_last_modified_by_slug(
+        semester.year, semester.type)
+
+    # Files are only written once, so use the site's default language.
+    with translation.override(settings.LANGUAGE_CODE):
+        for slug, value in sorted(modified.items()):
+            timestamp = calendar.timegm(
+                timezone.make_aware(value).utctimetuple())
+
+            paths = [(ical_type, get_path(semester, slug, ical_type))
+                     for ical_type in get_resources()]
+
+            if not force and all(os.path.exists(path) and
+                                 int(os.path.getmtime(path)) == timestamp
+                                 for ical_type, path in paths):
+                continue
+
+            for ical_type, path in paths:
+                resources = views.get_resources(ical_type)
+                write(path, views.render(semester, slug, resources, hostname,
+                                         refresh), timestamp)
+            count += 1
+
+        # Remove students that no longer have any courses.
+        parent = get_semester_directory(semester)
+        if os.path.isdir(parent):
+            for slug in os.listdir(parent):
+                if slug not in modified:
+                    shutil.rmtree(os.path.join(parent, slug),
+                                  ignore_errors=True)
+
+    return count
+
+
+def remove(semester, slug):
+    with translation.override(settings.LANGUAGE_CODE):
+        shutil.rmtree(get_directory(semester, slug), ignore_errors=True)
+
+
+def discard(year, semester_type, slug):
+    """Remove slug's files once the current transaction commits.
+
+       Requests go to Django until the next publish writes new files, which
+       is cheaper than rendering every feed for each change.
+    """
+    if enabled():
+        semester = Semester(year=year, type=semester_type)
+        transaction.on_commit(lambda: remove(semester, slug))
+
+
+def changed(semester):
+    """Publish feeds for semester once the current transaction commits."""
+    if not enabled():
+        return
+
+    def callback():
+        count = publish(semester)
+        logger.info('Published iCal feeds for %d students in %s.',
+                    count, semester)
+
+    transaction.on_commit(callback)
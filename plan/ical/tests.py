@@ -1,6 +1,21 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import datetime
+import os
+import shutil
+import tempfile
+
+import vobject
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from plan.common import tests
+from plan.common.models import (Course, Exam, Lecture, Semester,
+                                Subscription, SubscriptionLecture)
+from plan.common.snapshot import ScheduleSnapshot
+from plan.ical import blocks, static, views, writer
+from plan.scrape import base
 
 
 class EmptyViewTestCase(tests.BaseTestCase):
@@ -21,3 +36,221 @@ class EmptyViewTestCase(tests.BaseTestCase):
 
 class ViewTestCase(EmptyViewTestCase):
     fixtures = ['test_data.json', 'test_user.json']
+
+    def test_ical_conditional(self):
+        url = self.url('schedule-ical')
+
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+        url_args = list(self.default_args) + ['exams']
+        url = self.url('schedule-ical', *url_args)
+        response = self.client.get(url)
+
+        Exam.objects.filter(course__code='COURSE1').update(
+            last_import=datetime.datetime.now() + datetime.timedelta(days=1))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 200)
+
+    def test_ical_lectures(self):
+        url_args = list(self.default_args) + ['lectures']
+        response = self.client.get(self.url('schedule-ical', *url_args))
+        content = ''.join(response.streaming_content)
+
+        cal = vobject.readOne(content)
+        self.assertEquals(1, len(cal.contents['vtimezone']))
+
+        expected = {}
+        for lecture in Lecture.objects.exclude(id__in=[6, 7]).filter(
+                course__subscription__student__slug='adamcik'):
+            weeks = lecture.week_numbers
+            if not weeks:
+                continue
+            expected[lecture.id] = set(
+                datetime.datetime.combine(writer.week_start(2009, w) +
+                    datetime.timedelta(days=lecture.day), lecture.start)
+                for w in weeks)
+
+        actual = {}
+        for vevent in cal.vevent_list:
+            lecture_id = int(vevent.uid.value.split('-')[1])
+            occurrences = vevent.getrruleset(True) or [vevent.dtstart.value]
+            actual[lecture_id] = set(d.replace(tzinfo=None) for d in occurrences)
+
+        self.assertEquals(expected, actual)
+
+    def test_ical_exams(self):
+        url_args = list(self.default_args) + ['exams']
+        response = self.client.get(self.url('schedule-ical', *url_args))
+        cal = vobject.readOne(''.join(response.streaming_content))
+
+        uids = set(v.uid.value.split('@')[0] for v in cal.vevent_list)
+        control = Exam.objects.exclude(id__in=[3, 4])
+        self.assertEquals(set('exam-%d' % e.id for e in control), uids)
+
+
+    def test_ical_cached(self):
+        url = self.url('schedule-ical')
+
+        with CaptureQueriesContext(connection) as first:
+            content = ''.join(self.client.get(url).streaming_content)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+
+        self.assertEquals(content, response.content)
+        self.assert_(len(second) < len(first))
+
+        # Changed data gives a new feed, and new stamps.
+        Lecture.objects.filter(course__code='COURSE1').update(
+            last_import=datetime.datetime(2016, 1, 1, 12))
+        response = self.client.get(url)
+        updated = ''.join(response.streaming_content)
+        self.assertNotEquals(content, updated)
+        self.assert_('DTSTAMP:20160101T110000Z\r\n' in updated)
+
+    def test_ical_headers(self):
+        response = self.client.get(self.url('schedule-ical'))
+        content = ''.join(response.streaming_content)
+
+        self.assert_('max-age=3600' in response['Cache-Control'])
+        self.assert_(response.has_header('Expires'))
+        self.assert_('X-PUBLISHED-TTL:PT1H\r\n' in content)
+        self.assert_('REFRESH-INTERVAL;VALUE=DURATION:PT1H\r\n' in content)
+
+    def test_ical_shared_blocks(self):
+        def events(slug):
+            url = self.url('schedule-ical', 2009, 'spring', slug, 'lectures')
+            cal = vobject.readOne(''.join(
+                self.client.get(url).streaming_content))
+            return sorted(v.serialize() for v in cal.vevent_list)
+
+        # Put baz in the same COURSE2 groups as adamcik.
+        subscription = Subscription.objects.get(pk=6)
+        subscription.groups.set([1])
+        SubscriptionLecture.objects.refresh([subscription])
+
+        adamcik = events('adamcik')
+
+        def fail(*args):
+            raise AssertionError('Lecture events should have been cached.')
+
+        lecture_event, writer.lecture_event = writer.lecture_event, fail
+        try:
+            baz = events('baz')
+        finally:
+            writer.lecture_event = lecture_event
+
+        self.assert_(baz)
+        self.assert_(set(baz) <= set(adamcik))
+
+    def test_ical_blocks_follow_course_changes(self):
+        semester = Semester.objects.get(pk=1)
+
+        def events():
+            snapshot = ScheduleSnapshot(semester, 'adamcik')
+            return (blocks.lecture_events(snapshot, 2009, 'example.com',
+                                          'UTC') +
+                    blocks.exam_events(snapshot, 'example.com', 'UTC'))
+
+        before = events()
+        Course.objects.filter(code='COURSE1').update(name='Renamed')
+        after = events()
+
+        self.assertNotEqual(before, after)
+        self.assert_(any('Renamed' in event for event in after))
+
+    def test_max_age(self):
+        spring = Semester(year=2009, type=Semester.SPRING)
+        fall = Semester(year=2009, type=Semester.FALL)
+
+        self.assertEquals(60*60, views.get_max_age(spring))
+        self.assertEquals(60*60, views.get_max_age(fall))
+
+        self.set_now_to(2009, 4, 1)
+        self.assert_(60*60 < views.get_max_age(spring) < 60*60*24)
+        self.assertEquals(60*60, views.get_max_age(fall))
+
+        self.set_now_to(2009, 7, 1)
+        self.assertEquals(60*60*24*30, views.get_max_age(spring))
+
+
+class StaticTestCase(tests.BaseTestCase):
+    fixtures = ['test_data.json', 'test_user.json']
+
+    def setUp(self):
+        super(StaticTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.override = self.settings(TIMETABLE_ICAL_STATIC_ROOT=self.root,
+                                      TIMETABLE_HOSTNAME='example.com')
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.root)
+        super(StaticTestCase, self).tearDown()
+
+    def read(self, slug, *args):
+        path = os.path.join(self.root, '2009', 'spring', slug, 'ical',
+                            *(args + ('index.ics',)))
+        with open(path) as fp:
+            return fp.read()
+
+    def test_publish(self):
+        self.assertEquals(3, static.publish(self.semester))
+
+        for args in ((), ('lectures',), ('exams',)):
+            url = self.url('schedule-ical', *(self.default_args + list(args)))
+            content = ''.join(self.client.get(url).streaming_content)
+            self.assertEquals(content, self.read('adamcik', *args))
+
+        self.assertEquals(0, static.publish(self.semester))
+
+        Subscription.objects.touch(2009, 'spring', 'adamcik')
+        self.assertEquals(1, static.publish(self.semester))
+
+    def test_publish_after_scrape(self):
+        static.publish(self.semester)
+
+        # Only students following COURSE1 get new files.
+        scraper = base.LectureScraper(Semester.objects.get(pk=1), 'COURSE1')
+        scraper.scrape = lambda: []
+        scraper.run()
+        self.assertEquals(2, static.publish(self.semester))
+
+    def test_publish_removes_students(self):
+        static.publish(self.semester)
+        Subscription.objects.filter(student__slug='baz').delete()
+        static.publish(self.semester)
+
+        self.assertEquals(['adamcik', 'foo'], sorted(os.listdir(
+            os.path.join(self.root, '2009', 'spring'))))
+
+    def test_publish_removes_last_student(self):
+        static.publish(self.semester)
+        Subscription.objects.filter(course__semester=1).delete()
+        static.publish(self.semester)
+
+        self.assertEquals([], os.listdir(
+            os.path.join(self.root, '2009', 'spring')))
+
+
+class WriterTestCase(tests.BaseTestCase):
+    def test_fold(self):
+        line = writer.fold(u'DESCRIPTION:' + u'\xe6' * 100)
+        for part in line.split('\r\n'):
+            self.assert_(len(part) <= 75)
+            part.decode('utf-8')
+        self.assertEquals(u'DESCRIPTION:' + u'\xe6' * 100,
+                          line.replace('\r\n ', '')[:-2].decode('utf-8'))
+
+    def test_escape(self):
+        self.assertEquals(u'a\\, b\\; c\\\\ d\\n',
+                          writer.escape(u'a, b; c\\ d\n'))
+
+    def test_week_start(self):
+        self.assertEquals(datetime.date(2008, 12, 29), writer.week_start(2009, 1))
+        self.assertEquals(datetime.date(2010, 1, 4), writer.week_start(2010, 1))
@@ -1,41 +1,91 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
-import copy
 import datetime
-import math
+import hashlib
 import socket
-import vobject
-
-from dateutil import rrule
-from dateutil import tz
 
 from django import http
 from django.conf import settings
+from django.core import cache
 from django.core import urlresolvers
+from django.utils import cache as cache_utils
 from django.utils import translation
 
-from plan.common.models import Exam, Lecture, Semester, Room, Week
+from plan.common import utils
+from plan.common.models import Semester, Subscription
+from plan.common.snapshot import ScheduleSnapshot
+from plan.ical import blocks, writer
 
 _ = translation.ugettext
 
+# To allow for overriding of the codes idea of today() for tests
+today = datetime.date.today
 
-def ical(request, year, semester_type, slug, ical_type=None):
+
+def get_resources(ical_type=None):
     resources = [_(u'lectures'), _(u'exams')]
     if ical_type and ical_type not in resources:
         raise http.Http404
     elif ical_type:
         resources = [ical_type]
+    return resources
+
+
+def ical_last_modified(request, year, semester_type, slug, ical_type=None):
+    resources = get_resources(ical_type)
+    return Subscription.objects.get_last_modified(
+        year, semester_type, slug,
+        lectures=_(u'lectures') in resources,
+        exams=_(u'exams') in resources)
 
-    # TODO(adamcik): Add a last modified header and return 304s?
 
-    title  = urlresolvers.reverse('schedule', args=[year, semester_type, slug])
+@utils.conditional(ical_last_modified)
+def ical(request, year, semester_type, slug, ical_type=None):
+    resources = get_resources(ical_type)
+
     hostname = (settings.TIMETABLE_HOSTNAME or
                 request.META.get('HTTP_HOST', socket.getfqdn()))
 
     semester = Semester(year=year, type=semester_type)
 
-    cal = vobject.iCalendar()
-    cal.add('method').value = 'PUBLISH'  # IE/Outlook needs this
+    max_age = get_max_age(semester)
+    refresh = get_refresh(max_age)
+
+    modified = utils.get_last_modified(request)
+
+    key = None
+    if modified is not None:
+        key = 'ical:%s' % hashlib.sha1(u'|'.join([
+            slug, unicode(semester.year), semester.type, u','.join(resources),
+            hostname, translation.get_language() or u'',
+            modified.isoformat(), unicode(refresh)]).encode('utf-8')).hexdigest()
+
+    content = key and cache.cache.get(key)
+    if content is not None:
+        response = http.HttpResponse(content)
+    else:
+        icalstream = render(semester, slug, resources, hostname, refresh)
+        if key:
+            icalstream = cache_stream(key, icalstream)
+
+        response = http.StreamingHttpResponse(icalstream)
+
+    filename = '%s.ics' % '-'.join([str(semester.year), semester.type, slug] + resources)
+
+    response['Content-Type'] = 'text/calendar; charset=utf-8'
+    response['Filename'] = filename  # IE needs this
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    response['X-Robots-Tag'] = 'noindex, nofollow'
+
+    cache_utils.patch_response_headers(response, max_age)
+
+    return response
+
+
+def render(semester, slug, resources, hostname, refresh=None):
+    """Yield slug's feed for semester as chunks of bytes."""
+    title = urlresolvers.reverse(
+        'schedule', args=[semester.year, semester.type, slug])
 
     # TODO(adamcik): use same logic as in common.templatetags.title
     if slug.lower().endswith('s'):
@@ -43,136 +93,60 @@ def ical(request, year, semester_type, slug, ical_type=None):
     else:
         description = _(u"%(slug)s's %(semester)s %(year)s schedule for %(resources)s")
 
-    cal.add('X-WR-CALNAME').value = title.strip('/')
-    cal.add('X-WR-CALDESC').value = description % {
+    description = description % {
         'slug': slug,
         'semester': semester.get_type_display(),
         'year': semester.year,
         'resources': ', '.join(resources),
     }
 
+    snapshot = ScheduleSnapshot(semester, slug)
+    tzid = settings.TIME_ZONE
+
+    events = []
     if _('lectures') in resources:
-        lectures = Lecture.objects.get_lectures(year, semester.type, slug)
-        add_lectutures(lectures, semester.year, cal, hostname)
+        events.extend(blocks.lecture_events(snapshot, semester.year, hostname, tzid))
 
     if _('exams') in resources:
-        exams = Exam.objects.get_exams(year, semester.type, slug)
-        add_exams(exams, cal, hostname)
+        events.extend(blocks.exam_events(snapshot, hostname, tzid))
 
-    icalstream = cal.serialize()
+    return writer.calendar(title.strip('/'), description, events, tzid,
+                           refresh)
 
-    filename = '%s.ics' % '-'.join([str(semester.year), semester.type, slug] + resources)
 
-    response = http.HttpResponse(icalstream, content_type='text/calendar')
-    response['Content-Type'] = 'text/calendar; charset=utf-8'
-    response['Filename'] = filename  # IE needs this
-    response['Content-Disposition'] = 'attachment; filename=%s' % filename
-    response['X-Robots-Tag'] = 'noindex, nofollow'
+def cache_stream(key, stream):
+    """Pass stream through, caching the full content once it is done."""
+    chunks = []
+    for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    cache.cache.set(key, ''.join(chunks), settings.TIMETABLE_ICAL_CACHE_TIMEOUT)
 
-    # TODO(adamcik): add expires header that reduces load on old semesters
 
-    return response
+def get_max_age(semester):
+    """Seconds clients may cache feeds for semester.
+
+       Schedules change a lot around the start of a semester and hardly at
+       all towards the end, so the lifetime grows as the semester goes by.
+    """
+    year = int(semester.year)
+    if semester.type == Semester.SPRING:
+        start, end = datetime.date(year, 1, 1), datetime.date(year, 7, 1)
+    else:
+        start, end = datetime.date(year, 7, 1), datetime.date(year + 1, 1, 1)
+
+    minimum, maximum = settings.TIMETABLE_ICAL_MAX_AGE
+    current = today()
+
+    if current >= end:
+        return settings.TIMETABLE_ICAL_FINISHED_MAX_AGE
+    elif current <= start:
+        return minimum
+
+    progress = float((current - start).days) / (end - start).days
+    return int(minimum + (maximum - minimum) * progress)
 
 
-def add_lectutures(lectures, year, cal, hostname):
-    '''Adds lectures to cal object for current semester'''
-
-    all_rooms = Lecture.get_related(Room, lectures)
-    all_weeks = Lecture.get_related(Week, lectures, fields=['number'], use_extra=False)
-
-    for l in lectures:
-        if l.exclude: # Skip excluded
-            continue
-
-        if l.id not in all_weeks:
-            continue
-
-        weeks = all_weeks[l.id]
-
-        rrule_kwargs = {
-            'byweekno': weeks,
-            'count': len(weeks),
-            'byweekday': l.day,
-            'dtstart': datetime.datetime(int(year),1,1)
-        }
-
-        summary = l.alias or l.course.code
-        rooms = ', '.join(all_rooms.get(l.id, []))
-
-        if l.type:
-            desc = u'%s - %s (%s)' % (l.type.name, l.course.name, l.course.code)
-        else:
-            desc = u'%s (%s)' % (l.course.name, l.course.code)
-
-        for d in rrule.rrule(rrule.WEEKLY, **rrule_kwargs):
-            vevent = cal.add('vevent')
-            vevent.add('summary').value = summary
-            vevent.add('location').value = rooms
-            vevent.add('description').value = desc
-
-            vevent.add('dtstart').value = d.replace(hour=l.start.hour,
-                    minute=l.start.minute, tzinfo=tz.tzlocal())
-
-            vevent.add('dtend').value = d.replace(hour=l.end.hour,
-                    minute=l.end.minute, tzinfo=tz.tzlocal())
-
-            vevent.add('dtstamp').value = datetime.datetime.now(tz.tzlocal())
-
-            vevent.add('uid').value = 'lecture-%d-%s@%s' % \
-                    (l.id, d.strftime('%Y%m%d'), hostname)
-
-            if l.type and l.type.optional:
-                vevent.add('transp').value = 'TRANSPARENT'
-
-
-def add_exams(exams, cal, hostname):
-    for e in exams:
-
-        vevent = cal.add('vevent')
-
-        if e.type and e.type.name:
-            summary = u'%s - %s' % (e.type.name, e.alias or e.course.name)
-            desc = u'%s (%s) - %s (%s)' % (e.type.name, e.type.code,
-                    e.course.name, e.course.code)
-        elif e.type:
-            summary = _('Exam') + u' (%s) - %s' % (e.type, e.alias or e.course.code)
-            desc = _('Exam') + u' (%s) - %s (%s)' % (e.type.code, e.course.name,
-                    e.course.code)
-        else:
-            summary = _('Exam') + u' %s' % (e.alias or e.course.code)
-            desc = _('Exam') + u' %s (%s)' % (e.course.name, e.course.code)
-
-        vevent.add('summary').value = summary
-        vevent.add('description').value = desc
-        vevent.add('dtstamp').value = datetime.datetime.now(tz.tzlocal())
-
-        vevent.add('uid').value = 'exam-%d@%s' % (e.id, hostname)
-
-        if e.handout_date:
-            if e.handout_time:
-                vevent.add('dtstart').value = datetime.datetime.combine(
-                    e.handout_date, e.handout_time).replace(tzinfo=tz.tzlocal())
-            else:
-                vevent.add('dtstart').value = e.handout_date
-
-            if e.exam_time:
-                vevent.add('dtend').value = datetime.datetime.combine(
-                    e.exam_date, e.exam_time).replace(tzinfo=tz.tzlocal())
-            else:
-                vevent.add('dtend').value = e.exam_date
-        else:
-            if e.exam_time:
-                start = datetime.datetime.combine(
-                    e.exam_date, e.exam_time).replace(tzinfo=tz.tzlocal())
-            else:
-                start = e.exam_date
-
-            vevent.add('dtstart').value = start
-
-            if e.duration and e.exam_time:
-                hours = int(math.floor(e.duration))
-                minutes = int((e.duration % 1) * 60)
-                vevent.add('dtend').value = start + datetime.timedelta(
-                    hours=hours, minutes=minutes)
-            else:
-                vevent.add('dtend').value = start
+def get_refresh(max_age):
+    """Refresh hint for feeds, rounded to whole hours so it rarely changes."""
+    return max(60*60, max_age - max_age % (60*60))
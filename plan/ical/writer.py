@@ -0,0 +1,204 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Minimal RFC 5545 writer for timetable feeds.
+
+   Output is produced line by line so feeds can be streamed, and every
+   lecture becomes a single recurring event instead of one event per week.
+"""
+
+import datetime
+import math
+
+import pytz
+import vobject
+
+from django.conf import settings
+from django.utils import timezone
+
+CRLF = '\r\n'
+PRODID = '-//plan//timetable generator//EN'
+
+_timezones = {}
+
+
+def escape(value):
+    """Escape TEXT values."""
+    return (value.replace(u'\\', u'\\\\').replace(u';', u'\\;')
+                 .replace(u',', u'\\,').replace(u'\n', u'\\n'))
+
+
+def fold(line):
+    """Encode line and fold it so no line is more than 75 octets."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return data + CRLF
+
+    lines = []
+    while data:
+        limit = 75 if not lines else 74
+        if len(data) > limit:
+            # Don't split in the middle of multi-byte characters.
+            while limit and (ord(data[limit]) & 0xC0) == 0x80:
+                limit -= 1
+        lines.append(data[:limit])
+        data = data[limit:]
+    return (CRLF + ' ').join(lines) + CRLF
+
+
+def format_datetime(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def format_utc(value):
+    """UTC DATE-TIME for value, naive values are taken to be local time."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_date(value):
+    return value.strftime('%Y%m%d')
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds and not seconds % (60*60*24):
+        return 'P%dD' % (seconds // (60*60*24))
+    elif seconds and not seconds % (60*60):
+        return 'PT%dH' % (seconds // (60*60))
+    return 'PT%dS' % seconds
+
+
+def prop(name, text, **params):
+    parameters = u''.join(u';%s=%s' % (k.upper(), v)
+                          for k, v in sorted(params.items()))
+    return fold(u'%s%s:%s' % (name, parameters, text))
+
+
+def local(name, value, tzid):
+    """DATE or DATE-TIME property, with local times tied to tzid."""
+    if isinstance(value, datetime.datetime):
+        return prop(name, format_datetime(value), tzid=tzid)
+    return prop(name, format_date(value), value='DATE')
+
+
+def vtimezone(tzid):
+    """Serialized VTIMEZONE for tzid, computed once per process."""
+    if tzid not in _timezones:
+        component = vobject.icalendar.TimezoneComponent(pytz.timezone(tzid))
+        _timezones[tzid] = component.serialize()
+    return _timezones[tzid]
+
+
+def week_start(year, week):
+    """Monday in ISO week of year."""
+    jan4 = datetime.date(year, 1, 4)
+    return jan4 - datetime.timedelta(days=jan4.weekday(), weeks=1 - week)
+
+
+def lecture_event(lecture, year, weeks, rooms, dtstamp, hostname, tzid):
+    """Single VEVENT repeating weekly over the lecture's weeks."""
+    weeks = sorted(weeks)
+    first = week_start(year, weeks[0]) + datetime.timedelta(days=lecture.day)
+
+    def occurrence(week, time):
+        date = first + datetime.timedelta(weeks=week - weeks[0])
+        return datetime.datetime.combine(date, time)
+
+    summary = lecture.alias or lecture.course.code
+    if lecture.type:
+        desc = u'%s - %s (%s)' % (lecture.type.name, lecture.course.name,
+                                  lecture.course.code)
+    else:
+        desc = u'%s (%s)' % (lecture.course.name, lecture.course.code)
+
+    yield 'BEGIN:VEVENT' + CRLF
+    # Same UID as the first occurrence had when each week was its own event.
+    yield prop('UID', u'lecture-%d-%s@%s' % (
+        lecture.id, format_date(first), hostname))
+    yield prop('DTSTAMP', dtstamp)
+    yield prop('SUMMARY', escape(summary))
+    yield prop('LOCATION', escape(u', '.join(rooms)))
+    yield prop('DESCRIPTION', escape(desc))
+    yield local('DTSTART', occurrence(weeks[0], lecture.start), tzid)
+    yield local('DTEND', occurrence(weeks[0], lecture.end), tzid)
+
+    if len(weeks) > 1:
+        yield prop('RRULE', 'FREQ=WEEKLY;COUNT=%d' % (weeks[-1] - weeks[0] + 1))
+
+        skipped = sorted(set(range(weeks[0], weeks[-1] + 1)) - set(weeks))
+        if skipped:
+            dates = u','.join(format_datetime(occurrence(w, lecture.start))
+                              for w in skipped)
+            yield prop('EXDATE', dates, tzid=tzid)
+
+    if lecture.type and lecture.type.optional:
+        yield prop('TRANSP', 'TRANSPARENT')
+    yield 'END:VEVENT' + CRLF
+
+
+def exam_event(exam, dtstamp, hostname, tzid, exam_label):
+    if exam.type and exam.type.name:
+        summary = u'%s - %s' % (exam.type.name, exam.alias or exam.course.name)
+        desc = u'%s (%s) - %s (%s)' % (exam.type.name, exam.type.code,
+                exam.course.name, exam.course.code)
+    elif exam.type:
+        summary = exam_label + u' (%s) - %s' % (exam.type, exam.alias or exam.course.code)
+        desc = exam_label + u' (%s) - %s (%s)' % (exam.type.code,
+                exam.course.name, exam.course.code)
+    else:
+        summary = exam_label + u' %s' % (exam.alias or exam.course.code)
+        desc = exam_label + u' %s (%s)' % (exam.course.name, exam.course.code)
+
+    if exam.exam_time:
+        end = datetime.datetime.combine(exam.exam_date, exam.exam_time)
+    else:
+        end = exam.exam_date
+
+    if exam.handout_date:
+        if exam.handout_time:
+            start = datetime.datetime.combine(exam.handout_date, exam.handout_time)
+        else:
+            start = exam.handout_date
+    else:
+        start = end
+        if exam.duration and exam.exam_time:
+            hours = int(math.floor(exam.duration))
+            minutes = int((exam.duration % 1) * 60)
+            end = start + datetime.timedelta(hours=hours, minutes=minutes)
+
+    yield 'BEGIN:VEVENT' + CRLF
+    yield prop('UID', u'exam-%d@%s' % (exam.id, hostname))
+    yield prop('DTSTAMP', dtstamp)
+    yield prop('SUMMARY', escape(summary))
+    yield prop('DESCRIPTION', escape(desc))
+    yield local('DTSTART', start, tzid)
+    yield local('DTEND', end, tzid)
+    yield 'END:VEVENT' + CRLF
+
+
+def calendar(name, description, events, tzid=None, refresh=None):
+    """Yield complete calendar with events given as serialized VEVENTs.
+
+       refresh is the number of seconds clients should wait before polling
+       the calendar again.
+    """
+    tzid = tzid or settings.TIME_ZONE
+
+    yield 'BEGIN:VCALENDAR' + CRLF
+    yield prop('VERSION', '2.0')
+    yield prop('PRODID', PRODID)
+    yield prop('METHOD', 'PUBLISH')  # IE/Outlook needs this
+    yield prop('X-WR-CALNAME', escape(name))
+    yield prop('X-WR-CALDESC', escape(description))
+    yield prop('X-WR-TIMEZONE', tzid)
+    if refresh:
+        yield prop('X-PUBLISHED-TTL', format_duration(refresh))
+        yield prop('REFRESH-INTERVAL', format_duration(refresh),
+                   value='DURATION')
+    yield vtimezone(tzid)
+
+    for event in events:
+        yield event
+
+    yield 'END:VCALENDAR' + CRLF
@@ -0,0 +1,297 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Draw timetables straight onto a canvas.
+
+   Lays out the page the way the platypus Table in plan.pdf.views does, line
+   breaking and shrinking of lectures included, but with every position
+   calculated up front from cached font metrics instead of by repeatedly
+   wrapping flowables.
+"""
+
+from reportlab.lib import colors
+from reportlab.pdfbase import pdfmetrics
+
+from django.utils import dateformat
+from django.utils import text
+
+BOLD = 'Helvetica-Bold'
+REGULAR = 'Helvetica'
+
+TITLE_HEIGHT = 16
+HEADER_HEIGHT = 12
+
+# Font size of the course code and of the details shown in lectures, all
+# lines in lectures are LEADING apart.
+CODE = 10
+DETAILS = 6
+LEADING = 12
+
+# Same as reportlab's defaults for paragraphs: how much spaces may shrink
+# to fit one more word on a line, and the fuzz used in layout arithmetic.
+SPACE_SHRINKAGE = 0.05
+FUZZ = 1e-6
+
+outer_border = colors.HexColor('#666666')
+inner_border = colors.HexColor('#CCCCCC')
+backgrounds = [colors.HexColor('#FFFFFF'), colors.HexColor('#FAFAFA')]
+
+_widths = {}
+
+
+def string_width(value, font):
+    """Width of value at size one, cached as the same words keep coming up."""
+    key = (value, font)
+    if key not in _widths:
+        _widths[key] = pdfmetrics.stringWidth(value, font, 1)
+    return _widths[key]
+
+
+def split_word(word, line_width, font, size, width):
+    """Split a word that is wider than a whole line into pieces that fit.
+
+       The first piece fills up the line the word started on, which is
+       line_width wide so far. Returns (piece, True) tuples for wrap().
+    """
+    pieces, piece = [], u''
+    for char in word:
+        char_width = string_width(char, font) * size
+        if line_width + char_width > width:
+            pieces.append((piece, True))
+            piece, line_width = u'', 0
+        piece += char
+        line_width += char_width
+    pieces.append((piece, True))
+    return pieces
+
+
+def wrap(value, font, size, width):
+    """Break value into lines the same way a platypus Paragraph does.
+
+       Returns (words, extra) for each line, where extra is the width left
+       over. This is negative when spaces have to shrink to fit the line.
+    """
+    space = string_width(u' ', font) * size
+    words = [(word, False) for word in value.split()]
+    lines, line, current, shrink, forced = [], [], -space, 0, False
+
+    while words:
+        word, split = words.pop(0)
+        if not word and split:
+            forced = True
+        word_width = string_width(word, font) * size
+        new_width = current + space + word_width
+
+        if (new_width > width + shrink and not forced and not split and
+                word_width > width):
+            words[0:0] = split_word(word, current + space, font, size, width)
+            forced = True
+            continue
+
+        if new_width <= width + shrink or not line or forced:
+            if word:
+                line.append(word)
+            if forced:
+                lines.append((line, width - new_width))
+                line, current, shrink, forced = [], -space, 0, False
+            else:
+                current = new_width
+                shrink += SPACE_SHRINKAGE * space
+        else:
+            lines.append((line, width - current))
+            line, current, shrink = [word], word_width, 0
+
+    if line:
+        lines.append((line, width - current))
+    return lines
+
+
+def measure(paragraphs, width):
+    """Height of (text, font, size) paragraphs wrapped to width."""
+    return sum(len(wrap(value, font, size, width)) * LEADING
+               for value, font, size in paragraphs)
+
+
+def shrink(paragraphs, width, height):
+    """Scale paragraphs need to be shrunk by to fit width and height.
+
+       Follows KeepInFrame's shrink mode: the first guess is based on the
+       height at full size, which is then refined with a quadratic model of
+       height as a function of the scale.
+    """
+    full = measure(paragraphs, width)
+    if full <= height + FUZZ:
+        return 1.0
+
+    def scaled(scale):
+        return measure(paragraphs, scale * width) / scale
+
+    guess = float(full) / height
+    guessed = scaled(guess)
+    if guessed < min(0.95 * height, height - 10) or guessed >= height + FUZZ:
+        # Fit h = a/s**2 + b/s through the two heights we know.
+        det = 1.0 / guess - 1.0 / guess ** 2
+        a = (full / guess - guessed) / det
+        b = (guessed - full / guess ** 2) / det
+        for margin in (0, 0.01, 0.05, 0.10, 0.15):
+            scale = solve(height * (1 - margin), a, b)
+            if scale is not None and scaled(scale) <= height + FUZZ:
+                return scale
+    return guess
+
+
+def solve(height, a, b):
+    """Scale s where a/s**2 + b/s equals height, None if there is none."""
+    if abs(a) <= FUZZ:
+        return b / height
+    t = 0.5 * b / a
+    f = -height / a
+    r = t * t - f
+    if r < 0:
+        return None
+    r = r ** 0.5
+    s1 = -t - r if t >= 0 else -t + r
+    s2 = f / s1
+    return max(1.0 / s1, 1.0 / s2)
+
+
+def draw_lines(page, x, top, lines, font, size):
+    """Draw wrapped lines with the first baseline size below top."""
+    page.setFont(font, size)
+    for i, (words, extra) in enumerate(lines):
+        word_space = None
+        if extra < -1e-8 and len(words) > 1:
+            word_space = extra / (len(words) - 1)
+        page.drawString(x, top - size - i * LEADING, u' '.join(words),
+                        wordSpace=word_space)
+
+
+def draw_lecture(page, x, top, paragraphs, width, height):
+    """Draw paragraphs in the box with top left corner at (x, top).
+
+       Shrinks them to fit just like the table's KeepInFrame would.
+    """
+    scale = shrink(paragraphs, width, height)
+
+    page.saveState()
+    page.translate(x, top)
+    page.scale(1 / scale, 1 / scale)
+    offset = 0
+    for value, font, size in paragraphs:
+        lines = wrap(value, font, size, (width - FUZZ) * scale)
+        draw_lines(page, 0, -offset, lines, font, size)
+        offset += len(lines) * LEADING
+    page.restoreState()
+
+
+def draw(page, timetable, title, rooms, color_map, width, height):
+    """Draw timetable in the box from (0, 0) to (width, -height).
+
+       As with the table based renderer the title sticks out a little above
+       the box. timetable needs to have had insert_times() called.
+    """
+    time_width = 0.06 * width
+    day_width = (width - time_width) / 5
+    row_height = float(height - TITLE_HEIGHT) / len(timetable.table)
+
+    # Left edge of each day and width of its sub columns.
+    day_x = [time_width + j * day_width for j in range(len(timetable.span))]
+    column_width = [day_width / span for span in timetable.span]
+
+    # Rows share the height left after the title, so the table ends up
+    # sticking out above the box by the header's height.
+    table_top = HEADER_HEIGHT
+    header_top = table_top - TITLE_HEIGHT
+    body_top = header_top - HEADER_HEIGHT
+    row_top = [body_top - i * row_height
+               for i in range(len(timetable.table) + 1)]
+
+    cells = []
+    for lecture in timetable.lectures:
+        j, k = lecture['j'], lecture['k']
+        x = day_x[j] + k * column_width[j]
+        w = column_width[j] * lecture['width']
+        top = row_top[lecture['i']]
+        h = row_height * lecture['height']
+        cells.append((lecture, x, w, top, h))
+
+    # Row backgrounds, white rows are left out as the page already is.
+    for i in range(len(timetable.table)):
+        color = backgrounds[(i + 1) % len(backgrounds)]
+        if color != backgrounds[0]:
+            page.setFillColor(color)
+            page.rect(0, row_top[i + 1], width, row_height, stroke=0, fill=1)
+
+    colors_by_course = {}
+    for lecture, x, w, top, h in cells:
+        course_id = lecture['l'].course_id
+        if course_id not in colors_by_course:
+            colors_by_course[course_id] = colors.HexColor(color_map[course_id])
+        page.setFillColor(colors_by_course[course_id])
+        page.rect(x, top - h, w, h, stroke=0, fill=1)
+
+    # Outer border.
+    page.setStrokeColor(outer_border)
+    page.setLineWidth(1)
+    page.line(0, body_top, width, body_top)
+    page.line(0, -height, width, -height)
+    page.line(0, body_top, 0, -height)
+    page.line(width, body_top, width, -height)
+
+    # Lines between rows, leaving out the parts inside lectures.
+    page.setStrokeColor(inner_border)
+    page.setLineWidth(0.7)
+    page.line(0, body_top, width, body_top)
+    for i in range(len(timetable.table) - 1):
+        blocked = sorted((x, x + w) for lecture, x, w, top, h in cells
+                         if lecture['i'] <= i < lecture['i'] + lecture['height'] - 1)
+        start = 0
+        for x1, x2 in blocked:
+            if x1 > start + FUZZ:
+                page.line(start, row_top[i + 1], x1, row_top[i + 1])
+            start = max(start, x2)
+        if start < width - FUZZ:
+            page.line(start, row_top[i + 1], width, row_top[i + 1])
+
+    page.setStrokeColor(outer_border)
+    page.setLineWidth(1)
+    for x in day_x:
+        page.line(x, body_top, x, -height)
+
+    page.setFillColor(colors.black)
+
+    # Title, wrapping if it does not fit on one line, centered vertically
+    # between the generous top padding and the header.
+    lines = wrap(text.unescape_entities(title), BOLD, CODE, width - 3)
+    top = header_top + (TITLE_HEIGHT - 4 + len(lines) * LEADING) / 2.0
+    draw_lines(page, 2, top, lines, BOLD, CODE)
+
+    page.setFont(BOLD, 8)
+    for x, (span, date, name) in zip(day_x, timetable.header()):
+        if date:
+            label = dateformat.format(date, 'l - j M.')
+        else:
+            label = unicode(name)
+        page.drawString(x + 2, header_top - 1 - 8, label)
+
+    # Times are centered in the first column, lines 12 points apart.
+    for i, row in enumerate(timetable.table):
+        time = row[0][0].get('time')
+        if not time:
+            continue
+        lines = time.split(' - ')
+        bottom = row_top[i + 1]
+        y = bottom + (1 + row_height - 5 + len(lines) * 12) / 2.0 - 8
+        for line in lines:
+            page.drawCentredString((time_width + 1) / 2.0, y, line)
+            y -= 12
+
+    for lecture, x, w, top, h in cells:
+        l = lecture['l']
+        font = REGULAR if l.type and l.type.optional else BOLD
+
+        paragraphs = [(l.alias or l.course.code, font, CODE)]
+        if l.type:
+            paragraphs.append((l.type.name.replace('/', ' / '), font, DETAILS))
+        paragraphs.append((u', '.join(rooms.get(l.id, [])), font, DETAILS))
+
+        draw_lecture(page, x + 2, top - 1, paragraphs, w - 3, h - 2)
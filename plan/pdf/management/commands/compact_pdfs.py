@@ -0,0 +1,23 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from django.conf import settings
+from django.core.management import base as management
+
+from plan.pdf.store import store
+
+
+class Command(management.BaseCommand):
+    help = 'Remove PDFs in TIMETABLE_PDF_CACHE_DIR that are no longer used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--max-age', action='store', dest='max_age',
+                            type=int, default=7, help='drop PDFs not used in '
+                            'this many days, default: 7')
+
+    def handle(self, **options):
+        if not settings.TIMETABLE_PDF_CACHE_DIR:
+            raise management.CommandError(
+                'TIMETABLE_PDF_CACHE_DIR has not been set.')
+
+        count = store.compact(options['max_age'] * 60 * 60 * 24)
+        self.stdout.write('Removed %d PDFs.' % count)
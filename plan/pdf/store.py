@@ -0,0 +1,139 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Finished PDFs stored by a digest of everything that went into them.
+
+   Recently used PDFs are kept in memory up to TIMETABLE_PDF_CACHE_SIZE
+   bytes per process. With TIMETABLE_PDF_CACHE_DIR set they are also
+   written to disk, where every process can find them. Files on disk are
+   kept until compact() removes the ones that have not been used for a
+   while, see the compact_pdfs management command.
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+def digest(*parts):
+    """Hex digest of parts, which are turned into text with repr()."""
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+class PDFStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+        self._size = 0
+
+    def _path(self, key):
+        return os.path.join(settings.TIMETABLE_PDF_CACHE_DIR, key[:2],
+                            key + '.pdf')
+
+    def _remember(self, key, content):
+        limit = settings.TIMETABLE_PDF_CACHE_SIZE
+        if len(content) > limit:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = content
+            self._size += len(content)
+
+            while self._size > limit:
+                old_key, old_content = self._items.popitem(last=False)
+                self._size -= len(old_content)
+
+    def get(self, key):
+        with self._lock:
+            content = self._items.pop(key, None)
+            if content is not None:
+                # Move to the end as the most recently used.
+                self._items[key] = content
+                return content
+
+        if not settings.TIMETABLE_PDF_CACHE_DIR:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                content = fp.read()
+            # Mark as used so compact() keeps it around.
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        self._remember(key, content)
+        return content
+
+    def set(self, key, content):
+        self._remember(key, content)
+
+        if not settings.TIMETABLE_PDF_CACHE_DIR:
+            return
+
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Someone else got there first.
+                if not os.path.isdir(directory):
+                    raise
+
+        # Write to a temporary file first so readers never see partial files.
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def compact(self, max_age):
+        """Remove stored files not used for max_age seconds.
+
+           Returns the number of files that were removed.
+        """
+        directory = settings.TIMETABLE_PDF_CACHE_DIR
+        if not directory or not os.path.isdir(directory):
+            return 0
+
+        cutoff = time.time() - max_age
+        count = 0
+
+        for root, dirs, files in os.walk(directory, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        if name.endswith('.pdf'):
+                            count += 1
+                except OSError:
+                    # Removed or replaced by someone else.
+                    pass
+            if root != directory and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+store = PDFStore()
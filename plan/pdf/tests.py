@@ -1,6 +1,19 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import os
+import re
+import shutil
+import StringIO
+import tempfile
+
+from django.test.utils import override_settings
+from reportlab import platypus
+from reportlab.lib import styles
+from reportlab.pdfgen import canvas
+
 from plan.common.tests import BaseTestCase
+from plan.pdf import layout, views
+from plan.pdf.store import PDFStore, store
 
 class EmptyViewTestCase(BaseTestCase):
     def test_pdf(self):
@@ -24,6 +37,151 @@ class EmptyViewTestCase(BaseTestCase):
             response = self.client.get(url)
             self.assertEquals(response.status_code, 200)
 
+    def test_booklet_empty(self):
+        url = self.url('schedule-pdf-booklet', *self.default_args)
+        self.assertEquals(self.client.get(url).status_code, 200)
+
 
 class ViewTestCase(EmptyViewTestCase):
     fixtures = ['test_data.json', 'test_user.json']
+
+    def test_pdf_conditional(self):
+        url = self.url('schedule-pdf', *(self.default_args + ['A5']))
+
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        url = self.url('schedule-pdf', *(self.default_args + ['A4']))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+
+    def test_pdf_renderers(self):
+        for renderer in ('canvas', 'table'):
+            with override_settings(TIMETABLE_PDF_RENDERER=renderer):
+                for size in ('A4', 'A5', 'A6', 'A7'):
+                    url = self.url('schedule-pdf', *(self.default_args + [size]))
+                    response = self.client.get(url)
+                    self.assertEquals(response.status_code, 200)
+                    self.assert_(response.content.startswith('%PDF'))
+
+    def test_pdf_stored(self):
+        store.clear()
+        url = self.url('schedule-pdf', *(self.default_args + ['A5']))
+        content = self.client.get(url).content
+
+        def fail(*args, **kwargs):
+            raise AssertionError('PDF should have been stored.')
+
+        render_pages, views.render_pages = views.render_pages, fail
+        try:
+            self.assertEquals(content, self.client.get(url).content)
+        finally:
+            views.render_pages = render_pages
+
+        # Other sizes need their own PDF.
+        url = self.url('schedule-pdf', *(self.default_args + ['A6']))
+        self.assertNotEquals(content, self.client.get(url).content)
+
+    def test_booklet(self):
+        url = self.url('schedule-pdf-booklet', *(self.default_args + ['A5']))
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+
+        # One page for each of the two weeks with lectures.
+        pages = re.findall(r'/Type /Page\b', response.content)
+        self.assertEquals(2, len(pages))
+
+        url = self.url('schedule-pdf-booklet', *(self.default_args + ['A9']))
+        self.assertEquals(self.client.get(url).status_code, 404)
+
+
+class StoreTestCase(BaseTestCase):
+    def test_lru(self):
+        pdfs = PDFStore()
+        with override_settings(TIMETABLE_PDF_CACHE_SIZE=10):
+            pdfs.set('a', 'aaaa')
+            pdfs.set('b', 'bbbb')
+            self.assertEquals('aaaa', pdfs.get('a'))
+
+            # b is the least recently used, so goes first.
+            pdfs.set('c', 'cccc')
+            self.assertEquals(None, pdfs.get('b'))
+            self.assertEquals('aaaa', pdfs.get('a'))
+            self.assertEquals('cccc', pdfs.get('c'))
+
+            pdfs.set('d', 'd' * 11)
+            self.assertEquals(None, pdfs.get('d'))
+
+    def test_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(TIMETABLE_PDF_CACHE_DIR=directory):
+                PDFStore().set('abcdef', 'content')
+                self.assertEquals('content', PDFStore().get('abcdef'))
+                self.assertEquals(None, PDFStore().get('fedcba'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compact(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(TIMETABLE_PDF_CACHE_DIR=directory):
+                pdfs = PDFStore()
+                pdfs.set('abcdef', 'old')
+                pdfs.set('fedcba', 'new')
+
+                path = os.path.join(directory, 'ab', 'abcdef.pdf')
+                os.utime(path, (0, 0))
+
+                self.assertEquals(1, pdfs.compact(60))
+                self.assertEquals(['fe'], os.listdir(directory))
+                self.assertEquals('new', PDFStore().get('fedcba'))
+        finally:
+            shutil.rmtree(directory)
+
+
+class LayoutTestCase(BaseTestCase):
+    def style(self, font, size):
+        return styles.ParagraphStyle('test', fontName=font, fontSize=size,
+                                     leading=layout.LEADING)
+
+    def test_wrap(self):
+        width = layout.string_width(u'aaa bbb', 'Helvetica') * 10
+        lines = layout.wrap(u'aaa bbb ccc', 'Helvetica', 10, width)
+        self.assertEquals([[u'aaa', u'bbb'], [u'ccc']],
+                          [words for words, extra in lines])
+        self.assertAlmostEquals(0, lines[0][1])
+
+    def test_wrap_matches_paragraph(self):
+        values = [u'TDT4100', u'TMA4115MATEMATIKK3', u'alias lang navn',
+                  u'Lab / Exercise', u'Room 1, Room 22, Room 333', u'X']
+
+        for value in values:
+            for font, size in (('Helvetica-Bold', 10), ('Helvetica', 6)):
+                for width in (8, 15, 27.5, 40, 100):
+                    paragraph = platypus.Paragraph(value, self.style(font, size))
+                    expected = paragraph.breakLines([width]).lines
+                    lines = layout.wrap(value, font, size, width)
+
+                    self.assertEquals([words for extra, words in expected],
+                                      [words for words, extra in lines])
+                    for (a, words), (words, b) in zip(expected, lines):
+                        self.assertAlmostEquals(a, b)
+
+    def test_shrink_matches_keepinframe(self):
+        paragraphs = [(u'TMA4115MATEMATIKK3', 'Helvetica-Bold', 10),
+                      (u'Forelesning med veldig lang tekst', 'Helvetica', 6),
+                      (u'Room 1, Room 22, Room 333', 'Helvetica', 6)]
+
+        for width, height in ((100, 100), (40, 30), (27.5, 12), (15, 40)):
+            frame = platypus.KeepInFrame(width, height, [
+                platypus.Paragraph(value, self.style(font, size))
+                for value, font, size in paragraphs], mode='shrink')
+            frame.wrapOn(canvas.Canvas(StringIO.StringIO()), width, height)
+
+            self.assertAlmostEquals(getattr(frame, '_scale', 1.0),
+                                    layout.shrink(paragraphs, width, height))
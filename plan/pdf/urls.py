@@ -5,4 +5,5 @@ from plan.pdf import views
 
 urlpatterns = [
     url(r'^{year}/{semester}/{slug}/pdf/(?:{size}/)?(?:{week}/)?$', views.pdf, name='schedule-pdf'),
+    url(r'^{year}/{semester}/{slug}/pdf/(?:{size}/)?weeks/$', views.booklet, name='schedule-pdf-booklet'),
 ]
@@ -1,5 +1,7 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import StringIO
+
 from reportlab.lib import colors
 from reportlab.lib import pagesizes
 from reportlab.lib import styles
@@ -9,20 +11,23 @@ from reportlab.pdfgen import canvas
 from reportlab.platypus import tables
 
 from django import http
+from django.conf import settings
 from django.utils import html
 from django.utils import translation
 from django.utils import dateformat
 
-from plan.common.models import Lecture, Semester, Room, Course
-from plan.common.timetable import Timetable
-from plan.common.utils import ColorMap
+from plan.common.models import Semester, Subscription
+from plan.common.snapshot import ScheduleSnapshot
+from plan.common.utils import ColorMap, conditional, get_last_modified
 from plan.common.templatetags.title import render_title
+from plan.pdf import layout
+from plan.pdf.layout import backgrounds, inner_border, outer_border
+from plan.pdf.store import digest, store
 
 _ = translation.ugettext
 
-outer_border = colors.HexColor('#666666')
-inner_border = colors.HexColor('#CCCCCC')
-backgrounds = [colors.HexColor('#FFFFFF'), colors.HexColor('#FAFAFA')]
+# Bump when rendering changes so stored PDFs are not reused.
+VERSION = 2
 
 default_styles = styles.getSampleStyleSheet()
 
@@ -56,6 +61,12 @@ def _tablestyle():
 
     return table_style
 
+def pdf_last_modified(request, year, semester_type, slug, **kwargs):
+    return Subscription.objects.get_last_modified(
+        year, semester_type, slug, exams=False)
+
+
+@conditional(pdf_last_modified)
 def pdf(request, year, semester_type, slug, size=None, week=None):
     if size is not None and size not in ['A4', 'A5', 'A6', 'A7']:
         raise http.Http404
@@ -64,15 +75,6 @@ def pdf(request, year, semester_type, slug, size=None, week=None):
 
     color_map = ColorMap(hex=True)
 
-    margin = 0.5*units.cm
-    width, height = pagesizes.landscape(pagesizes.A5)
-
-    width -= 2*margin
-    height -= 2*margin
-
-    time_width = 0.06 * width
-    day_width = (width-time_width) / 5
-
     filename = '%s-%s-%s' % (year, semester.type, slug)
 
     if week:
@@ -81,20 +83,157 @@ def pdf(request, year, semester_type, slug, size=None, week=None):
     response = http.HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = 'attachment; filename=%s.pdf' % filename
 
-    lectures = Lecture.objects.get_lectures(year, semester.type, slug, week)
-    rooms = Lecture.get_related(Room, lectures)
-    courses = Course.objects.get_courses(year, semester.type, slug)
+    snapshot = ScheduleSnapshot.cached(semester, slug, week,
+                                       get_last_modified(request))
+    rooms = snapshot.room_names
 
-    for course in courses:
+    for course in snapshot.courses:
         color_map[course.id]
 
-    timetable = Timetable(lectures)
-    if lectures:
-        timetable.place_lectures()
-        timetable.do_expansion()
+    timetable = snapshot.timetable
     timetable.insert_times()
-    if week:
-        timetable.set_week(semester.year, int(week))
+
+    note = request.META.get('HTTP_HOST', '').split(':')[0]
+    pages = [(timetable, render_title(semester, slug, week))]
+
+    response.write(get_pdf(pages, rooms, color_map, size, note))
+
+    response['X-Robots-Tag'] = 'noindex, nofollow'
+    return response
+
+
+@conditional(pdf_last_modified)
+def booklet(request, year, semester_type, slug, size=None):
+    """PDF with one page for each week that has lectures."""
+    if size is not None and size not in ['A4', 'A5', 'A6', 'A7']:
+        raise http.Http404
+
+    semester = Semester(year=year, type=semester_type)
+
+    color_map = ColorMap(hex=True)
+
+    filename = '%s-%s-%s-weeks' % (year, semester.type, slug)
+
+    response = http.HttpResponse(content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename=%s.pdf' % filename
+
+    # Lectures and rooms for all weeks are loaded once, with each week's
+    # timetable worked out from them in memory.
+    snapshot = ScheduleSnapshot.cached(semester, slug,
+                                       modified=get_last_modified(request))
+    rooms = snapshot.room_names
+
+    for course in snapshot.courses:
+        color_map[course.id]
+
+    pages = []
+    for week in snapshot.week_range:
+        timetable = snapshot.get_week_timetable(week)
+        if timetable.lectures:
+            timetable.insert_times()
+            pages.append((timetable, render_title(semester, slug, week)))
+
+    if not pages:
+        timetable = snapshot.timetable
+        timetable.insert_times()
+        pages.append((timetable, render_title(semester, slug)))
+
+    note = request.META.get('HTTP_HOST', '').split(':')[0]
+
+    response.write(get_pdf(pages, rooms, color_map, size, note))
+
+    response['X-Robots-Tag'] = 'noindex, nofollow'
+    return response
+
+
+def get_pdf(pages, rooms, color_map, size, note):
+    """Rendered PDF for pages, reusing stored PDFs when possible."""
+    renderer = settings.TIMETABLE_PDF_RENDERER
+
+    key = digest(*[get_digest(timetable, title, rooms, color_map, size, note,
+                              renderer) for timetable, title in pages])
+    content = store.get(key)
+    if content is None:
+        output = StringIO.StringIO()
+        render_pages(output, pages, rooms, color_map, size, note, renderer)
+        content = output.getvalue()
+        store.set(key, content)
+    return content
+
+
+def get_digest(timetable, title, rooms, color_map, size, note, renderer):
+    """Digest of everything that shows up in the PDF for timetable."""
+    header = [(span, date and dateformat.format(date, 'l - j M.'), unicode(name))
+              for span, date, name in timetable.header()]
+    times = [row[0][0].get('time') for row in timetable.table]
+
+    lectures = []
+    for lecture in timetable.lectures:
+        l = lecture['l']
+        lectures.append((
+            lecture['i'], lecture['j'], lecture['k'], lecture['height'],
+            lecture['width'], l.alias or l.course.code,
+            l.type and (l.type.name, l.type.optional),
+            rooms.get(l.id, []), color_map[l.course_id]))
+
+    return digest(VERSION, renderer, size, note, title, timetable.span,
+                  header, times, lectures)
+
+
+def render(output, timetable, title, rooms, color_map, size=None, note=u'',
+           renderer=None):
+    """Write PDF with timetable to output using the given renderer.
+
+       renderer is either 'canvas' or 'table', and defaults to the
+       TIMETABLE_PDF_RENDERER setting.
+    """
+    render_pages(output, [(timetable, title)], rooms, color_map, size, note,
+                 renderer)
+
+
+def render_pages(output, pages, rooms, color_map, size=None, note=u'',
+                 renderer=None):
+    """Write PDF with one page per (timetable, title) in pages."""
+    margin = 0.5*units.cm
+    width, height = pagesizes.landscape(pagesizes.A5)
+
+    width -= 2*margin
+    height -= 2*margin
+
+    if (renderer or settings.TIMETABLE_PDF_RENDERER) == 'table':
+        draw = draw_table
+    else:
+        draw = layout.draw
+
+    page = canvas.Canvas(output, pagesizes.A4)
+
+    for timetable, title in pages:
+        page.translate(margin, pagesizes.A4[1]-margin)
+
+        if 'A4' == size:
+            page.translate(0.5*margin, 2.5*margin-pagesizes.A4[1])
+            page.scale(1.414, 1.414)
+            page.rotate(90)
+        elif 'A6' == size:
+            page.scale(0.707, 0.707)
+        elif 'A7' == size:
+            page.scale(0.5, 0.5)
+
+        draw(page, timetable, title, rooms, color_map, width, height)
+
+        page.setFont('Helvetica', 10)
+        page.setFillColor(colors.HexColor('#666666'))
+        page.drawString(width - page.stringWidth(note) - 2, -height+2, note)
+
+        page.showPage()
+
+    page.save()
+
+
+def draw_table(page, timetable, title, rooms, color_map, width, height):
+    """Draw timetable using a platypus Table, see plan.pdf.layout.draw."""
+    time_width = 0.06 * width
+    day_width = (width-time_width) / 5
 
     paragraph_style = default_styles['Normal']
     paragraph_style.fontName = 'Helvetica-Bold'
@@ -103,7 +242,7 @@ def pdf(request, year, semester_type, slug, size=None, week=None):
 
     table_style = _tablestyle()
 
-    data = [[platypus.Paragraph(render_title(semester, slug, week), paragraph_style)]]
+    data = [[platypus.Paragraph(title, paragraph_style)]]
     data[-1].extend([''] * sum(timetable.span))
     table_style.add('SPAN', (0,0), (-1, 0))
 
@@ -116,7 +255,7 @@ def pdf(request, year, semester_type, slug, size=None, week=None):
             data[-1].append(unicode(name))
         if span > 1:
             extra = span - 1
-            table_style.add('SPAN', (len(data[-1])-1, 2), (len(data[-1])-1+extra, 2))
+            table_style.add('SPAN', (len(data[-1])-1, 1), (len(data[-1])-1+extra, 1))
             data[-1].extend([''] * extra)
 
     # Convert to "simple" datastruct
@@ -188,32 +327,8 @@ def pdf(request, year, semester_type, slug, size=None, week=None):
                                             row_heights[2]*lecture['height'],
                                             content, mode='shrink')
 
-    page = canvas.Canvas(response, pagesizes.A4)
-    page.translate(margin, pagesizes.A4[1]-margin)
-
-    if 'A4' == size:
-        page.translate(0.5*margin, 2.5*margin-pagesizes.A4[1])
-        page.scale(1.414, 1.414)
-        page.rotate(90)
-    elif 'A6' == size:
-        page.scale(0.707, 0.707)
-    elif 'A7' == size:
-        page.scale(0.5, 0.5)
-
     table = tables.Table(data, colWidths=col_widths, rowHeights=row_heights,
                          style=table_style)
 
     table.wrapOn(page, width, height)
     table.drawOn(page, 0, -height)
-
-    note = request.META.get('HTTP_HOST', '').split(':')[0]
-
-    page.setFont('Helvetica', 10)
-    page.setFillColor(colors.HexColor('#666666'))
-    page.drawString(width - page.stringWidth(note) - 2, -height+2, note)
-
-    page.showPage()
-    page.save()
-
-    response['X-Robots-Tag'] = 'noindex, nofollow'
-    return response
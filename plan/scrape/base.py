@@ -6,25 +6,76 @@ import logging
 import HTMLParser
 
 from django import db
-from django.db.models import Count
+from django.conf import settings
+from django.db.models import Case, Count, Max, Model, Value, When
 
 from plan.common.models import (Course, Exam, ExamType, Lecture, LectureType,
-                                Lecturer, Location, Group, Room, Semester, Week)
+                                Lecturer, Location, Group, Room, Semester,
+                                SemesterStats, Subscription,
+                                SubscriptionLecture, Week)
+from plan.common import fulltext
+from plan.common import utils as common_utils
+from plan.common.catalog import CourseCatalog
+from plan.common.registry import SemesterRegistry
+from plan.common.search import CourseIndex
+from plan.common.snapshot import ScheduleSnapshot
+from plan.ical import static
 from plan.scrape import utils
 
 
 html_parser = HTMLParser.HTMLParser()
 
+# Most rows to read or write per statement when working in batches, keeps us
+# well within SQLite's limit on the number of query parameters.
+BATCH_SIZE = 500
+
+
+def chunked(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_update(objs, fields):
+    """Write fields of objs with one UPDATE per batch of objects.
+
+       Stand-in for the bulk_update() that Django only got in 2.2.
+    """
+    if not objs or not fields:
+        return
+
+    model = type(objs[0])
+    fields = [model._meta.get_field(name) for name in fields]
+    size = BATCH_SIZE // (2 * len(fields) + 1)
+
+    for batch in chunked(objs, size):
+        values = {}
+        for field in fields:
+            cases = [When(pk=obj.pk, then=Value(getattr(obj, field.attname),
+                                                output_field=field))
+                     for obj in batch]
+            values[field.attname] = Case(*cases, output_field=field)
+        model._default_manager.filter(
+            pk__in=[obj.pk for obj in batch]).update(**values)
+
 
 class Scraper(object):
     fields = ()
     extra_fields = ()
     m2m_fields = ()
 
+    # Process scraped items with a few bulk statements, see run_batch().
+    batch = False
+
     def __init__(self, semester, course_prefix=None):
         self.semester = semester
         self.course_prefix = course_prefix
         self.import_time = datetime.datetime.now()
+        self.touch = settings.TIMETABLE_SCRAPE_TOUCH_UNCHANGED
+        self.seen = set()  # Primary keys of items found during this scrape.
+        self.changed = []  # Items created or updated during this scrape.
+        self.lookups = {}
+        self.pending = {}  # Lookups save_lookups() still has to resolve.
         self.stats = collections.OrderedDict([
             ('initial',  0),  # items initialy in db
             ('scraped',  0),  # items we have scraped
@@ -49,6 +100,68 @@ class Scraper(object):
         """
         raise NotImplementedError
 
+    def lookup(self, model, field, value, **defaults):
+        """get_or_create() for reference tables, cached for the whole run.
+
+           Values we have not seen before give an unsaved object that
+           save_lookups() later matches with its row, or creates, together
+           with all other new values. Existing rows get their defaults
+           brought up to date.
+        """
+        items = self.lookups.setdefault(model, {})
+        if value not in items:
+            items[value] = model(**dict(defaults, **{field: value}))
+            self.pending.setdefault((model, field), {})[value] = (
+                items[value], sorted(defaults))
+        return items[value]
+
+    def save_lookups(self):
+        """Give all objects handed out by lookup() a row in the database.
+
+           Only the values asked for are loaded, and the missing ones are
+           created with one insert per batch.
+        """
+        for (model, field), pending in self.pending.items():
+            updated, update_fields = [], set()
+
+            for batch in chunked(sorted(pending)):
+                for row in model.objects.filter(**{field + '__in': batch}):
+                    if getattr(row, field) not in pending:
+                        continue
+                    obj, defaults = pending.pop(getattr(row, field))
+                    changed = [name for name in defaults
+                               if getattr(obj, name) != getattr(row, name)]
+
+                    # Take over the row, apart from the defaults to update.
+                    for f in model._meta.concrete_fields:
+                        if f.name not in changed:
+                            setattr(obj, f.attname, getattr(row, f.attname))
+                    obj._state.adding = False
+                    obj._state.db = row._state.db
+
+                    if changed:
+                        updated.append(obj)
+                        update_fields.update(changed)
+
+            bulk_update(updated, sorted(update_fields))
+
+            created = [obj for obj, defaults in pending.values()]
+            for batch in chunked(created):
+                model.objects.bulk_create(batch)
+
+            # Not all databases give us the primary keys of bulk inserts.
+            missing = dict((getattr(obj, field), obj)
+                           for obj in created if obj.pk is None)
+            for batch in chunked(sorted(missing)):
+                rows = model.objects.filter(**{field + '__in': batch})
+                for value, pk in rows.values_list(field, 'pk'):
+                    obj = missing[value]
+                    obj.pk = pk
+                    obj._state.adding = False
+                    obj._state.db = rows.db
+
+        self.pending = {}
+
     def should_proccess_course(self, code):
         # TODO: delete as this is no longer called?
         """Common helper for filtering out course codes to skip."""
@@ -80,24 +193,59 @@ class Scraper(object):
            5. Call prepare_delete() to determine what to delete.
 
            This method can be overriden to implement custom scrape logic that
-           does not match this pattern.
+           does not match this pattern. Scrapers with batch set do steps 3 and
+           4 in bulk using run_batch().
         """
         self.log_initial()
 
-        for data in self.scrape():
-            try:
-                self.log_scraped(data)
+        if self.batch:
+            self.run_batch()
+        else:
+            prepared = []
+            for data in self.scrape():
+                try:
+                    self.log_scraped(data)
+
+                    data = self.prepare_data(data)
+                    if not data:
+                        continue
+                    self.log_processed(data)
+
+                    # Items may depend on the ones saved before them, so we
+                    # only hold them back while they wait for lookups.
+                    prepared.append(data)
+                    if not self.pending or len(prepared) >= BATCH_SIZE:
+                        self.persist(prepared)
+                        prepared = []
+                finally:
+                    db.reset_queries()
+            self.persist(prepared)
 
-                data = self.prepare_data(data)
-                if not data:
-                    continue
-                self.log_processed(data)
+        self.delete(self.prepare_delete())
+        self.log_stats()
 
+        if self.needs_commit():
+            self.touch_subscriptions(self.changed)
+            # Lets data cached for the whole semester see the change.
+            Semester.objects.filter(pk=self.semester.pk).update(
+                last_import=datetime.datetime.now())
+            ScheduleSnapshot.invalidate()
+            static.changed(self.semester)
+
+        return self.needs_commit()
+
+    def persist(self, items):
+        """Save prepared items one by one, steps 3 and 4 of run()."""
+        self.save_lookups()
+
+        for data in items:
+            try:
                 kwargs = self.prepare_save(data)
                 if not kwargs:
                     continue
 
                 obj, created = self.save(kwargs)
+                self.seen.add(obj.pk)
                 self.log_persisted(obj)
 
                 changes = self.update_m2m(obj, data)
@@ -116,10 +264,190 @@ class Scraper(object):
             finally:
                 db.reset_queries()
 
-        self.delete(self.prepare_delete())
-        self.log_stats()
+    def run_batch(self):
+        """Save all scraped items using a handful of queries.
 
-        return self.needs_commit()
+           Existing items are loaded up front and matched on fields in
+           memory, after which creates, updates and m2m changes are written
+           in bulk. Stats and logging are the same as for the item by item
+           version in run(), but save(), update() and update_m2m() are not
+           used, so this only fits scrapers that don't override them.
+        """
+        model = self.queryset().model
+        fields = [model._meta.get_field(name) for name in self.fields]
+        related = [model._meta.get_field(name) for name in self.m2m_fields]
+
+        def value_key(value):
+            return value.pk if isinstance(value, Model) else value
+
+        existing = collections.defaultdict(collections.deque)
+        qs = self.queryset().filter(last_import__lt=self.import_time)
+        for obj in qs.order_by('pk'):
+            key = tuple(getattr(obj, f.attname) for f in fields)
+            existing[key].append(obj)
+
+        # {field: {obj pk: {related pk: (through pk, related obj)}}}
+        current = self.load_m2m(related, [o.pk for objs in existing.values()
+                                          for o in objs])
+
+        created, touched, updated, update_fields = [], [], [], set()
+        m2m_values = []
+
+        prepared = []
+        for data in self.scrape():
+            try:
+                self.log_scraped(data)
+
+                data = self.prepare_data(data)
+                if data:
+                    self.log_processed(data)
+                    prepared.append(data)
+            finally:
+                db.reset_queries()
+
+        # Items are keyed on primary keys, lookups included.
+        self.save_lookups()
+
+        for data in prepared:
+            try:
+                kwargs = self.prepare_save(data)
+                if not kwargs:
+                    continue
+
+                defaults = kwargs.pop('defaults')
+                key = tuple(value_key(kwargs[f.name]) for f in fields)
+
+                if existing.get(key):
+                    obj, is_new = existing[key].popleft(), False
+                    touched.append(obj)
+                else:
+                    kwargs.update(defaults)
+                    obj, is_new = model(**kwargs), True
+                    created.append(obj)
+                self.log_persisted(obj)
+
+                changes = {}
+                for field in related:
+                    new_values = data[field.name]
+                    m2m_values.append((obj, field, new_values))
+
+                    if is_new:
+                        continue
+                    old = current[field.name].get(obj.pk, {})
+                    if set(old) != set(v.pk for v in new_values):
+                        changes[field.name] = (
+                            [o for p, o in old.values()], new_values)
+
+                if is_new:
+                    self.log_created(obj)
+                    continue
+
+                dirty = False
+                for field, value in defaults.items():
+                    old_value = getattr(obj, field)
+                    if old_value != value:
+                        setattr(obj, field, value)
+                        changes[field] = (old_value, value)
+                        update_fields.add(field)
+                        dirty = True
+
+                if dirty:
+                    updated.append(obj)
+
+                if changes:
+                    self.log_updated(obj, changes)
+                    continue
+
+                self.log_unaltered(obj)
+            finally:
+                db.reset_queries()
+
+        self.save_batch(model, fields, created)
+        self.seen.update(obj.pk for obj in created + touched)
+
+        # Stands in for the save() that updates last_import in update().
+        now = datetime.datetime.now()
+        for obj in updated:
+            obj.last_import = now
+        bulk_update(updated, sorted(update_fields) + ['last_import'])
+
+        if self.touch:
+            for batch in chunked(touched):
+                model._default_manager.filter(
+                    pk__in=[o.pk for o in batch]).update(last_import=now)
+
+        self.update_m2m_batch(current, m2m_values)
+
+    def load_m2m(self, related, pks):
+        current = {}
+        for field in related:
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+
+            current[field.name] = values = collections.defaultdict(dict)
+            for batch in chunked(pks):
+                rows = through.objects.filter(**{source + '__in': batch})
+                for row in rows.select_related(target):
+                    values[getattr(row, source + '_id')][
+                        getattr(row, target + '_id')] = (row.pk, getattr(row, target))
+        return current
+
+    def save_batch(self, model, fields, objs):
+        """Insert objs, making sure they end up with primary keys."""
+        if not objs:
+            return
+
+        manager = model._default_manager
+        last_pk = manager.aggregate(value=Max('pk'))['value'] or 0
+
+        for batch in chunked(objs):
+            manager.bulk_create(batch)
+
+        # Only some databases give us the new primary keys, otherwise look
+        # them up among the rows inserted after last_pk. The scraper's own
+        # queryset can't be used as it may not cover every created row.
+        if all(obj.pk for obj in objs):
+            return
+
+        def key(obj):
+            return tuple(getattr(obj, f.attname) for f in fields)
+
+        pks = collections.defaultdict(collections.deque)
+        qs = manager.filter(pk__gt=last_pk, last_import__gte=self.import_time)
+        for obj in qs.order_by('pk'):
+            pks[key(obj)].append(obj.pk)
+
+        for obj in objs:
+            if not pks[key(obj)]:
+                raise db.IntegrityError(
+                    'Could not find the created %s.' % self.display(obj))
+            obj.pk = pks[key(obj)].popleft()
+
+    def update_m2m_batch(self, current, m2m_values):
+        """Bring m2m relations in line with m2m_values using bulk queries."""
+        inserts = collections.defaultdict(list)
+        deletes = collections.defaultdict(list)
+
+        for obj, field, new_values in m2m_values:
+            through = field.remote_field.through
+            source = field.m2m_field_name() + '_id'
+            target = field.m2m_reverse_field_name() + '_id'
+
+            old = current[field.name].get(obj.pk, {})
+            new = set(v.pk for v in new_values)
+
+            deletes[through].extend(p for pk, (p, o) in old.items()
+                                    if pk not in new)
+            inserts[through].extend(through(**{source: obj.pk, target: pk})
+                                    for pk in new if pk not in old)
+
+        for through, pks in deletes.items():
+            for batch in chunked(pks):
+                through.objects.filter(pk__in=batch).delete()
+        for through, rows in inserts.items():
+            for batch in chunked(rows):
+                through.objects.bulk_create(batch)
 
     def prepare_data(self, data):
         """Clean and/or validate data from scrape method.
@@ -139,13 +467,20 @@ class Scraper(object):
         return kwargs
 
     def save(self, kwargs):
-        """Save prepared arguments using get_or_create().
+        """Save prepared arguments like get_or_create() would.
 
-           This method keeps filters out already updated items. Which prevents
-           some cases of stepping on our own toes during updates.
+           This method skips items we have already seen. Which prevents some
+           cases of stepping on our own toes during updates.
         """
-        qs = self.queryset().filter(last_import__lt=self.import_time)
-        return qs.get_or_create(**kwargs)
+        kwargs = kwargs.copy()
+        defaults = kwargs.pop('defaults', {})
+
+        for obj in self.queryset().filter(**kwargs):
+            if obj.pk not in self.seen:
+                return obj, False
+
+        kwargs.update(defaults)
+        return self.queryset().create(**kwargs), True
 
     def update_m2m(self, obj, data):
         changes = {}
@@ -170,21 +505,53 @@ class Scraper(object):
                 setattr(obj, field, value)
                 changes[field] = (old_value, value)
 
-        obj.save()  # To trigger update of last import time.
+        if changes or self.touch:
+            obj.save()  # Also updates last import time.
         return changes
 
     def prepare_delete(self):
-        """Filter a query set done to objects that should be deleted.
+        """List the objects that should be deleted.
 
            Default is to delete all items within the current scrapers queryset
-           limitation that we have not updated or created.
+           limitation that we have not seen during this scrape. Items are
+           fetched in chunks to stay below the database's limit on query
+           parameters.
         """
-        return self.queryset().filter(last_import__lt=self.import_time)
+        pks = set(self.queryset().values_list('pk', flat=True)) - self.seen
+
+        items = []
+        for batch in chunked(sorted(pks)):
+            items.extend(self.queryset().filter(pk__in=batch))
+        return items
+
+    def delete(self, items):
+        """Actually delete the items from prepare_delete()."""
+        self.log_delete(items)
+        # Deleted courses take their subscriptions with them.
+        self.touch_subscriptions(items)
+
+        if items:
+            manager = items[0]._meta.model._default_manager
+            for batch in chunked([obj.pk for obj in items]):
+                manager.filter(pk__in=batch).delete()
+
+    def course_ids(self, items):
+        """Primary keys of the courses items are part of."""
+        return set(obj.course_id for obj in items)
+
+    def touch_subscriptions(self, items):
+        """Mark students following the courses of items as modified.
 
-    def delete(self, qs):
-        """Actually delete the query set."""
-        self.log_delete(qs)
-        qs.delete()
+           Needed for Last-Modified as only saved rows get a new last_import,
+           leaving deletes and changes to related rows unnoticed.
+        """
+        now = datetime.datetime.now()
+        for batch in chunked(sorted(self.course_ids(items))):
+            students = Subscription.objects.filter(
+                course__in=batch).values('student')
+            Subscription.objects.filter(
+                student__in=students, course__semester=self.semester).update(
+                    modified=now)
 
     def display(self, obj):
         """Helper that defines how objects are stringified for display."""
@@ -204,10 +571,12 @@ class Scraper(object):
 
     def log_created(self, obj):
         self.stats['created'] += 1
+        self.changed.append(obj)
         logging.info('Added %s', self.display(obj))
 
     def log_updated(self, obj, changes):
         self.stats['updated'] += 1
+        self.changed.append(obj)
         logging.info('Updated %s:', self.display(obj))
         for key, (old, new) in changes.items():
             logging.info('  %s: %s', key, utils.compare(old, new))
@@ -215,10 +584,10 @@ class Scraper(object):
     def log_unaltered(self, obj):
         self.stats['unaltered'] += 1
 
-    def log_delete(self, qs):
-        self.stats['deleted'] = qs.count()
-        if qs:
-            logging.info('Deleted:\n%s', self.format(qs))
+    def log_delete(self, items):
+        self.stats['deleted'] = len(items)
+        if items:
+            logging.info('Deleted:\n%s', self.format(items))
 
     def log_stats(self):
         self.stats['final'] = self.queryset().count() - self.stats['deleted']
@@ -240,6 +609,7 @@ class CourseScraper(Scraper):
     fields = ('code', 'version', 'semester')
     extra_fields = ('name', 'url', 'points')
     m2m_fields = ('locations',)
+    batch = True
 
     def queryset(self):
         qs = Course.objects.filter(semester=self.semester)
@@ -261,20 +631,43 @@ class CourseScraper(Scraper):
 
         return data
 
+    def run(self):
+        needs_commit = super(CourseScraper, self).run()
+        if needs_commit:
+            fulltext.sync(self.semester.id)
+            CourseIndex.invalidate(self.semester.year, self.semester.type)
+            CourseCatalog.invalidate(self.semester.year, self.semester.type)
+            # Deleted or renamed courses change the statistics as well.
+            SemesterStats.objects.rebuild(self.semester.pk)
+            # Locations per semester come from courses.
+            SemesterRegistry.invalidate()
+        return needs_commit
+
     def display(self, obj):
         return obj.code
 
+    def course_ids(self, items):
+        return set(obj.pk for obj in items)
+
     def format(self, items):
         return utils.columnify(
             (u'%s - %s lectures' % (c, c.lecture__count) for c in items), 2)
 
     def location(self, name):
-        return Location.objects.get_or_create(name=name)[0]
+        return self.lookup(Location, 'name', name)
 
 
 class LectureScraper(Scraper):
     fields = ('course', 'day', 'start', 'end', 'type')
-    extra_fields = ('rooms', 'lecturers', 'groups', 'weeks', 'title')
+    extra_fields = ('rooms', 'lecturers', 'groups', 'weeks', 'title',
+                    'external_id')
+
+    def __init__(self, *args, **kwargs):
+        super(LectureScraper, self).__init__(*args, **kwargs)
+        self.lectures = None  # Loaded on first save(), see load_lectures().
+        self.moved = {}
+        self.left_courses = set()  # Courses lectures were moved away from.
+        self.rooms_by_code = None  # Loaded on first room(), see load_rooms().
 
     def queryset(self):
         qs = Lecture.objects.filter(course__semester=self.semester)
@@ -293,6 +686,10 @@ class LectureScraper(Scraper):
         return utils.columnify(
             (u'%s - %s subscriptions' % (c, c.course__subscription__count) for c in items), 2)
 
+    def course_ids(self, items):
+        course_ids = super(LectureScraper, self).course_ids(items)
+        return course_ids | self.left_courses
+
     def needs_commit(self, stats=None):
         return super(LectureScraper, self).needs_commit(
             ('created', 'updated', 'deleted', 'rooms'))
@@ -322,51 +719,112 @@ class LectureScraper(Scraper):
 
         return data
 
+    def load_lectures(self):
+        """Index the lectures we might update along with their relations.
+
+           Lectures are indexed both by the fields we match on and by their
+           external id, so save() can pick candidates without any queries.
+        """
+        self.lectures = collections.defaultdict(list)
+        self.external_ids = {}
+        self.related = collections.defaultdict(dict)
+
+        qs = self.queryset().filter(last_import__lt=self.import_time)
+        for l in qs.order_by('id'):
+            self.lectures[self.lecture_key(l)].append(l)
+            if l.external_id:
+                self.external_ids[l.external_id] = l
+            for field in ('rooms', 'lecturers', 'groups'):
+                self.related[l.pk][field] = set()
+
+        filters = {'lecture__course__semester': self.semester}
+        if self.course_prefix:
+            filters['lecture__course__code__startswith'] = self.course_prefix
+
+        for field in ('rooms', 'lecturers', 'groups'):
+            target = Lecture._meta.get_field(field).m2m_reverse_field_name()
+            through = getattr(Lecture, field).through
+            for row in through.objects.filter(**filters).select_related(target):
+                if row.lecture_id in self.related:
+                    self.related[row.lecture_id][field].add(getattr(row, target))
+
+    def lecture_key(self, lecture):
+        return (lecture.course_id, lecture.day, lecture.start, lecture.end,
+                lecture.type_id)
+
+    def claim(self, lecture):
+        """Stop lecture from being matched again during this scrape."""
+        self.lectures[self.lecture_key(lecture)].remove(lecture)
+        if lecture.external_id:
+            self.external_ids.pop(lecture.external_id, None)
+
     def save(self, kwargs):
         kwargs = kwargs.copy()
         defaults = kwargs.pop('defaults')
 
-        groups = set(g.pk for g in defaults['groups'])
-        kwargs['type'] = self.lecture_type(kwargs['type'])
-
-        lectures = self.queryset().filter(**kwargs).order_by('id')
-        lectures = lectures.filter(last_import__lt=self.import_time)
+        if self.lectures is None:
+            self.load_lectures()
+
+        external_id = defaults.get('external_id')
+        if external_id in self.external_ids:
+            obj = self.external_ids[external_id]
+            self.claim(obj)
+
+            # The source says this is the same lecture, so move it instead
+            # of treating the new time or type as a new lecture.
+            for field, value in kwargs.items():
+                attname = Lecture._meta.get_field(field).attname
+                if getattr(obj, attname) != getattr(value, 'pk', value):
+                    self.moved.setdefault(obj.pk, {})[field] = (
+                        getattr(obj, field), value)
+                    setattr(obj, field, value)
+            return obj, False
+
+        groups = set(defaults['groups'])
+        week_mask = common_utils.weeks_to_mask(defaults['weeks'])
+        key = (kwargs['course'].pk, kwargs['day'], kwargs['start'],
+               kwargs['end'], kwargs['type'].pk)
 
         # Try way to hard to find what is likely the same lecture so we can
         # update instead of replacing. This is needed to have some what stable
         # imports and not step on our own feet flip flopping lectures back and
         # forth.
-        # TODO: add an external_id field to use when available.
-        candidates = {}
-        for l in lectures:
-            candidates[l] = 0
+        best, best_score = None, 0
+        for l in self.lectures.get(key, []):
+            related = self.related[l.pk]
+            score = 0
 
-            if groups == set(l.groups.values_list('pk', flat=True)):
-                candidates[l] = 3
+            if groups == related['groups']:
+                score = 3
 
             for field in ('rooms', 'lecturers'):
-                if set(defaults[field]) == set(getattr(l, field).all()):
-                    candidates[l] += 1
+                if set(defaults[field]) == related[field]:
+                    score += 1
 
-            weeks = l.weeks.values_list('number', flat=True)
-            if set(defaults['weeks']) == set(weeks):
-                candidates[l] += 2
+            if week_mask == l.week_mask:
+                score += 2
 
-        if candidates:
-            obj, score = sorted(candidates.items(), key=lambda i: -i[1])[0]
-            if score > 0:
-                return obj, False
+            if score > best_score:
+                best, best_score = l, score
 
-        obj = lectures.create(**kwargs)
+        if best:
+            self.claim(best)
+            return best, False
+
+        obj = Lecture.objects.create(**kwargs)
+        for field in ('rooms', 'lecturers', 'groups'):
+            self.related[obj.pk][field] = set()
         self.update(obj, defaults)
         return obj, True
 
     def update(self, obj, defaults):
-        changes = {}
+        changes = self.moved.pop(obj.pk, {})
 
         # TODO: Replace with m2m_fields handling?
         for field in ('rooms', 'lecturers', 'groups'):
-            current = set(getattr(obj, field).all())
+            current = self.related.get(obj.pk, {}).get(field)
+            if current is None:
+                current = set(getattr(obj, field).all())
             if current != set(defaults[field]):
                 changes[field] = current, set(defaults[field])
                 setattr(obj, field, defaults[field])
@@ -375,66 +833,104 @@ class LectureScraper(Scraper):
             changes['title'] = (obj.title, defaults['title'])
             obj.title = defaults['title']
 
-        obj.save()
+        if 'external_id' in defaults and obj.external_id != defaults['external_id']:
+            changes['external_id'] = (obj.external_id, defaults['external_id'])
+            obj.external_id = defaults['external_id']
 
-        current = set(obj.weeks.values_list('number', flat=True))
-        if current != set(defaults['weeks']):
+        current = set(obj.week_numbers)
+        obj.week_mask = common_utils.weeks_to_mask(defaults['weeks'])
+        if current != set(obj.week_numbers):
             changes['weeks'] = current, set(defaults['weeks'])
+
+        if changes or self.touch:
+            obj.save()
+
+        if 'weeks' in changes:
             obj.weeks.all().delete()
 
             for week in defaults['weeks']:
                 Week.objects.create(lecture=obj, number=week)
 
+        if 'course' in changes:
+            # Subscribers of the old course lose the lecture and those of the
+            # new one gain it.
+            old_course, new_course = changes['course']
+            self.left_courses.add(old_course.pk)
+            SubscriptionLecture.objects.refresh(Subscription.objects.filter(
+                course__in=[old_course, new_course]))
+        elif 'groups' in changes:
+            SubscriptionLecture.objects.refresh(lectures=[obj])
+
         return changes
 
     def lecture_type(self, name):
-        return LectureType.objects.get_or_create(name=name)[0]
+        return self.lookup(LectureType, 'name', name)
+
+    def load_rooms(self):
+        """Index all rooms by code, and by name for those without a code."""
+        self.rooms_by_code = {}
+        self.rooms_by_name = collections.defaultdict(list)
+        self.rooms_found = {}  # Rooms room() had to ask the database for.
+
+        for room in Room.objects.all():
+            if room.code is None:
+                self.rooms_by_name[room.name].append(room)
+            else:
+                self.rooms_by_code[room.code] = room
 
     def room(self, code, name, url):
         if url and '&amp;' in url:
             url = html_parser.unescape(url)
 
-        if code:
-            try:
-                room = Room.objects.get(code=code)
-                if room.name != name:
-                    logging.warning('Room %s: %s != %s', room.code, room.name, name)
-                if url and room.url != url:
-                    self.log_extra('rooms', 'Adding room url %s to %s (%s)', [url, room.name, room.code])
-                    room.url = url
-                    room.save()
-                return room
-            except Room.DoesNotExist:
-                pass
+        if self.rooms_by_code is None:
+            self.load_rooms()
+
+        if code and code in self.rooms_by_code:
+            room = self.rooms_by_code[code]
+            if room.name != name:
+                logging.warning('Room %s: %s != %s', room.code, room.name, name)
+            if url and room.url != url:
+                self.log_extra('rooms', 'Adding room url %s to %s (%s)', [url, room.name, room.code])
+                room.url = url
+                room.save()
+            return room
 
         # Get room by just name and code=None so we can try and upgrade.
-        rooms = Room.objects.filter(code=None, name=name)
+        rooms = self.rooms_by_name.get(name, [])
         if len(rooms) == 1:
-            r = rooms.get()
+            r = rooms[0]
             if code:
                 self.log_extra('rooms', 'Adding room code %s to %s', [code, r.name])
                 r.code = code
                 r.save()
+                del self.rooms_by_name[name]
+                self.rooms_by_code[code] = r
             if url and url != r.url:
                 self.log_extra('rooms', 'Adding room url %s to %s', [url, r.name])
                 r.url = url
                 r.save()
             return r
 
-        if not code:
-            return Room.objects.get_or_create(name=name)[0]
-        return Room.objects.get_or_create(code=code, defaults={'name': name})[0]
+        if (code, name) not in self.rooms_found:
+            if not code:
+                room = Room.objects.get_or_create(name=name)[0]
+            else:
+                room = Room.objects.get_or_create(code=code, defaults={'name': name})[0]
+                self.rooms_by_code[code] = room
+            self.rooms_found[code, name] = room
+        return self.rooms_found[code, name]
 
     def lecturer(self, name):
-        return Lecturer.objects.get_or_create(name=name)[0]
+        return self.lookup(Lecturer, 'name', name)
 
     def group(self, code):
-        return Group.objects.get_or_create(code=code)[0]
+        return self.lookup(Group, 'code', code)
 
 
 class ExamScraper(Scraper):
     fields = ('course', 'type', 'combination', 'exam_date')
     extra_fields = ('duration', 'exam_time', 'handout_date', 'handout_time')
+    batch = True
 
     def queryset(self):
         qs = Exam.objects.filter(course__semester=self.semester)
@@ -471,12 +967,12 @@ class ExamScraper(Scraper):
             return data
 
     def exam_type(self, code, name):
-        exam_type, created = ExamType.objects.get_or_create(
-            code=code, defaults={'name': name})
+        exam_type = self.lookup(ExamType, 'code', code, name=name)
 
         if exam_type.name != name:
             exam_type.name = name
-            exam_type.save()
+            if exam_type.pk:  # Otherwise save_lookups() takes care of it.
+                exam_type.save()
 
         return exam_type
 
@@ -484,11 +980,20 @@ class ExamScraper(Scraper):
 class RoomScraper(Scraper):
     fields = ('code',)
     extra_fields = ('name', 'url',)
+    batch = True
 
     def queryset(self):
         return Room.objects.order_by('name', 'code')
 
-    def delete(self, qs):
+    def course_ids(self, items):
+        course_ids = set()
+        for batch in chunked([obj.pk for obj in items if obj.pk]):
+            course_ids.update(Lecture.objects.filter(
+                rooms__in=batch, course__semester=self.semester).values_list(
+                    'course_id', flat=True))
+        return course_ids
+
+    def delete(self, items):
         logging.warning('This scraper newer deletes any rooms as we would '
                         'loose data we can\'t get back.')
 
@@ -506,14 +1011,18 @@ class SyllabysScraper(Scraper):
     def display(self, obj):
         return obj.code
 
+    def course_ids(self, items):
+        return set(obj.pk for obj in items)
+
     def prepare_data(self, data):
         # Only update courses we already know about.
-        qs = self.queryset().filter(code=data['code'])
-        if qs.filter(last_import__lt=self.import_time):
+        pks = set(self.queryset().filter(code=data['code']).values_list(
+            'pk', flat=True))
+        if pks - self.seen:
             return data
-        elif qs:
+        elif pks:
             logging.warning('Duplicate syllabus info for: %s', data['code'])
 
-    def delete(self, qs):
+    def delete(self, items):
         # TODO(adamcik): clear syllabus we didn't find.
         pass
@@ -1,24 +1,151 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
 import collections
+import itertools
 import json as jsonlib
 import logging
 import lxml.etree
 import lxml.html
-import warnings
+import Queue
+import sys
+import threading
+import time
 import urllib
+import urlparse
 
 import requests
+from requests import adapters
 
-from django.core import cache
+from django.conf import settings
 from django.db import connections
-from django.core.cache import CacheKeyWarning
 
-warnings.simplefilter('ignore', CacheKeyWarning)
-
-scraper_cache = cache.caches['scraper']
+from plan.scrape import store
 
 session = requests.Session()
+# Enough pooled connections for every worker to keep its own.
+for prefix in ('http://', 'https://'):
+    session.mount(prefix, adapters.HTTPAdapter(
+        pool_connections=settings.TIMETABLE_SCRAPE_WORKERS,
+        pool_maxsize=settings.TIMETABLE_SCRAPE_WORKERS))
+
+
+class RateLimiter(object):
+    """Spaces out requests to each host, shared by all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, url):
+        rate = settings.TIMETABLE_SCRAPE_RATE_LIMIT
+        if not rate:
+            return
+
+        host = urlparse.urlsplit(url).netloc
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + 1.0 / rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+limiter = RateLimiter()
+
+
+def request(method, url, **kwargs):
+    """Send request, retrying with backoff on connection and server errors."""
+    retries = settings.TIMETABLE_SCRAPE_RETRIES
+
+    for attempt in xrange(retries + 1):
+        limiter.wait(url)
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            logging.warning('Retrying %s: %s', url, e)
+        else:
+            if response.status_code < 500 or attempt == retries:
+                return response
+            logging.warning('Retrying %s: %s', url, response.status_code)
+
+        time.sleep(settings.TIMETABLE_SCRAPE_BACKOFF * 2 ** attempt)
+
+
+class _Task(object):
+    def __init__(self, func, item):
+        self.func = func
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(self.item)
+        except Exception:
+            self.error = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def get(self):
+        # Wait with a timeout, as plain waits can't be interrupted.
+        while not self.done.wait(0.1):
+            pass
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+def prefetch(func, items, workers=None):
+    """Yield (item, func(item)) for items, in order.
+
+       Calls are made in worker threads, staying at most a few items ahead
+       of the consumer, so the next items are fetched while the current one
+       is processed. func should only fetch data, not use the database.
+    """
+    workers = workers or settings.TIMETABLE_SCRAPE_WORKERS
+    items = iter(items)
+
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    tasks = Queue.Queue()
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            task.run()
+
+    threads = [threading.Thread(target=worker) for i in xrange(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = collections.deque()
+
+    def submit(count):
+        for item in itertools.islice(items, count):
+            task = _Task(func, item)
+            pending.append(task)
+            tasks.put(task)
+
+    try:
+        submit(workers * 2)
+        while pending:
+            task = pending.popleft()
+            result = task.get()
+            submit(1)
+            yield task.item, result
+    finally:
+        for thread in threads:
+            tasks.put(None)
 
 
 def sql(db, query, params=None):
@@ -30,16 +157,37 @@ def sql(db, query, params=None):
         yield row(*values)
 
 
+def is_fresh(entry, url):
+    return time.time() - entry.fetched < store.get_ttl(url)
+
+
 def get(url, cache=True, verbose=False):
     key = 'get||%s' % (url)
-    result = scraper_cache.get(key)
+    entry = store.responses.get(key) if cache else None
     msg = 'Cached fetch: %s' % url
-    if not result or not cache:
-        msg = 'Fetched: %s' % url
-        response = session.get(url, timeout=30)
-        result = response.text
-        if response.status_code == 200 and result:
-            scraper_cache.set(key, result)
+
+    if entry and is_fresh(entry, url):
+        result = entry.body
+    else:
+        # Ask the server to skip the body if our copy is still good.
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+        response = request('GET', url, headers=headers)
+        if entry and response.status_code == 304:
+            msg = 'Revalidated: %s' % url
+            result = entry.body
+            store.responses.touch(key)
+        else:
+            msg = 'Fetched: %s' % url
+            result = response.text
+            if response.status_code == 200 and result:
+                store.responses.set(key, result,
+                                    response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified'))
 
     logging.log(logging.INFO if verbose else logging.DEBUG, msg)
     return result
@@ -47,15 +195,17 @@ def get(url, cache=True, verbose=False):
 
 def post(url, data, cache=True, verbose=False):
     key = 'post||%s||%s' % (url, urllib.urlencode(data))
-    result = scraper_cache.get(key)
+    entry = store.responses.get(key) if cache else None
     msg = 'Cached result found under: %s' % key
 
-    if not result or not cache:
+    if entry and is_fresh(entry, url):
+        result = entry.body
+    else:
         msg = 'Post: %s Data: %s' % (url, data)
-        response = session.post(url, data=data, timeout=30)
+        response = request('POST', url, data=data)
         result = response.text
         if response.status_code == 200 and result:
-            scraper_cache.set(key, result)
+            store.responses.set(key, result)
 
     logging.log(logging.INFO if verbose else logging.DEBUG, msg)
     return result
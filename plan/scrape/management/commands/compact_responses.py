@@ -0,0 +1,23 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+from django.core.management import base as management
+
+from plan.scrape import store
+
+
+class Command(management.BaseCommand):
+    help = 'Remove old and unused responses from TIMETABLE_SCRAPE_STORE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--max-age', action='store', dest='max_age',
+                            type=int, help='drop responses fetched more than '
+                            'this many days ago, default: keep all')
+
+    def handle(self, **options):
+        max_age = options['max_age']
+        if max_age is not None:
+            max_age *= 60 * 60 * 24
+
+        responses, bodies = store.responses.compact(max_age)
+        self.stdout.write('Removed %d responses and %d bodies.' %
+                          (responses, bodies))
@@ -91,6 +91,7 @@ class Command(management.LabelCommand):
         except Semester.DoesNotExist:
             if not options['create']:
                 raise
+            # Saving the semester also invalidates the semester registry.
             return Semester.objects.create(year=year, type=type)
 
     def load_scraper(self, type):
@@ -14,9 +14,12 @@ def fetch_pois(tag):
     campuses = fetch.json('http://use.mazemap.com/api/campuscollections/?tag=%s' % tag)
     base_url = 'http://api.mazemap.com/api/pois/?campusid=%s'
 
+    responses = fetch.prefetch(
+        lambda campus: fetch.json(base_url % campus['campusId']),
+        campuses['children'])
+
     pois = {}
-    for campus in campuses['children']:
-        data = fetch.json(base_url % campus['campusId'])
+    for campus, data in responses:
         for p in data.get('pois', []):
             if p['identifier'] and not p['deleted']:
                 pois[normalize(p['identifier'])] = p
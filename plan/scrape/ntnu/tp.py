@@ -32,9 +32,11 @@ class Courses(base.CourseScraper):
 class Lectures(base.LectureScraper):
     def scrape(self):
 
-        for c in self.course_queryset():
-            result = fetch_course_lectures(self.semester, c)
+        courses = fetch.prefetch(
+            lambda c: fetch_course_lectures(self.semester, c),
+            self.course_queryset())
 
+        for c, result in courses:
             if 'data' not in result or not result['data']:
                 continue
 
@@ -42,6 +44,7 @@ class Lectures(base.LectureScraper):
                 for method in methods:
                     for sequence in method['eventsequences']:
                         current = None
+                        parts = 0
 
                         for e in sequence['events']:
                             tmp = {
@@ -58,8 +61,10 @@ class Lectures(base.LectureScraper):
                                     'type': method.get('teaching-method-name', 'teaching-method'),
                                     'weeks': [],
                                     'lecturers': [],
+                                    'external_id': sequence_id(sequence, parts),
                                 }
                                 current.update(tmp)
+                                parts += 1
 
                             for key in tmp:
                                 if current[key] != tmp[key]:
@@ -101,6 +106,15 @@ def convert_semester(semester):
         return u'%sv' % str(semester.year)[-2:]
 
 
+def sequence_id(sequence, part):
+    """Stable id for a lecture made from (part of) an event sequence."""
+    if not sequence.get('id'):
+        return None
+    elif part:
+        return u'%s-%d' % (sequence['id'], part)
+    return unicode(sequence['id'])
+
+
 def process_groups(values):
     groups = []
     for value in values:
@@ -26,6 +26,9 @@ class Courses(base.CourseScraper):
 
 class Exams(base.ExamScraper):
     def scrape(self):
+        courses = dict(((c.code, c.version), c) for c in
+                       Course.objects.filter(semester=self.semester))
+
         for course in fetch_courses(self.semester):
             seen = set()
             for exam in course['exam']:
@@ -42,10 +45,8 @@ class Exams(base.ExamScraper):
 
                 seen.add(date)
                 yield {
-                    'course': Course.objects.get(
-                        code=course['courseCode'],
-                        version=course['courseVersion'],
-                        semester=self.semester),
+                    'course': courses[course['courseCode'],
+                                      course['courseVersion']],
                     'exam_date': date,
                 }
 
@@ -57,8 +58,11 @@ class Lectures(base.LectureScraper):
         else:
             ntnu_semeter = u'%d_VÅR' % self.semester.year
 
-        for c in self.course_queryset():
-            course = fetch_course_lectures(self.semester, c)
+        courses = fetch.prefetch(
+            lambda c: fetch_course_lectures(self.semester, c),
+            self.course_queryset())
+
+        for c, course in courses:
             for activity in course.get('summarized', []):
                 if activity['artermin'] != ntnu_semeter:
                     continue
@@ -74,14 +78,18 @@ class Lectures(base.LectureScraper):
                     'groups': activity.get('studyProgramKeys', []),
                     'lecturers': [],
                     'title': activity.get('title'),
+                    'external_id': activity_id(activity),
                 }
 
 
 class Rooms(base.RoomScraper):
     def scrape(self):
         seen = set()
-        for c in Course.objects.filter(semester=self.semester):
-            course = fetch_course_lectures(self.semester, c)
+        courses = fetch.prefetch(
+            lambda c: fetch_course_lectures(self.semester, c),
+            Course.objects.filter(semester=self.semester))
+
+        for c, course in courses:
             for activity in course.get('summarized', []):
                 for room in activity.get('rooms', []):
                     if room['syllabusKey'] not in seen:
@@ -91,6 +99,12 @@ class Rooms(base.RoomScraper):
                                'url': room.get('url')}
 
 
+def activity_id(activity):
+    """Id the timetable uses for an activity, if it gives one."""
+    if activity.get('id'):
+        return unicode(activity['id'])
+
+
 def fetch_course_lectures(semester, course):
     url = 'https://www.ntnu.no/web/studier/emner'
     query = {
@@ -0,0 +1,154 @@
+# This file is part of the plan timetable generator, see LICENSE for details.
+
+"""Responses fetched by scrapers, kept in a single SQLite file.
+
+   Bodies are zlib compressed and stored once per distinct content, keyed by
+   their sha1, while each request points at its latest body along with the
+   ETag and Last-Modified headers needed to revalidate it. Responses are
+   used as is for TIMETABLE_SCRAPE_TTL seconds, or the time given by the
+   first matching pattern in TIMETABLE_SCRAPE_TTLS.
+"""
+
+import collections
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS bodies ('
+    '  digest TEXT PRIMARY KEY,'
+    '  data BLOB NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS responses ('
+    '  key TEXT PRIMARY KEY,'
+    '  digest TEXT NOT NULL REFERENCES bodies (digest),'
+    '  etag TEXT,'
+    '  last_modified TEXT,'
+    '  fetched REAL NOT NULL)',
+]
+
+Entry = collections.namedtuple('Entry', 'body etag last_modified fetched')
+
+
+def get_ttl(url):
+    """Seconds a response from url can be used without revalidating it."""
+    for pattern, ttl in settings.TIMETABLE_SCRAPE_TTLS:
+        if re.search(pattern, url):
+            return ttl
+    return settings.TIMETABLE_SCRAPE_TTL
+
+
+class ResponseStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        path = settings.TIMETABLE_SCRAPE_STORE
+        if path != ':memory:' and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # Prefetching shares the connection between threads, which is fine
+        # as every use holds the lock.
+        connection = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    def _execute(self, *statements):
+        """Run (query, params) statements in one transaction.
+
+           Returns the rows from the last statement.
+        """
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN')
+            try:
+                for query, params in statements:
+                    cursor.execute(query, params)
+                rows = cursor.fetchall()
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            return rows
+
+    def get(self, key):
+        rows = self._execute((
+            'SELECT b.data, r.etag, r.last_modified, r.fetched '
+            'FROM responses r JOIN bodies b ON b.digest = r.digest '
+            'WHERE r.key = ?', [key]))
+        if not rows:
+            return None
+
+        data, etag, last_modified, fetched = rows[0]
+        return Entry(zlib.decompress(data).decode('utf-8'),
+                     etag, last_modified, fetched)
+
+    def set(self, key, body, etag=None, last_modified=None):
+        data = body.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+
+        self._execute(
+            ('INSERT OR IGNORE INTO bodies (digest, data) VALUES (?, ?)',
+             [digest, buffer(zlib.compress(data))]),
+            ('INSERT OR REPLACE INTO responses '
+             '(key, digest, etag, last_modified, fetched) '
+             'VALUES (?, ?, ?, ?, ?)',
+             [key, digest, etag, last_modified, time.time()]))
+
+    def touch(self, key):
+        """Mark key's response as up to date, used after a 304."""
+        self._execute(('UPDATE responses SET fetched = ? WHERE key = ?',
+                       [time.time(), key]))
+
+    def compact(self, max_age=None):
+        """Drop responses older than max_age seconds and unused bodies.
+
+           Returns the number of responses and bodies that were removed.
+        """
+        statements = []
+        if max_age is not None:
+            statements.append(('DELETE FROM responses WHERE fetched < ?',
+                               [time.time() - max_age]))
+            statements.append(('SELECT changes()', []))
+        responses = self._execute(*statements)[0][0] if statements else 0
+
+        bodies = self._execute(
+            ('DELETE FROM bodies WHERE digest NOT IN '
+             '(SELECT digest FROM responses)', []),
+            ('SELECT changes()', []))[0][0]
+
+        # VACUUM can't run inside a transaction.
+        with self._lock:
+            self._connection.execute('VACUUM')
+
+        return responses, bodies
+
+    def count(self):
+        return self._execute(
+            ('SELECT (SELECT COUNT(*) FROM responses), '
+             '(SELECT COUNT(*) FROM bodies)', []))[0]
+
+    def clear(self):
+        self._execute(('DELETE FROM responses', []),
+                      ('DELETE FROM bodies', []))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+responses = ResponseStore()
@@ -1,9 +1,438 @@
 # This file is part of the plan timetable generator, see LICENSE for details.
 
+import BaseHTTPServer
+import SocketServer
+import datetime
+import threading
+import time
+
+from django.db import transaction
+from django.test.utils import override_settings
+
+from plan.common.models import (Course, ExamType, Group, Lecture, Lecturer,
+                                LectureType, Room, Semester, Subscription,
+                                SubscriptionLecture)
 from plan.common.tests import BaseTestCase
+from plan.scrape import base
+from plan.scrape import fetch
+from plan.scrape import store
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+
+        etag = '"v%d"' % self.server.version
+        if self.path.startswith('/etag') and \
+                self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        if self.path.startswith('/flaky') and self.server.failures:
+            self.server.failures -= 1
+            status, body = 503, 'unavailable'
+        elif self.path.startswith('/slow/'):
+            value = int(self.path.split('/')[-1])
+            # Later items answer first to show results are kept in order.
+            time.sleep(0.01 * (10 - value))
+            status, body = 200, str(value)
+        else:
+            status, body = 200, 'ok'
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(TIMETABLE_SCRAPE_BACKOFF=0.01,
+                   TIMETABLE_SCRAPE_RATE_LIMIT=None)
+class FetchTestCase(BaseTestCase):
+    def setUp(self):
+        super(FetchTestCase, self).setUp()
+        store.responses.clear()
+
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.version = 1
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(FetchTestCase, self).tearDown()
+
+    def test_get_cached(self):
+        url = self.base_url + '/page'
+        self.assertEquals('ok', fetch.get(url))
+        self.assertEquals('ok', fetch.get(url))
+        self.assertEquals(['/page'], self.server.requests)
+
+    def test_get_not_cached(self):
+        url = self.base_url + '/page'
+        fetch.get(url)
+        fetch.get(url, cache=False)
+        self.assertEquals(['/page', '/page'], self.server.requests)
+
+    def test_get_revalidated(self):
+        url = self.base_url + '/etag'
+        with self.settings(TIMETABLE_SCRAPE_TTL=0):
+            self.assertEquals('ok', fetch.get(url))
+            self.assertEquals('ok', fetch.get(url))
+            self.assertEquals(2, len(self.server.requests))
+
+            self.server.version = 2
+            self.assertEquals('ok', fetch.get(url))
+            self.assertEquals('"v2"', store.responses.get('get||' + url).etag)
+
+    def test_get_ttls(self):
+        ttls = [(r'/page/1$', 0)]
+        with self.settings(TIMETABLE_SCRAPE_TTLS=ttls):
+            for i in range(2):
+                fetch.get(self.base_url + '/page/1')
+                fetch.get(self.base_url + '/page/2')
+        self.assertEquals(['/page/1', '/page/2', '/page/1'],
+                          self.server.requests)
+
+    def test_store_compact(self):
+        store.responses.set('a', u'same body')
+        store.responses.set('b', u'same body')
+        store.responses.set('c', u'other body \xe6\xf8\xe5')
+        self.assertEquals((3, 2), store.responses.count())
+        self.assertEquals(u'other body \xe6\xf8\xe5',
+                          store.responses.get('c').body)
+
+        store.responses.set('c', u'same body')
+        self.assertEquals((0, 1), store.responses.compact())
+        self.assertEquals((3, 1), store.responses.count())
+
+        self.assertEquals((3, 1), store.responses.compact(max_age=-1))
+        self.assertEquals((0, 0), store.responses.count())
+
+    def test_retry(self):
+        self.server.failures = 2
+        self.assertEquals('ok', fetch.get(self.base_url + '/flaky'))
+        self.assertEquals(3, len(self.server.requests))
+
+    def test_retry_gives_up(self):
+        self.server.failures = 10
+        with self.settings(TIMETABLE_SCRAPE_RETRIES=1):
+            self.assertEquals('unavailable', fetch.get(self.base_url + '/flaky'))
+        self.assertEquals(2, len(self.server.requests))
+
+    def test_prefetch(self):
+        def get(i):
+            return fetch.get('%s/slow/%d' % (self.base_url, i))
+
+        result = list(fetch.prefetch(get, range(10), workers=4))
+        self.assertEquals([(i, str(i)) for i in range(10)], result)
+
+    def test_prefetch_error(self):
+        def fail(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+
+        results = fetch.prefetch(fail, range(10), workers=2)
+        self.assertEquals([(0, 0), (1, 1), (2, 2)],
+                          [next(results) for i in range(3)])
+        self.assertRaises(ValueError, next, results)
+
+    def test_rate_limit(self):
+        with self.settings(TIMETABLE_SCRAPE_RATE_LIMIT=50):
+            start = time.time()
+            for i in range(6):
+                fetch.get('%s/page/%d' % (self.base_url, i))
+            self.assert_(time.time() - start >= 0.1)
+
+
+class CourseScraper(base.CourseScraper):
+    def scrape(self):
+        return [
+            {'code': 'COURSE1', 'name': 'Course 1 full name', 'url': '',
+             'points': '1', 'locations': ['Trondheim']},
+            {'code': 'COURSE2', 'name': 'Course 2 new name', 'url': '',
+             'points': '1', 'locations': []},
+            {'code': 'COURSE3', 'name': 'Course 3 full name', 'url': '',
+             'points': '1', 'locations': []},
+            {'code': 'COURSE5', 'name': 'Course 5 full name', 'url': '',
+             'points': '7.5', 'locations': ['Trondheim', 'Gjovik']},
+        ]
+
 
 class DBTestCase(BaseTestCase):
-    pass
+    fixtures = ['test_data.json']
+
+    def scrape(self, batch):
+        scraper = CourseScraper(Semester.objects.get(year=2009, type='spring'))
+        scraper.batch = batch
+        scraper.run()
+
+        courses = {}
+        for c in Course.objects.filter(semester__year=2009, semester__type='spring'):
+            courses[c.code] = (c.name, c.points,
+                               sorted(l.name for l in c.locations.all()))
+        return dict(scraper.stats), courses
+
+    def test_course_scraper(self):
+        stats, courses = self.scrape(batch=True)
+
+        self.assertEquals(1, stats['created'])
+        self.assertEquals(2, stats['updated'])
+        self.assertEquals(1, stats['unaltered'])
+        self.assertEquals(1, stats['deleted'])
+
+        self.assertEquals(('Course 2 new name', 1, []), courses['COURSE2'])
+        self.assertEquals(['Trondheim'], courses['COURSE1'][2])
+        self.assertEquals(['Gjovik', 'Trondheim'], courses['COURSE5'][2])
+        self.assertNotIn('COURSE4', courses)
+
+    def test_course_scraper_syncs_fulltext(self):
+        self.scrape(batch=True)
+
+        def search(query):
+            courses = Course.objects.search(2009, 'spring', query)
+            return [c.code for c in courses]
+
+        self.assertEquals(['COURSE5'], search('cour 5'))
+        self.assertEquals(['COURSE2'], search('new'))
+        self.assertEquals([], search('course4'))
+
+    def test_course_scraper_batch_matches(self):
+        with transaction.atomic():
+            expected = self.scrape(batch=False)
+            transaction.set_rollback(True)
+
+        self.assertEquals(expected, self.scrape(batch=True))
+
+    def last_import(self, code):
+        return Course.objects.get(code=code, semester__year=2009,
+                                  semester__type='spring').last_import
+
+    def test_unchanged_rows_not_saved(self):
+        for batch in (False, True):
+            with transaction.atomic():
+                self.scrape(batch=batch)
+                self.assertEquals(datetime.datetime(2015, 9, 10),
+                                  self.last_import('COURSE3'))
+                self.assertTrue(self.last_import('COURSE2').year > 2015)
+                transaction.set_rollback(True)
+
+    def test_unchanged_rows_touched(self):
+        with self.settings(TIMETABLE_SCRAPE_TOUCH_UNCHANGED=True):
+            for batch in (False, True):
+                with transaction.atomic():
+                    self.scrape(batch=batch)
+                    self.assertTrue(self.last_import('COURSE3').year > 2015)
+                    transaction.set_rollback(True)
+
+    def test_course_scraper_rerun(self):
+        self.scrape(batch=True)
+        stats, courses = self.scrape(batch=True)
+
+        self.assertEquals(0, stats['created'])
+        self.assertEquals(0, stats['updated'])
+        self.assertEquals(4, stats['unaltered'])
+        self.assertEquals(0, stats['deleted'])
+
+    def test_save_batch_outside_queryset(self):
+        semester = Semester.objects.get(year=2009, type='spring')
+        scraper = CourseScraper(semester, 'COURSE1')
+        fields = [Course._meta.get_field(name) for name in scraper.fields]
+
+        courses = [Course(code='OTHER%d' % i, semester=semester)
+                   for i in range(3)]
+        scraper.save_batch(Course, fields, courses)
+
+        for course in courses:
+            self.assertEquals(course.code, Course.objects.get(pk=course.pk).code)
+
+
+class LectureScraperTestCase(BaseTestCase):
+    fixtures = ['test_data.json', 'test_user.json']
+
+    def setUp(self):
+        super(LectureScraperTestCase, self).setUp()
+        self.scraper = base.LectureScraper(
+            Semester.objects.get(year=2009, type='spring'))
+
+    def kwargs(self, **defaults):
+        kwargs = {
+            'course': Course.objects.get(pk=1),
+            'day': 0,
+            'start': datetime.time(8, 15),
+            'end': datetime.time(10, 0),
+            'type': LectureType.objects.get(pk=1),
+            'defaults': {
+                'groups': [Group.objects.get(pk=1)],
+                'rooms': [Room.objects.get(pk=1)],
+                'lecturers': [Lecturer.objects.get(pk=1)],
+                'weeks': [1],
+                'title': None,
+            },
+        }
+        kwargs['defaults'].update(defaults)
+        return kwargs
+
+    def test_save_matches_in_memory(self):
+        kwargs = self.kwargs()
+        self.scraper.load_lectures()
+
+        with self.assertNumQueries(0):
+            obj, created = self.scraper.save(kwargs)
+
+        self.assertEquals((2, False), (obj.pk, created))
+        self.assertEquals({}, self.scraper.update(obj, kwargs['defaults']))
+
+    def test_save_picks_best_candidate(self):
+        kwargs = self.kwargs(rooms=[], lecturers=[])
+        lecture = Lecture.objects.create(
+            course_id=1, day=0, start=datetime.time(8, 15),
+            end=datetime.time(10, 0), type_id=1, week_mask=2)
+        lecture.groups.set([Group.objects.get(pk=1)])
+        self.scraper.import_time = datetime.datetime.now()
+
+        obj, created = self.scraper.save(kwargs)
+        self.assertEquals((lecture.pk, False), (obj.pk, created))
+
+        # Lectures are only matched once per scrape.
+        obj, created = self.scraper.save(kwargs)
+        self.assertEquals((2, False), (obj.pk, created))
+
+        obj, created = self.scraper.save(kwargs)
+        self.assertTrue(created)
+
+    def test_save_external_id(self):
+        Lecture.objects.filter(pk=3).update(external_id='abc')
+        kwargs = self.kwargs(external_id='abc')
+
+        obj, created = self.scraper.save(kwargs)
+        self.assertEquals((3, False), (obj.pk, created))
+
+        changes = self.scraper.update(obj, kwargs['defaults'])
+        self.assertEquals(['end', 'groups', 'lecturers', 'rooms', 'start',
+                           'type', 'weeks'], sorted(changes))
+
+        lecture = Lecture.objects.get(pk=3)
+        self.assertEquals(datetime.time(10, 0), lecture.end)
+        self.assertEquals(1, lecture.type_id)
+        self.assertEquals([1], lecture.week_numbers)
+
+    def test_save_external_id_other_course(self):
+        def rows():
+            return sorted(SubscriptionLecture.objects.values_list(
+                'subscription', 'lecture', 'excluded'))
+
+        SubscriptionLecture.objects.refresh()
+        Lecture.objects.filter(pk=4).update(external_id='abc')
+        kwargs = self.kwargs(external_id='abc')
+
+        obj, created = self.scraper.save(kwargs)
+        changes = self.scraper.update(obj, kwargs['defaults'])
+        self.assertEquals((2, 1), tuple(c.pk for c in changes['course']))
+        self.assertEquals(set([1, 2]), self.scraper.course_ids([obj]))
+
+        courses = SubscriptionLecture.objects.filter(lecture=4).values_list(
+            'subscription__course', flat=True)
+        self.assertEquals(set([1]), set(courses))
+
+        current = rows()
+        SubscriptionLecture.objects.refresh()
+        self.assertEquals(rows(), current)
+
+    def test_save_sets_external_id(self):
+        obj, created = self.scraper.save(self.kwargs(external_id='abc'))
+        self.assertEquals((2, False), (obj.pk, created))
+
+        changes = self.scraper.update(obj, self.kwargs(external_id='abc')['defaults'])
+        self.assertEquals({'external_id': (None, 'abc')}, changes)
+
+    def test_delete_changes_last_modified(self):
+        def last_modified(slug):
+            return Subscription.objects.get_last_modified(2009, 'spring', slug)
+
+        adamcik, baz = last_modified('adamcik'), last_modified('baz')
+        self.scraper.course_prefix = 'COURSE1'
+        self.scraper.scrape = lambda: []
+        self.scraper.run()
+
+        self.assert_(self.scraper.stats['deleted'])
+        self.assertGreater(last_modified('adamcik'), adamcik)
+        # Only follows COURSE2, so nothing changed.
+        self.assertEquals(baz, last_modified('baz'))
+
+
+class LookupTestCase(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super(LookupTestCase, self).setUp()
+        self.scraper = base.LectureScraper(
+            Semester.objects.get(year=2009, type='spring'))
+
+    def test_lookup(self):
+        with self.assertNumQueries(0):
+            type1 = self.scraper.lecture_type('Type 1')
+            type2 = self.scraper.lecture_type('Type 2')
+            new = self.scraper.lecture_type('Type 4')
+            self.assertIs(type1, self.scraper.lecture_type('Type 1'))
+
+        # One select for the existing rows, one insert and one select to
+        # find the new primary key.
+        with self.assertNumQueries(3):
+            self.scraper.save_lookups()
+
+        self.assertEquals((1, 2), (type1.pk, type2.pk))
+        self.assertEquals('Type 4', LectureType.objects.get(pk=new.pk).name)
+
+        with self.assertNumQueries(0):
+            self.assertEquals(new, self.scraper.lecture_type('Type 4'))
+            self.scraper.save_lookups()
+
+    def test_lookup_defaults(self):
+        scraper = base.ExamScraper(self.scraper.semester)
+        scraper.exam_type('E', 'New name')
+        new = scraper.exam_type('N', 'Name')
+        scraper.save_lookups()
+
+        self.assertEquals('Name', ExamType.objects.get(pk=new.pk).name)
+        self.assertEquals('New name', ExamType.objects.get(code='E').name)
+
+    def test_room_upgrade(self):
+        room = self.scraper.room('R1', 'Room 1', 'http://example.com/r1')
+        self.assertEquals(1, room.pk)
+        self.assertEquals('R1', Room.objects.get(pk=1).code)
+
+        with self.assertNumQueries(0):
+            self.assertEquals(room, self.scraper.room('R1', 'Room 1', None))
+
+    def test_room_create(self):
+        room = self.scraper.room('R4', 'Room 4', None)
+        self.assertEquals(('R4', 'Room 4'), (room.code, room.name))
+
+        with self.assertNumQueries(0):
+            self.assertEquals(room, self.scraper.room('R4', 'Room 4', None))
+            self.assertEquals(room, self.scraper.room('R4', 'Other name', None))
+
+        other = self.scraper.room(None, 'Room 5', None)
+        with self.assertNumQueries(0):
+            self.assertEquals(other, self.scraper.room(None, 'Room 5', None))
+
 
 class StudwebTestCase(BaseTestCase):
     pass
@@ -105,14 +105,6 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'KEY_PREFIX': '',
     },
-    'scraper': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': os.path.join(BASE_PATH, 'cache'),
-        'TIMEOUT': 60*60*24*7,
-        'OPTIONS': {
-            'MAX_ENTRIES': 50000,
-        },
-    },
 }
 
 # -- Statifiles settings:
@@ -203,6 +195,91 @@ TIMETABLE_AJAX_LIMIT = 100
 # Max number of courses per timetable.
 TIMETABLE_MAX_COURSES = 20
 
+# Seconds to keep compiled schedules cached, entries are also replaced as soon
+# as subscriptions or scraped data changes.
+TIMETABLE_SCHEDULE_CACHE_TIMEOUT = 60*60*24
+
+# Seconds before each process reloads semesters and their locations, saving
+# semesters and scraping courses reloads them right away.
+TIMETABLE_SEMESTER_REGISTRY_TIMEOUT = 5*60
+
+# Seconds clients may cache course catalogs, urls change with the content.
+TIMETABLE_CATALOG_MAX_AGE = 60*60*24*365
+
+# Seconds before course catalogs are rebuilt to pick up new aliases, scrapes
+# trigger rebuilds right away.
+TIMETABLE_CATALOG_TIMEOUT = 60*60
+
+# Seconds before in memory course search indexes are rebuilt to pick up new
+# subscription counts, scrapes and aliases trigger rebuilds right away.
+TIMETABLE_COURSE_INDEX_TIMEOUT = 60*60
+
+# Where course queries are answered, 'index' uses an in memory index per
+# process while 'database' uses Course.objects.search, and thus the database's
+# full-text index that all processes share.
+TIMETABLE_COURSE_SEARCH = 'index'
+
+# Full-text search backends to use per database vendor, vendors that are not
+# listed use plain substring matching when searching for courses.
+TIMETABLE_FULLTEXT_BACKENDS = {
+    'sqlite': 'plan.common.fulltext.SQLiteBackend',
+    'postgresql': 'plan.common.fulltext.PostgresBackend',
+}
+
+# Seconds to keep rendered iCal feeds cached, feeds are keyed on when their
+# data last changed so updates show up right away.
+TIMETABLE_ICAL_CACHE_TIMEOUT = 60*60*24
+
+# Seconds clients may cache iCal feeds, growing from the first to the second
+# value as a semester progresses.
+TIMETABLE_ICAL_MAX_AGE = (60*60, 60*60*24)
+
+# Seconds clients may cache iCal feeds for semesters that have ended.
+TIMETABLE_ICAL_FINISHED_MAX_AGE = 60*60*24*30
+
+# Directory to write pre-generated iCal feeds to, using the same layout as
+# the feed urls so the web server can serve them directly. See the
+# publish_ical management command.
+TIMETABLE_ICAL_STATIC_ROOT = None
+
+# How to draw PDF timetables, either 'canvas' to draw directly on the page
+# or 'table' for the original platypus table based renderer. Both produce
+# the same page, the canvas renderer just gets there faster.
+TIMETABLE_PDF_RENDERER = 'canvas'
+
+# Bytes of rendered PDFs to keep in memory per process.
+TIMETABLE_PDF_CACHE_SIZE = 32*1024*1024
+
+# Directory to store rendered PDFs in so they can be shared between
+# processes, None to only keep them in memory. Run compact_pdfs regularly to
+# remove PDFs that are no longer used.
+TIMETABLE_PDF_CACHE_DIR = None
+
+# Number of requests scrapers may have in flight at the same time.
+TIMETABLE_SCRAPE_WORKERS = 4
+
+# Max number of requests per second scrapers send to each host, None for no
+# limit.
+TIMETABLE_SCRAPE_RATE_LIMIT = 10
+
+# Number of times scrapers retry failed requests, waiting twice as long as
+# last time between each attempt starting at the given number of seconds.
+TIMETABLE_SCRAPE_RETRIES = 3
+TIMETABLE_SCRAPE_BACKOFF = 0.5
+
+# SQLite file scrapers keep fetched responses in, see plan.scrape.store.
+TIMETABLE_SCRAPE_STORE = os.path.join(BASE_PATH, 'cache', 'scraper.sqlite')
+
+# Seconds fetched responses are used before asking the server if they have
+# changed. TIMETABLE_SCRAPE_TTLS is a list of (url regexp, seconds) that
+# override the default for matching urls, first match wins.
+TIMETABLE_SCRAPE_TTL = 60*60*24*7
+TIMETABLE_SCRAPE_TTLS = []
+
+# Save every row a scrape finds, not just the ones that changed. Only rows
+# that are saved get a new last_import, which feeds Last-Modified headers.
+TIMETABLE_SCRAPE_TOUCH_UNCHANGED = False
+
 # Number of courses to show on frontpage stats.
 TIMETABLE_TOP_COURSE_COUNT = 10
 
@@ -14,3 +14,5 @@ CACHES = {
         'KEY_PREFIX': 'test',
     }
 }
+
+TIMETABLE_SCRAPE_STORE = ':memory:'